@@ -0,0 +1,229 @@
+"""کلاینت و PyTgCalls جعلی برای بنچمارک بدون اتصال به تلگرام
+
+تأخیر، نرخ خطا و FloodWait هر عملیات از طریق FakeBehavior قابل تنظیم است.
+"""
+import os
+import sys
+import random
+import asyncio
+import tempfile
+import zlib
+from typing import Dict, List, Optional
+
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+
+
+class FakeBehavior:
+    """رفتار عملیات‌های جعلی: تأخیر پایه، نوسان، نرخ خطا و نرخ FloodWait"""
+    
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, failure_rate: float = 0.0,
+                 flood_rate: float = 0.0, flood_seconds: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        # تعداد فراخوانی هر عملیات
+        self.calls: Dict[str, int] = {}
+        # آیا چت‌ها ویس چت فعال دارند
+        self.group_call_active = True
+    
+    async def run(self, op: str):
+        self.calls[op] = self.calls.get(op, 0) + 1
+        delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        await asyncio.sleep(max(0.0, delay))
+        
+        roll = self.random.random()
+        if roll < self.flood_rate:
+            raise FloodWait(value=self.flood_seconds)
+        if roll < self.flood_rate + self.failure_rate:
+            raise RuntimeError(f"fake {op} failure")
+
+
+# رفتار مشترک همه نمونه‌ها؛ بنچمارک قبل از هر اجرا آن را عوض می‌کند
+behavior = FakeBehavior()
+
+
+class FakeUser:
+    def __init__(self, name: str):
+        self.id = zlib.crc32(name.encode()) % 10 ** 9
+        self.first_name = name
+        self.last_name = None
+        self.username = name
+
+
+class FakeChatType:
+    value = "supergroup"
+
+
+class FakeChat:
+    def __init__(self, username: str):
+        self.id = -1000000000000 - zlib.crc32(username.encode()) % 10 ** 9
+        self.title = f"Chat {username}"
+        self.username = username
+        self.type = FakeChatType()
+
+
+class FakeInputPeer:
+    def __init__(self, access_hash: int):
+        self.access_hash = access_hash
+
+
+class FakeStorage:
+    """جایگزین حافظه peer های pyrogram"""
+    
+    def __init__(self):
+        self.peers: Dict[int, tuple] = {}
+    
+    async def update_peers(self, peers):
+        for peer in peers:
+            self.peers[peer[0]] = peer
+    
+    async def get_peer_by_id(self, peer_id: int):
+        return FakeInputPeer(self.peers.get(peer_id, (peer_id, 1))[1])
+
+
+class FakeFullChat:
+    def __init__(self, active: bool):
+        self.full_chat = type("ChatFull", (), {"call": object() if active else None})()
+
+
+class FakeClient:
+    """جایگزین pyrogram.Client"""
+    
+    def __init__(self, name: str, api_id=None, api_hash=None, session_string=None, in_memory=True, **kwargs):
+        self.name = name
+        self.is_connected = False
+        self.me = None
+        self.storage = FakeStorage()
+    
+    async def start(self):
+        await behavior.run("client_start")
+        self.is_connected = True
+        self.me = FakeUser(self.name)
+        return self
+    
+    async def stop(self):
+        await behavior.run("client_stop")
+        self.is_connected = False
+    
+    async def get_me(self):
+        await behavior.run("get_me")
+        return FakeUser(self.name)
+    
+    async def get_chat(self, chat_id):
+        await behavior.run("get_chat")
+        chat = FakeChat(str(chat_id))
+        await self.storage.update_peers([(chat.id, 1, "supergroup", chat.username, None)])
+        return chat
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        await behavior.run("send_message")
+    
+    async def resolve_peer(self, peer_id):
+        peer = await self.storage.get_peer_by_id(peer_id)
+        return raw.types.InputPeerChannel(channel_id=abs(peer_id) % 10 ** 12, access_hash=peer.access_hash)
+    
+    async def invoke(self, query):
+        await behavior.run(type(query).__name__)
+        return FakeFullChat(behavior.group_call_active)
+
+
+class FakeStreamEnded:
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+
+
+class FakePyTgCalls:
+    """جایگزین PyTgCalls"""
+    
+    def __init__(self, client: FakeClient, **kwargs):
+        self.client = client
+        self.is_connected = False
+        self.joined = set()
+        # هندلرهای ثبت شده با دکوراتورهای on_* به تفکیک رویداد
+        self.handlers: Dict[str, List] = {}
+    
+    def _decorator(self, event: str):
+        def decorator(func):
+            self.handlers.setdefault(event, []).append(func)
+            return func
+        return decorator
+    
+    def on_kicked(self):
+        return self._decorator("kicked")
+    
+    def on_left(self):
+        return self._decorator("left")
+    
+    def on_closed_voice_chat(self):
+        return self._decorator("closed")
+    
+    def on_stream_end(self):
+        return self._decorator("stream_end")
+    
+    async def emit(self, event: str, chat_id: int):
+        """شبیه‌سازی رویداد سرور با همان آرگومان‌هایی که PyTgCalls به هندلرها می‌دهد"""
+        if event != "stream_end":
+            self.joined.discard(chat_id)
+        arg = FakeStreamEnded(chat_id) if event == "stream_end" else chat_id
+        for handler in self.handlers.get(event, []):
+            await handler(self, arg)
+    
+    async def start(self):
+        await behavior.run("call_start")
+        self.is_connected = True
+    
+    async def stop(self):
+        await behavior.run("call_stop")
+        self.is_connected = False
+    
+    async def join_group_call(self, chat_id: int, stream, invite_hash: str = None, join_as=None, stream_type=None):
+        await behavior.run("join_group_call")
+        self.joined.add(chat_id)
+    
+    async def leave_group_call(self, chat_id: int):
+        await behavior.run("leave_group_call")
+        self.joined.discard(chat_id)
+    
+    async def change_stream(self, chat_id: int, stream):
+        await behavior.run("change_stream")
+        if chat_id not in self.joined:
+            raise LookupError(f"group call {chat_id} not found")
+
+
+class ScaledAsyncio:
+    """نسخه‌ای از ماژول asyncio که sleep های ثابت ربات را با ضریب کوچک می‌کند"""
+    
+    def __init__(self, scale: float):
+        self.scale = scale
+    
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+    
+    async def sleep(self, delay, result=None):
+        return await asyncio.sleep(delay * self.scale, result)
+
+
+def load_bot(sleep_scale: float = 1.0, **env):
+    """ایمپورت bot با دیتابیس موقت و جایگزینی Client و PyTgCalls با نسخه جعلی"""
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_sessions.db"))
+    os.environ.setdefault("METRICS_PORT", "0")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    import bot
+    bot.Client = FakeClient
+    bot.PyTgCalls = FakePyTgCalls
+    if sleep_scale != 1.0:
+        bot.asyncio = ScaledAsyncio(sleep_scale)
+    return bot
+
+
+def seed_sessions(manager, count: int, prefix: str = "bench"):
+    """ثبت سشن‌های جعلی در حافظه (بدون نوشتن در دیتابیس)"""
+    for i in range(count):
+        manager.register_session(f"{prefix}{i}", "fake-session-string", "+10000000000", f"{prefix}{i}", f"{prefix}{i}")
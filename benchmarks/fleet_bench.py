@@ -0,0 +1,252 @@
+"""بنچمارک آفلاین عملیات‌های SessionManager با کلاینت‌های جعلی
+
+برای هر اندازه ناوگان، زمان کل، بیشترین RSS و تأخیر event loop هر عملیات گزارش می‌شود.
+در پایان حافظه رجیستری سشن‌ها (رکورد __slots__) با ساختار قدیمی دیکشنری‌ها مقایسه می‌شود.
+با --standby تأخیر ورود اکانت‌های استخر آماده با اکانت‌های سرد مقایسه می‌شود.
+
+اجرا:
+    python benchmarks/fleet_bench.py --sizes 10,100,1000,5000 --latency 0.05 --failure-rate 0.01
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tracemalloc
+
+import fakes
+
+OPS = ["start_all_clients", "get_status", "join_voice_chat", "leave_all_voice_chats", "stop_all_clients"]
+
+
+class LagProbe:
+    """نمونه‌برداری از تأخیر event loop در طول یک عملیات"""
+    
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+    
+    def __enter__(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+    
+    def __exit__(self, *exc):
+        self.task.cancel()
+    
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def peak_rss_mb() -> float:
+    # در لینوکس ru_maxrss بر حسب کیلوبایت است
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_op(manager, op: str, link: str):
+    if op == "join_voice_chat":
+        return await manager.join_voice_chat(link)
+    return await getattr(manager, op)()
+
+
+def count_ok(op: str, result) -> int:
+    if op == "start_all_clients":
+        return sum(1 for r in result if r["status"] == "success")
+    if op in ("join_voice_chat", "leave_all_voice_chats", "get_status"):
+        return result[1]
+    return len(result)
+
+
+def count_deferred(op: str, result) -> int:
+    """اکانت‌هایی که start_all_clients به خاطر سقف MAX_LIVE_CLIENTS وصل نکرد"""
+    if op == "start_all_clients":
+        return sum(1 for r in result if r["status"] == "deferred")
+    return 0
+
+
+async def bench_size(bot, size: int, ops, link: str):
+    manager = bot.SessionManager()
+    fakes.seed_sessions(manager, size)
+    # هر اندازه با سطل‌های توکن پر شروع می‌شود
+    bot.limiter = bot.RateLimiter()
+    rows = []
+    for op in ops:
+        with LagProbe() as probe:
+            started = time.perf_counter()
+            result = await run_op(manager, op, link)
+            wall = time.perf_counter() - started
+        rows.append({
+            "size": size,
+            "op": op,
+            "wall_s": round(wall, 4),
+            "per_s": round(size / wall, 1) if wall > 0 else None,
+            "ok": count_ok(op, result),
+            "deferred": count_deferred(op, result),
+            "lag_max_ms": round(max(probe.samples, default=0.0) * 1000, 2),
+            "lag_p99_ms": round(probe.percentile(0.99) * 1000, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1)
+        })
+    manager.storage.close()
+    return rows
+
+
+async def bench_standby(bot, size: int, standby: int, link: str):
+    """صدک‌های تأخیر ورود: اکانت‌های استخر آماده در برابر اکانت‌های سرد همان ناوگان"""
+    manager = bot.SessionManager()
+    fakes.seed_sessions(manager, size)
+    bot.limiter = bot.RateLimiter()
+    manager.standby.size = standby
+    await manager.standby.fill()
+    await manager.join_voice_chat(link)
+    rows = []
+    for path, values in sorted(manager.join_latency_samples().items()):
+        rows.append({
+            "size": size,
+            "path": path,
+            "joins": len(values),
+            "p50_ms": round(bot.percentile(values, 0.5) * 1000, 1),
+            "p95_ms": round(bot.percentile(values, 0.95) * 1000, 1),
+            "p99_ms": round(bot.percentile(values, 0.99) * 1000, 1)
+        })
+    manager.storage.close()
+    return rows
+
+
+def print_standby_rows(rows):
+    header = f"{'size':>6} {'path':<8} {'joins':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['size']:>6} {row['path']:<8} {row['joins']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+
+def measure_memory(build) -> int:
+    """حافظه اختصاص داده شده (بایت) برای ساختاری که build می‌سازد"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def bench_registry(bot, count: int, chats: int = 10):
+    """حافظه هر سشن: رجیستری جدید در برابر دیکشنری‌های جدای قبلی (sessions / active_calls / ...)"""
+    names = [f"bench{i}" for i in range(count)]
+    session_string = "x" * 350
+    
+    def registry(joined: bool):
+        def build():
+            sessions = bot.SessionRegistry()
+            for i, name in enumerate(names):
+                entry = sessions.add(name, session_string, "+10000000000")
+                if joined:
+                    sessions.join(entry, -1000 - i % chats, "chat", "silence", 0.0)
+            return sessions
+        return build
+    
+    def legacy(joined: bool):
+        def build():
+            sessions = {name: {"session_string": session_string, "phone_number": "+10000000000"} for name in names}
+            last_used = {name: 0.0 for name in names}
+            active_calls = {}
+            if joined:
+                for i, name in enumerate(names):
+                    active_calls[name] = {"chat_id": -1000 - i % chats, "chat_title": "chat", "join_time": 0.0,
+                                          "media_source": "silence"}
+            return sessions, last_used, active_calls
+        return build
+    
+    rows = []
+    for label, build in (("registry idle", registry(False)), ("legacy idle", legacy(False)),
+                         ("registry joined", registry(True)), ("legacy joined", legacy(True))):
+        used = measure_memory(build)
+        rows.append({"layout": label, "records": count, "bytes": used, "bytes_per_record": round(used / count, 1)})
+    return rows
+
+
+def print_registry_rows(rows):
+    header = f"{'layout':<16} {'records':>8} {'kib':>10} {'bytes/rec':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['layout']:<16} {row['records']:>8} {row['bytes'] / 1024:>10.1f} {row['bytes_per_record']:>10.1f}")
+
+
+def print_rows(rows):
+    header = f"{'size':>6} {'op':<22} {'wall_s':>9} {'per_s':>9} {'ok':>6} {'deferred':>8} {'lag_max_ms':>11} {'lag_p99_ms':>11} {'rss_mb':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['size']:>6} {row['op']:<22} {row['wall_s']:>9.3f} {row['per_s'] or 0:>9.1f} {row['ok']:>6} {row['deferred']:>8} "
+              f"{row['lag_max_ms']:>11.2f} {row['lag_p99_ms']:>11.2f} {row['peak_rss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,5000")
+    parser.add_argument("--ops", default=",".join(OPS))
+    parser.add_argument("--latency", type=float, default=0.05, help="تأخیر پایه هر عملیات جعلی (ثانیه)")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--sleep-scale", type=float, default=1.0, help="ضریب sleep های داخل ربات")
+    parser.add_argument("--global-rate", type=float, default=30, help="GLOBAL_RATE محدودیت نرخ (درخواست در ثانیه)")
+    parser.add_argument("--account-rate", type=float, default=1, help="ACCOUNT_RATE محدودیت نرخ (درخواست در ثانیه)")
+    parser.add_argument("--link", default="https://t.me/benchchat?videochat")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--registry-records", type=int, default=10000, help="تعداد رکورد برای مقایسه حافظه رجیستری (۰ = رد شدن)")
+    parser.add_argument("--standby", type=int, default=0, help="اندازه استخر آماده برای مقایسه تأخیر ورود (۰ = رد شدن)")
+    parser.add_argument("--max-live", type=int, help="MAX_LIVE_CLIENTS (پیش‌فرض همان مقدار ربات)")
+    parser.add_argument("--json", help="ذخیره نتایج در فایل JSON")
+    args = parser.parse_args()
+    
+    sizes = [int(size) for size in args.sizes.split(",")]
+    ops = [op for op in args.ops.split(",") if op]
+    # سقف LRU همان پیش‌فرض ربات است تا هزینه خروج کلاینت‌ها و اکانت‌های معوق هم دیده شود
+    env = {"MAX_LIVE_CLIENTS": args.max_live} if args.max_live else {}
+    bot = fakes.load_bot(args.sleep_scale, GLOBAL_RATE=args.global_rate, ACCOUNT_RATE=args.account_rate, **env)
+    fakes.behavior = fakes.FakeBehavior(args.latency, args.jitter, args.failure_rate,
+                                        args.flood_rate, args.flood_seconds, args.seed)
+    
+    print(f"📊 latency={args.latency}s failure={args.failure_rate} flood={args.flood_rate} "
+          f"global_rate={args.global_rate} account_rate={args.account_rate} max_live={bot.MAX_LIVE_CLIENTS}")
+    rows = []
+    for size in sizes:
+        size_rows = asyncio.run(bench_size(bot, size, ops, args.link))
+        print_rows(size_rows)
+        print()
+        rows.extend(size_rows)
+    
+    standby_rows = []
+    if args.standby:
+        for size in sizes:
+            standby_rows.extend(asyncio.run(bench_standby(bot, size, min(args.standby, size), args.link)))
+        print_standby_rows(standby_rows)
+        print()
+    
+    registry_rows = []
+    if args.registry_records:
+        registry_rows = bench_registry(bot, args.registry_records)
+        print_registry_rows(registry_rows)
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"operations": rows, "standby": standby_rows, "registry": registry_rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""بنچمارک چند نودی اجاره سشن‌ها روی یک دیتابیس مشترک
+
+چند پروسه نود (با کلاینت‌های جعلی) روی یک دیتابیس اجرا می‌شوند. زمان تا تقسیم کامل و بدون
+همپوشانی سشن‌ها، و زمان تقسیم دوباره بعد از کشتن یک نود (بدون آزادسازی اجاره) و بعد از
+اضافه شدن نود جدید گزارش می‌شود. بدون DATABASE_URL یک فایل SQLite موقت نقش دیتابیس مشترک
+را دارد؛ با DATABASE_URL=postgresql://... همین آزمایش روی PostgreSQL محلی اجرا می‌شود.
+
+اجرا:
+    python benchmarks/lease_bench.py --nodes 3 --sessions 1000 --heartbeat 1 --ttl 3
+"""
+import os
+import sys
+import json
+import time
+import queue
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+import fakes
+
+
+def node_main(node_id: str, env: dict, reports, stop):
+    """یک نود: اجاره سهم خودش و گزارش دوره‌ای سشن‌های رجیستری"""
+    bot = fakes.load_bot(1.0, NODE_ID=node_id, **env)
+    manager = bot.session_manager
+    
+    async def run():
+        await manager.leases.start()
+        while not stop.is_set():
+            reports.put((node_id, sorted(manager.sessions)))
+            await asyncio.sleep(0.2)
+        await manager.shutdown(5)
+    
+    asyncio.run(run())
+
+
+class Cluster:
+    def __init__(self, bot, env: dict):
+        self.bot = bot
+        self.env = env
+        self.context = multiprocessing.get_context("spawn")
+        self.reports = self.context.Queue()
+        self.nodes = {}
+        self.latest = {}
+    
+    def start(self, node_id: str):
+        stop = self.context.Event()
+        process = self.context.Process(target=node_main, args=(node_id, self.env, self.reports, stop), daemon=True)
+        process.start()
+        self.nodes[node_id] = (process, stop)
+    
+    def kill(self, node_id: str):
+        """توقف ناگهانی؛ اجاره‌ها آزاد نمی‌شوند و باید منقضی شوند"""
+        process, _ = self.nodes.pop(node_id)
+        process.kill()
+        process.join()
+        self.latest.pop(node_id, None)
+    
+    def stop_all(self):
+        for process, stop in self.nodes.values():
+            stop.set()
+        for process, _ in self.nodes.values():
+            process.join(10)
+    
+    def wait_converged(self, names, timeout: float):
+        """انتظار تا وقتی هر نود دقیقاً سهم خودش (rendezvous روی نودهای زنده) را اجرا کند؛ (ثانیه، سهم هر نود) یا None"""
+        nodes = sorted(self.nodes)
+        expected = {node: set() for node in nodes}
+        for name in names:
+            expected[self.bot.lease_owner(name, nodes)].add(name)
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            try:
+                node_id, names = self.reports.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if node_id not in self.nodes:
+                continue
+            self.latest[node_id] = names
+            if len(self.latest) < len(self.nodes):
+                continue
+            if all(set(self.latest[node]) == expected[node] for node in nodes):
+                return time.perf_counter() - started, {node: len(expected[node]) for node in nodes}
+        return None
+
+
+def seed(bot, count: int):
+    records = [
+        {"name": f"lease{i}", "session_string": "fake-session-string", "phone_number": "+10000000000",
+         "first_name": f"lease{i}", "username": f"lease{i}", "user_id": i}
+        for i in range(count)
+    ]
+    bot.session_manager.storage.run_sync(bot.session_manager.storage._save_sessions, records)
+    return [record["name"] for record in records]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--heartbeat", type=float, default=1, help="LEASE_HEARTBEAT (ثانیه)")
+    parser.add_argument("--ttl", type=float, default=3, help="LEASE_TTL (ثانیه)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="ذخیره نتایج در فایل JSON")
+    args = parser.parse_args()
+    
+    env = {
+        "DB_PATH": os.environ.get("DB_PATH") or os.path.join(tempfile.mkdtemp(), "lease_bench.db"),
+        "DATABASE_URL": os.environ.get("DATABASE_URL", ""),
+        "LEASE_HEARTBEAT": args.heartbeat,
+        "LEASE_TTL": args.ttl,
+        "STANDBY_SIZE": 0
+    }
+    bot = fakes.load_bot(1.0, **env)
+    names = seed(bot, args.sessions)
+    print(f"📊 {bot.session_manager.storage.backend.label}: {args.sessions} سشن، heartbeat={args.heartbeat}s ttl={args.ttl}s")
+    
+    cluster = Cluster(bot, env)
+    rows = []
+    
+    def phase(label: str):
+        result = cluster.wait_converged(names, args.timeout)
+        if result is None:
+            print(f"{label:<24} ❌ در {args.timeout:.0f} ثانیه تقسیم نشد")
+            rows.append({"phase": label, "seconds": None, "shares": None})
+            return
+        seconds, counts = result
+        shares = [counts[node] for node in sorted(counts)]
+        print(f"{label:<24} {seconds:>7.2f}s  سهم نودها: {shares}")
+        rows.append({"phase": label, "seconds": round(seconds, 3), "shares": shares})
+    
+    try:
+        for i in range(args.nodes):
+            cluster.start(f"node{i}")
+        phase(f"start {args.nodes} nodes")
+        
+        cluster.kill("node0")
+        phase("kill node0")
+        
+        cluster.start(f"node{args.nodes}")
+        phase(f"add node{args.nodes}")
+    finally:
+        cluster.stop_all()
+    
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
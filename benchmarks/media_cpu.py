@@ -0,0 +1,123 @@
+"""مقایسه مصرف CPU به ازای هر اکانت: لینک راه دور (ffmpeg) در برابر فایل سکوت محلی
+
+هر دو منبع با یک خواننده یکسان (فریم‌های ۲۰ میلی‌ثانیه‌ای با سرعت واقعی، مانند tgcalls) مصرف
+می‌شوند و CPU همین پروسه و فرزندانش (ffmpeg) شمرده می‌شود. فقط هزینه تولید PCM سنجیده می‌شود؛
+کدگذاری Opus و ارسال در tgcalls برای هر دو یکسان است و در این اعداد نیست.
+
+اجرا:
+    python benchmarks/media_cpu.py --accounts 20 --seconds 30 --source both
+"""
+import os
+import sys
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+
+# دیتابیس موقت تا ایمپورت bot به دیتابیس اصلی دست نزند
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_sessions.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+FRAME_MS = 20
+FRAME_BYTES = bot.PCM_BYTES_PER_SECOND * FRAME_MS // 1000
+
+
+def cpu_seconds(who) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _consume(read, seconds: float):
+    """خواندن PCM با سرعت واقعی (فریم‌های ۲۰ میلی‌ثانیه‌ای) مانند tgcalls؛ برای هر دو منبع یکسان"""
+    for _ in range(int(seconds * 1000 / FRAME_MS)):
+        await read()
+        await asyncio.sleep(FRAME_MS / 1000)
+
+
+async def _stream_remote(url: str, seconds: float):
+    """همان فرمان ffmpeg که AudioPiped (ffmpeg_reader در py-tgcalls 0.9.7) اجرا می‌کند؛ خروجی از pipe خوانده می‌شود
+    
+    مثل خود tgcalls بدون -re؛ سرعت را خواننده و پر شدن pipe تعیین می‌کند
+    """
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-i", url,
+        "-f", "s16le", "-ac", "1", "-ar", "48000", "pipe:1",
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    
+    async def read():
+        try:
+            await process.stdout.readexactly(FRAME_BYTES)
+        except asyncio.IncompleteReadError:
+            pass
+    
+    try:
+        await _consume(read, seconds)
+    finally:
+        process.terminate()
+        # wait تا بسته شدن pipe منتظر می‌ماند؛ باقی خروجی خوانده و دور ریخته می‌شود
+        await process.communicate()
+
+
+async def _stream_silence(path: str, seconds: float):
+    """خواندن فایل سکوت مشترک و شروع دوباره از ابتدا در پایان فایل (مانند پخش حلقه‌ای ربات)"""
+    with open(path, "rb") as f:
+        async def read():
+            if not f.read(FRAME_BYTES):
+                f.seek(0)
+        
+        await _consume(read, seconds)
+
+
+def measure(streams) -> float:
+    """اجرای همزمان استریم‌ها؛ خروجی: CPU ثانیه مصرفی این پروسه و فرزندانش"""
+    before = cpu_seconds(resource.RUSAGE_SELF) + cpu_seconds(resource.RUSAGE_CHILDREN)
+    
+    async def run():
+        await asyncio.gather(*streams())
+    
+    asyncio.run(run())
+    return cpu_seconds(resource.RUSAGE_SELF) + cpu_seconds(resource.RUSAGE_CHILDREN) - before
+
+
+def bench_remote(accounts: int, seconds: float, url: str) -> float:
+    """یک ffmpeg برای هر اکانت"""
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg نصب نیست")
+    return measure(lambda: (_stream_remote(url, seconds) for _ in range(accounts)))
+
+
+def bench_silence(accounts: int, seconds: float) -> float:
+    """همه اکانت‌ها یک فایل سکوت مشترک را می‌خوانند"""
+    path = bot.ensure_silence_file()
+    return measure(lambda: (_stream_silence(path, seconds) for _ in range(accounts)))
+
+
+def report(label: str, cpu: float, accounts: int, seconds: float):
+    per_account = cpu / accounts / seconds * 100
+    print(f"{label:<10} CPU تولید PCM: {cpu:7.2f}s | به ازای هر اکانت: {per_account:6.2f}% از یک هسته")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--source", choices=["remote", "silence", "both"], default="both")
+    parser.add_argument("--url", default=bot.REMOTE_SAMPLE_URL)
+    args = parser.parse_args()
+    
+    print(f"📊 {args.accounts} اکانت، {args.seconds:.0f} ثانیه")
+    if args.source in ("silence", "both"):
+        report("silence", bench_silence(args.accounts, args.seconds), args.accounts, args.seconds)
+    if args.source in ("remote", "both"):
+        try:
+            report("remote", bench_remote(args.accounts, args.seconds, args.url), args.accounts, args.seconds)
+        except RuntimeError as e:
+            print(f"remote     ❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
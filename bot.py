@@ -1,20 +1,45 @@
 import os
+import io
 import asyncio
 import re
 import json
+import random
+import signal
 import sqlite3
 import base64
-from typing import Dict, List, Optional
-from pyrogram import Client, filters
+import csv
+import time
+import zlib
+import tempfile
+import multiprocessing
+import functools
+import hashlib
+import inspect
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple, Union
+
+# زمان شروع پروسه برای گزارش زمان‌بندی راه‌اندازی
+BOOT_STARTED = time.perf_counter()
+
+from pyrogram import Client, filters, raw
 from pyrogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from pyrogram.errors import (
     SessionPasswordNeeded, PhoneCodeInvalid, PhoneNumberInvalid, 
-    PhoneCodeExpired, ApiIdInvalid
+    PhoneCodeExpired, ApiIdInvalid, FloodWait, Forbidden,
+    ChatAdminRequired, ChannelPrivate, ChannelInvalid, InternalServerError,
+    Unauthorized, UserBannedInChannel, UsernameNotOccupied, UsernameInvalid, PeerIdInvalid
 )
-from pytgcalls import PyTgCalls
-from pytgcalls.types import Update
-from pytgcalls.types.input_stream import AudioPiped, AudioVideoPiped
-from pytgcalls.types.input_stream.quality import HighQualityAudio, HighQualityVideo
+
+if TYPE_CHECKING:
+    from aiohttp import web
+    from pytgcalls import PyTgCalls
+    from pytgcalls.types.input_stream import InputStream
+else:
+    # pytgcalls سنگین است و فقط برای ویس چت لازم است؛ در load_voice_backend ایمپورت می‌شود
+    PyTgCalls = None
 
 # ==================== تنظیمات ====================
 API_ID = int(os.environ.get("API_ID", 23726943))
@@ -22,19 +47,561 @@ API_HASH = os.environ.get("API_HASH", "1dcb583a80fe61341fd3c2e25b313d61")
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "8545444149:AAGfQS-tDBIHSPRXKT6LfmIrv3Llv8Ohamc")
 OWNER_ID = int(os.environ.get("OWNER_ID", 7542685645))
 
+# تنظیمات راه‌اندازی همزمان اکانت‌ها
+START_CONCURRENCY = int(os.environ.get("START_CONCURRENCY", 20))
+START_TIMEOUT = float(os.environ.get("START_TIMEOUT", 60))
+FLOOD_WAIT_RETRIES = int(os.environ.get("FLOOD_WAIT_RETRIES", 3))
+
+# خروج و توقف همزمان اکانت‌ها؛ هر سشن حداکثر STOP_TIMEOUT ثانیه
+STOP_CONCURRENCY = int(os.environ.get("STOP_CONCURRENCY", 50))
+STOP_TIMEOUT = float(os.environ.get("STOP_TIMEOUT", 10))
+# مهلت کل خاموشی بعد از SIGTERM (باید کمتر از مهلت Railway باشد)
+SHUTDOWN_DEADLINE = float(os.environ.get("SHUTDOWN_DEADLINE", 20))
+
+# محدودیت نرخ درخواست‌های MTProto (درخواست در ثانیه)؛ هر FloodWait نرخ را کم می‌کند و موفقیت‌ها آن را برمی‌گردانند
+GLOBAL_RATE = float(os.environ.get("GLOBAL_RATE", 30))
+GLOBAL_BURST = float(os.environ.get("GLOBAL_BURST", 30))
+ACCOUNT_RATE = float(os.environ.get("ACCOUNT_RATE", 1))
+ACCOUNT_BURST = float(os.environ.get("ACCOUNT_BURST", 5))
+FLOOD_BACKOFF = float(os.environ.get("FLOOD_BACKOFF", 0.5))
+RATE_RECOVERY = float(os.environ.get("RATE_RECOVERY", 0.05))
+MIN_RATE_FRACTION = float(os.environ.get("MIN_RATE_FRACTION", 0.1))
+# FloodWait طولانی‌تر از این مقدار (ثانیه) صبر نمی‌شود و خطا برگردانده می‌شود
+FLOOD_WAIT_MAX = float(os.environ.get("FLOOD_WAIT_MAX", 120))
+
+# تکرار ورود به ویس چت فقط برای خطاهای گذرا، با backoff نمایی
+JOIN_RETRIES = int(os.environ.get("JOIN_RETRIES", 2))
+JOIN_RETRY_BASE = float(os.environ.get("JOIN_RETRY_BASE", 1))
+JOIN_RETRY_MAX = float(os.environ.get("JOIN_RETRY_MAX", 10))
+# بعد از این تعداد خطای سراسری پشت سر هم در یک چت، بقیه اکانت‌ها تا پایان مهلت تلاش نمی‌کنند
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", 3))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 60))
+
+# تنظیمات نگهداری کلاینت‌های زنده (LRU)
+MAX_LIVE_CLIENTS = int(os.environ.get("MAX_LIVE_CLIENTS", 200))
+CLIENT_IDLE_TTL = float(os.environ.get("CLIENT_IDLE_TTL", 900))
+
+# تنظیمات کش هویت اکانت‌ها (ثانیه)
+IDENTITY_TTL = float(os.environ.get("IDENTITY_TTL", 6 * 3600))
+IDENTITY_REFRESH_INTERVAL = float(os.environ.get("IDENTITY_REFRESH_INTERVAL", 600))
+
+# عمر کش وضعیت ویس چت هر چت (مشترک بین همه اکانت‌ها، ثانیه)
+GROUP_CALL_TTL = float(os.environ.get("GROUP_CALL_TTL", 30))
+# «ویس چت فعال نیست» کوتاه‌تر کش می‌شود تا بعد از شروع ویس چت زود دوباره بررسی شود
+GROUP_CALL_NEGATIVE_TTL = float(os.environ.get("GROUP_CALL_NEGATIVE_TTL", 5))
+
+# پایش سلامت اکانت‌ها در پس‌زمینه (فاصله بررسی، سقف بررسی همزمان و تایم‌اوت هر بررسی)
+HEALTH_INTERVAL = float(os.environ.get("HEALTH_INTERVAL", 60))
+HEALTH_CONCURRENCY = int(os.environ.get("HEALTH_CONCURRENCY", 10))
+HEALTH_PROBE_TIMEOUT = float(os.environ.get("HEALTH_PROBE_TIMEOUT", 10))
+
+# استخر اکانت‌های آماده: همیشه متصل و با PyTgCalls راه‌اندازی شده تا ورود به ویس چت اتصال سرد نداشته باشد
+STANDBY_SIZE = int(os.environ.get("STANDBY_SIZE", 10))
+STANDBY_INTERVAL = float(os.environ.get("STANDBY_INTERVAL", 15))
+STANDBY_BACKOFF_MAX = float(os.environ.get("STANDBY_BACKOFF_MAX", 300))
+# تعداد نمونه‌های اخیر تأخیر ورود برای محاسبه صدک‌ها
+JOIN_LATENCY_SAMPLES = int(os.environ.get("JOIN_LATENCY_SAMPLES", 500))
+
+# تعداد پروسه‌های کاری برای پخش سشن‌ها بین هسته‌های CPU (۱ = همه در همین پروسه)
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", 1))
+SHARD_START_TIMEOUT = float(os.environ.get("SHARD_START_TIMEOUT", 60))
+
+# اندپوینت /metrics برای Prometheus (۰ = غیرفعال)؛ پروسه‌های کاری روی پورت‌های بعدی گوش می‌دهند
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", 0.5))
+
+# ورود و خروجی گروهی سشن‌ها با فایل JSON/CSV
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", 10))
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 5 * 1024 * 1024))
+EXPORT_BATCH = int(os.environ.get("EXPORT_BATCH", 500))
+
+# کارهای پس‌زمینه (راه‌اندازی، توقف، ورود و خروج)
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 1))
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", 20))
+# فاصله ویرایش پیام وضعیت کارها (ثانیه) و سقف طول پیام تلگرام (واحد UTF-16)
+STATUS_EDIT_INTERVAL = float(os.environ.get("STATUS_EDIT_INTERVAL", 3))
+MESSAGE_LIMIT = 4096
+
 # تنظیم مسیر دیتابیس برای Railway
-DB_PATH = "/tmp/sessions.db" if "RAILWAY_ENVIRONMENT" in os.environ else "sessions.db"
+# با DB_PATH می‌توان دیتابیس (و کش چت‌ها) را روی یک Volume ماندگار گذاشت؛ Railway پوشه /tmp را پاک می‌کند
+DB_PATH = os.environ.get("DB_PATH") or ("/tmp/sessions.db" if "RAILWAY_ENVIRONMENT" in os.environ else "sessions.db")
+# دیتابیس مشترک چند نود (postgresql://...)؛ خالی یعنی SQLite روی DB_PATH
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+
+# اجرای چند نود روی یک دیتابیس: هر نود با NODE_ID یکتا فقط سشن‌هایی را اجرا می‌کند که اجاره‌شان را دارد
+NODE_ID = os.environ.get("NODE_ID") or os.environ.get("RAILWAY_REPLICA_ID", "")
+LEASE_TTL = float(os.environ.get("LEASE_TTL", 30))
+LEASE_HEARTBEAT = float(os.environ.get("LEASE_HEARTBEAT", 10))
+# فقط نودی که اجاره کنترل را دارد ربات (BOT_TOKEN) را اجرا می‌کند و فرمان‌ها را از راه دیتابیس به همه نودها می‌فرستد
+COMMAND_POLL = float(os.environ.get("COMMAND_POLL", 1))
+COMMAND_TIMEOUT = float(os.environ.get("COMMAND_TIMEOUT", 900))
+
+# منبع صدای ویس چت: "silence" (فایل PCM خام محلی و مشترک که حلقه‌ای پخش می‌شود)، فایل .raw/.pcm یا هر مسیر/لینک دیگر (با ffmpeg)
+REMOTE_SAMPLE_URL = "http://docs.evostream.com/sample_content/assets/sintel1m720p.mp4"
+MEDIA_SOURCE = os.environ.get("MEDIA_SOURCE", "silence")
+SILENCE_PATH = os.environ.get("SILENCE_PATH") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "silence.raw")
+SILENCE_SECONDS = int(os.environ.get("SILENCE_SECONDS", 30))
+# PCM16LE، ۴۸ کیلوهرتز، مونو؛ همان فرمتی که InputAudioStream/AudioPiped در py-tgcalls می‌خوانند (ffmpeg -ac 1)
+PCM_BYTES_PER_SECOND = 48000 * 2
+
+# حلقه رویداد uvloop (در صورت نصب بودن)
+USE_UVLOOP = os.environ.get("USE_UVLOOP", "0") == "1"
+
+if USE_UVLOOP:
+    # باید قبل از ساخت Client انجام شود چون pyrogram حلقه را هنگام ساخت می‌گیرد
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        print("⚠️ uvloop نصب نیست؛ از event loop پیش‌فرض استفاده می‌شود")
+        USE_UVLOOP = False
+
+# ==================== منبع صدا ====================
+def ensure_silence_file(path: str = SILENCE_PATH, seconds: int = SILENCE_SECONDS) -> str:
+    """ساخت فایل سکوت PCM خام فقط یک بار؛ همه کال‌ها از همین فایل استفاده می‌کنند"""
+    size = seconds * PCM_BYTES_PER_SECOND
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        return path
+    
+    chunk = bytes(PCM_BYTES_PER_SECOND)
+    with open(path + ".tmp", "wb") as f:
+        for _ in range(seconds):
+            f.write(chunk)
+    os.replace(path + ".tmp", path)
+    print(f"🔇 فایل سکوت ساخته شد: {path} ({seconds} ثانیه)")
+    return path
+
+def load_voice_backend():
+    """ایمپورت pytgcalls در اولین نیاز یا در پس‌زمینه بعد از اتصال ربات"""
+    global PyTgCalls
+    if PyTgCalls is None:
+        from pytgcalls import PyTgCalls as backend
+        PyTgCalls = backend
+    return PyTgCalls
+
+def build_media_stream(source: Optional[str] = None) -> "InputStream":
+    """ساخت استریم ورودی ویس چت؛ فایل‌های PCM خام بدون ffmpeg پخش می‌شوند"""
+    from pytgcalls.types.input_stream import AudioPiped, InputStream, InputAudioStream
+    from pytgcalls.types.input_stream.quality import HighQualityAudio
+    
+    source = source or MEDIA_SOURCE
+    if source == "silence":
+        return InputStream(InputAudioStream(ensure_silence_file(), HighQualityAudio()))
+    if source.endswith((".raw", ".pcm")):
+        return InputStream(InputAudioStream(source, HighQualityAudio()))
+    return AudioPiped(source, HighQualityAudio())
+
+# ==================== متریک‌ها ====================
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_HELP = {
+    "bot_operation_duration_seconds": ("histogram", "مدت عملیات‌های تلگرام و ویس چت"),
+    "bot_operation_total": ("counter", "تعداد عملیات‌ها به تفکیک نتیجه"),
+    "bot_operation_errors_total": ("counter", "خطاهای عملیات‌ها به تفکیک نوع استثنا"),
+    "bot_event_loop_lag_seconds": ("histogram", "تأخیر event loop"),
+    "bot_event_loop_lag_last_seconds": ("gauge", "آخرین تأخیر اندازه‌گیری شده event loop"),
+    "bot_live_clients": ("gauge", "کلاینت‌های ساخته شده در LRU"),
+    "bot_connected_clients": ("gauge", "کلاینت‌های متصل"),
+    "bot_connected_calls": ("gauge", "PyTgCalls های متصل"),
+    "bot_active_calls": ("gauge", "عضویت‌های فعال ویس چت (اکانت × چت)"),
+    "bot_flood_wait_total": ("counter", "تعداد FloodWait های دریافتی"),
+    "bot_flood_wait_seconds_total": ("counter", "مجموع زمان FloodWait های دریافتی"),
+    "bot_rate_limit_wait_seconds": ("histogram", "زمان انتظار برای توکن محدودیت نرخ"),
+    "bot_rate_limit_global_rate": ("gauge", "نرخ فعلی سطل توکن سراسری (درخواست در ثانیه)"),
+    "bot_single_flight_joined_total": ("counter", "درخواست‌های تکراری که به عملیات در حال اجرا متصل شدند"),
+    "bot_group_call_lookups_total": ("counter", "بررسی وضعیت ویس چت (hit = از کش، miss = درخواست به تلگرام)"),
+    "bot_join_failures_total": ("counter", "خطاهای ورود به ویس چت به تفکیک دسته"),
+    "bot_join_retries_total": ("counter", "تلاش‌های دوباره ورود بعد از خطای گذرا"),
+    "bot_circuit_open_total": ("counter", "دفعات باز شدن مدار یک ویس چت"),
+    "bot_circuit_open_chats": ("gauge", "ویس چت‌هایی که مدارشان الان باز است"),
+    "bot_call_events_total": ("counter", "رویدادهای PyTgCalls (اخراج، ترک گروه، بسته شدن کال، پایان پخش)؛ تفکیک هر چت در خلاصه چت‌های صفحه وضعیت"),
+    "bot_join_latency_seconds": ("histogram", "تأخیر ورود هر اکانت به ویس چت (standby = اتصال آماده، cold = اتصال سرد)"),
+    "bot_standby_ready": ("gauge", "اکانت‌های آماده در استخر standby"),
+    "bot_leased_sessions": ("gauge", "سشن‌هایی که اجاره‌شان دست این نود است"),
+    "bot_live_nodes": ("gauge", "نودهای زنده روی دیتابیس مشترک"),
+    "bot_lease_handoffs_total": ("counter", "سشن‌هایی که به نود دیگر تحویل داده یا از دست رفتند")
+}
+
+def _escape_label(value) -> str:
+    """escape مقدار لیبل طبق فرمت متنی Prometheus"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+class Metrics:
+    """شمارنده، هیستوگرام و گیج در حافظه با خروجی متنی Prometheus"""
+    
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        # هر هیستوگرام: [شمارش هر باکت..., مجموع, تعداد]
+        self.histograms: Dict[Tuple[str, Tuple], List[float]] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.last_loop_lag = 0.0
+        self.lag_task: Optional[asyncio.Task] = None
+        self.runner: Optional["web.AppRunner"] = None
+    
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1.0):
+        key = (name, tuple(sorted((labels or {}).items())))
+        self.counters[key] = self.counters.get(key, 0.0) + value
+    
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+    
+    def gauge(self, name: str, func: Callable[[], float]):
+        """ثبت گیجی که مقدارش هنگام درخواست /metrics خوانده می‌شود"""
+        self.gauges[name] = func
+    
+    @asynccontextmanager
+    async def track(self, op: str):
+        """اندازه‌گیری مدت و نتیجه یک عملیات"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.inc("bot_operation_total", {"op": op, "result": "error"})
+            self.inc("bot_operation_errors_total", {"op": op, "error": type(e).__name__})
+            raise
+        else:
+            self.inc("bot_operation_total", {"op": op, "result": "success"})
+        finally:
+            self.observe("bot_operation_duration_seconds", time.perf_counter() - started, {"op": op})
+    
+    def render(self) -> str:
+        """خروجی با فرمت متنی Prometheus"""
+        lines = []
+        described = set()
+        
+        def describe(name):
+            if name not in described and name in METRIC_HELP:
+                kind, help_text = METRIC_HELP[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+        
+        for (name, labels), value in sorted(self.counters.items()):
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            describe(name)
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            describe(name)
+            lines.append(f"{name} {value}")
+        
+        return "\n".join(lines) + "\n"
+    
+    async def _monitor_loop_lag(self):
+        """اندازه‌گیری دیرکرد بیدار شدن از sleep به عنوان تأخیر event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.last_loop_lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+            self.observe("bot_event_loop_lag_seconds", self.last_loop_lag)
+    
+    async def _handle_metrics(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+    
+    async def start(self, stats: Callable[[], Dict[str, int]], port: int = METRICS_PORT):
+        """ثبت گیج‌ها، پایش event loop و راه‌اندازی سرور /metrics"""
+        self.gauge("bot_event_loop_lag_last_seconds", lambda: self.last_loop_lag)
+        for key in ("live_clients", "connected_clients", "connected_calls", "active_calls"):
+            self.gauge(f"bot_{key}", lambda key=key: stats()[key])
+        
+        if self.lag_task is None or self.lag_task.done():
+            self.lag_task = asyncio.create_task(self._monitor_loop_lag())
+        
+        if not port:
+            return
+        from aiohttp import web
+        application = web.Application()
+        application.router.add_get("/metrics", self._handle_metrics)
+        self.runner = web.AppRunner(application)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, METRICS_HOST, port).start()
+            print(f"📈 متریک‌ها: http://{METRICS_HOST}:{port}/metrics")
+        except OSError as e:
+            print(f"❌ خطا در راه‌اندازی سرور متریک روی پورت {port}: {e}")
+
+metrics = Metrics()
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+class LatencySamples:
+    """نمونه‌های اخیر تأخیر به تفکیک مسیر برای گزارش صدک‌ها"""
+    
+    def __init__(self, name: str, size: int = JOIN_LATENCY_SAMPLES):
+        self.name = name
+        self.size = size
+        self.samples: Dict[str, deque] = {}
+    
+    def add(self, path: str, seconds: float):
+        self.samples.setdefault(path, deque(maxlen=self.size)).append(seconds)
+        metrics.observe(self.name, seconds, {"path": path})
+    
+    def export(self) -> Dict[str, List[float]]:
+        """نمونه‌ها به صورت قابل ارسال (برای ادغام بین شاردها)"""
+        return {path: [round(value, 4) for value in values] for path, values in self.samples.items()}
+
+def format_latency(samples: Dict[str, List[float]]) -> str:
+    """خلاصه p50/p95/p99 هر مسیر به میلی‌ثانیه"""
+    lines = []
+    for path in sorted(samples):
+        values = samples[path]
+        if values:
+            lines.append(
+                f"• {path}: p50 {percentile(values, 0.5) * 1000:.0f}ms | "
+                f"p95 {percentile(values, 0.95) * 1000:.0f}ms | "
+                f"p99 {percentile(values, 0.99) * 1000:.0f}ms ({len(values)} نمونه)"
+            )
+    return "\n".join(lines)
+
+# ==================== زمان‌بندی راه‌اندازی ====================
+class BootTimer:
+    """ثبت مدت هر مرحله راه‌اندازی و لحظه‌های کلیدی از شروع پروسه"""
+    
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: List[Tuple[str, float]] = []
+        self.milestones: List[Tuple[str, float]] = []
+    
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+    
+    def mark(self, name: str) -> float:
+        """ثبت زمان سپری شده از شروع پروسه تا این لحظه"""
+        elapsed = time.perf_counter() - self.started
+        self.milestones.append((name, elapsed))
+        return elapsed
+    
+    def report(self) -> str:
+        lines = ["⏱ زمان‌بندی راه‌اندازی:"]
+        lines += [f"  • {name}: {elapsed:.3f}s" for name, elapsed in self.phases]
+        lines += [f"  ⏩ {name}: {elapsed:.3f}s از شروع" for name, elapsed in self.milestones]
+        return "\n".join(lines)
+
+boot = BootTimer(BOOT_STARTED)
 
 # ==================== مدیریت دیتابیس سشن‌ها ====================
+class SQLiteBackend:
+    """دیتابیس پیش‌فرض؛ دستورات SessionStorage به گویش SQLite نوشته شده‌اند"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.label = f"SQLite ({path})"
+    
+    def connect(self, keys: Dict[str, Tuple[str, ...]]):
+        # timeout برای وقتی چند پروسه (نود محلی) روی یک فایل می‌نویسند
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def columns(self, conn, table: str) -> List[Tuple[str, int]]:
+        """(نام ستون، ترتیب در کلید اصلی یا ۰) برای هر ستون جدول"""
+        return [(row[1], row[5]) for row in conn.execute(f'PRAGMA table_info({table})')]
+
+class PostgresConnection:
+    """رابط sqlite3 روی psycopg تا SessionStorage بدون تغییر روی PostgreSQL کار کند
+    
+    placeholder ها به %s، INSERT OR REPLACE به ON CONFLICT ... DO UPDATE و نوع‌های
+    INTEGER / REAL به BIGINT / DOUBLE PRECISION (شناسه‌های تلگرام و زمان‌ها) تبدیل می‌شوند.
+    """
+    
+    UPSERT = re.compile(r"\s*INSERT OR REPLACE INTO (\w+) \(([^)]*)\)(.*)", re.S)
+    # رشته‌ها، شناسه‌های داخل "" و توضیحات دست‌نخورده می‌مانند؛ فقط ? بیرون از آن‌ها placeholder است
+    PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\?", re.S)
+    
+    def __init__(self, conn, keys: Dict[str, Tuple[str, ...]]):
+        self.conn = conn
+        self.keys = keys
+        self.translated: Dict[str, str] = {}
+        self.transactions: List = []
+    
+    def translate(self, sql: str) -> str:
+        result = self.translated.get(sql)
+        if result is None:
+            # psycopg هر % متن را شروع placeholder می‌داند
+            result = self.PLACEHOLDER.sub(
+                lambda match: "%s" if match.group(0) == "?" else match.group(0), sql.replace("%", "%%")
+            )
+            match = self.UPSERT.match(result)
+            if match:
+                table, columns, rest = match.groups()
+                keys = self.keys[table]
+                updates = ", ".join(
+                    f"{column} = EXCLUDED.{column}" for column in (c.strip() for c in columns.split(",")) if column not in keys
+                )
+                result = f"INSERT INTO {table} ({columns}){rest} ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+            if result.lstrip().upper().startswith(("CREATE TABLE", "ALTER TABLE")):
+                result = re.sub(r"\bINTEGER\b", "BIGINT", result)
+                result = re.sub(r"\bREAL\b", "DOUBLE PRECISION", result)
+            self.translated[sql] = result
+        return result
+    
+    def execute(self, sql: str, params=()):
+        return self.conn.execute(self.translate(sql), params)
+    
+    def executemany(self, sql: str, rows):
+        with self.conn.cursor() as cursor:
+            cursor.executemany(self.translate(sql), rows)
+    
+    def commit(self):
+        pass
+    
+    def close(self):
+        self.conn.close()
+    
+    def __enter__(self):
+        transaction = self.conn.transaction()
+        transaction.__enter__()
+        self.transactions.append(transaction)
+        return self
+    
+    def __exit__(self, *exc):
+        return self.transactions.pop().__exit__(*exc)
+
+class PostgresBackend:
+    """دیتابیس مشترک برای چند نود (نیاز به پکیج اختیاری psycopg)"""
+    
+    def __init__(self, url: str):
+        self.url = url
+        self.label = "PostgreSQL"
+    
+    def connect(self, keys: Dict[str, Tuple[str, ...]]):
+        try:
+            import psycopg
+        except ImportError:
+            raise RuntimeError("برای DATABASE_URL پستگرس پکیج psycopg لازم است (pip install psycopg)")
+        # هر دستور جدا commit می‌شود؛ تراکنش‌ها با with conn باز می‌شوند
+        return PostgresConnection(psycopg.connect(self.url, autocommit=True), keys)
+    
+    def columns(self, conn, table: str) -> List[Tuple[str, int]]:
+        rows = conn.execute(
+            "SELECT c.column_name, COALESCE(k.ordinal_position, 0) FROM information_schema.columns c "
+            "LEFT JOIN information_schema.key_column_usage k ON k.table_name = c.table_name AND k.column_name = c.column_name "
+            "AND k.constraint_name = (SELECT constraint_name FROM information_schema.table_constraints "
+            "WHERE table_name = ? AND constraint_type = 'PRIMARY KEY' AND table_schema = current_schema()) "
+            "WHERE c.table_name = ? AND c.table_schema = current_schema() ORDER BY c.ordinal_position",
+            (table, table)
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+def open_backend(url: str = DATABASE_URL, path: str = DB_PATH):
+    """انتخاب دیتابیس از روی DATABASE_URL"""
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(url)
+    return SQLiteBackend(url.split("sqlite:///", 1)[-1] if url else path)
+
 class SessionStorage:
-    def __init__(self):
-        self.db_path = DB_PATH
-        self.init_database()
+    """دسترسی به دیتابیس با یک اتصال دائمی (WAL) روی یک ترد جداگانه"""
+    
+    # دستورات ثابت تا sqlite3 آن‌ها را یک بار کامپایل و کش کند
+    SQL_SAVE = 'INSERT OR REPLACE INTO sessions (name, session_string, phone_number, first_name, username, user_id, identity_updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)'
+    SQL_LOAD_ALL = 'SELECT name, session_string, phone_number, first_name, username, user_id, identity_updated_at FROM sessions'
+    SQL_UPDATE_IDENTITY = 'UPDATE sessions SET first_name = ?, username = ?, user_id = ?, identity_updated_at = ? WHERE name = ?'
+    SQL_DELETE = 'DELETE FROM sessions WHERE name = ?'
+    SQL_GET = 'SELECT session_string FROM sessions WHERE name = ?'
+    SQL_COUNT = 'SELECT COUNT(*) FROM sessions'
+    SQL_EXPORT = 'SELECT name, session_string, phone_number, first_name, username, user_id FROM sessions ORDER BY name'
+    SQL_SAVE_PEER = 'INSERT OR REPLACE INTO peers (session_name, username, chat_id, access_hash, peer_type, title, resolved_at) VALUES (?, ?, ?, ?, ?, ?, ?)'
+    SQL_LOAD_PEERS = 'SELECT session_name, username, chat_id, access_hash, peer_type, title FROM peers'
+    SQL_DELETE_PEER = 'DELETE FROM peers WHERE session_name = ? AND username = ?'
+    SQL_DELETE_SESSION_PEERS = 'DELETE FROM peers WHERE session_name = ?'
+    SQL_SAVE_CALL = 'INSERT OR REPLACE INTO calls (session_name, chat_id, chat_title, username, join_time, media_source) VALUES (?, ?, ?, ?, ?, ?)'
+    SQL_LOAD_CALLS = 'SELECT session_name, chat_id, chat_title, username, join_time, media_source FROM calls ORDER BY join_time'
+    SQL_DELETE_CALL = 'DELETE FROM calls WHERE session_name = ? AND chat_id = ?'
+    SQL_DELETE_SESSION_CALLS = 'DELETE FROM calls WHERE session_name = ?'
+    SQL_NAMES = 'SELECT name FROM sessions'
+    SQL_HEARTBEAT = 'INSERT OR REPLACE INTO nodes (node_id, heartbeat_at, snapshot) VALUES (?, ?, ?)'
+    SQL_LIVE_NODES = 'SELECT node_id FROM nodes WHERE heartbeat_at > ? ORDER BY node_id'
+    SQL_NODE_SNAPSHOTS = 'SELECT node_id, snapshot FROM nodes WHERE heartbeat_at > ? AND snapshot IS NOT NULL'
+    SQL_DELETE_NODE = 'DELETE FROM nodes WHERE node_id = ?'
+    SQL_PURGE_NODES = 'DELETE FROM nodes WHERE heartbeat_at < ?'
+    # اجاره فقط وقتی گرفته می‌شود که آزاد، منقضی یا از قبل مال همین نود باشد
+    SQL_CLAIM_LEASE = (
+        'INSERT INTO leases (session_name, node_id, expires_at) VALUES (?, ?, ?) '
+        'ON CONFLICT (session_name) DO UPDATE SET node_id = excluded.node_id, expires_at = excluded.expires_at '
+        'WHERE leases.node_id = excluded.node_id OR leases.expires_at < ?'
+    )
+    SQL_RENEW_LEASES = 'UPDATE leases SET expires_at = ? WHERE node_id = ? AND expires_at >= ?'
+    SQL_OWNED_LEASES = 'SELECT session_name FROM leases WHERE node_id = ? AND expires_at >= ?'
+    SQL_RELEASE_LEASE = 'DELETE FROM leases WHERE session_name = ? AND node_id = ?'
+    SQL_RELEASE_NODE = 'DELETE FROM leases WHERE node_id = ?'
+    SQL_DELETE_SESSION_LEASE = 'DELETE FROM leases WHERE session_name = ?'
+    # فرمان‌های نود کنترل؛ برای هر نود مقصد یک ردیف نتیجه (pending → running → done)
+    SQL_SUBMIT_COMMAND = 'INSERT INTO commands (command_id, op, args, created_at) VALUES (?, ?, ?, ?)'
+    SQL_ADD_COMMAND_TARGET = "INSERT INTO command_results (command_id, node_id, status) VALUES (?, ?, 'pending')"
+    SQL_PENDING_COMMANDS = (
+        'SELECT c.command_id, c.op, c.args FROM command_results r JOIN commands c ON c.command_id = r.command_id '
+        "WHERE r.node_id = ? AND r.status = 'pending' AND c.created_at > ? ORDER BY c.created_at"
+    )
+    SQL_TAKE_COMMAND = "UPDATE command_results SET status = 'running' WHERE command_id = ? AND node_id = ?"
+    SQL_FINISH_COMMAND = "UPDATE command_results SET status = 'done', result = ? WHERE command_id = ? AND node_id = ?"
+    SQL_COMMAND_RESULTS = 'SELECT node_id, result FROM command_results WHERE command_id = ?'
+    SQL_DELETE_COMMAND = 'DELETE FROM commands WHERE command_id = ?'
+    SQL_DELETE_COMMAND_RESULTS = 'DELETE FROM command_results WHERE command_id = ?'
+    SQL_PURGE_COMMANDS = 'DELETE FROM commands WHERE created_at < ?'
+    SQL_PURGE_COMMAND_RESULTS = 'DELETE FROM command_results WHERE command_id NOT IN (SELECT command_id FROM commands)'
+    
+    # کلید اصلی جدول‌ها (برای upsert در PostgreSQL)
+    TABLE_KEYS = {
+        "sessions": ("name",),
+        "peers": ("session_name", "username"),
+        "calls": ("session_name", "chat_id"),
+        "nodes": ("node_id",),
+        "leases": ("session_name",),
+        "commands": ("command_id",),
+        "command_results": ("command_id", "node_id")
+    }
+    
+    # ستون‌های فایل خروجی (همان ستون‌های SQL_EXPORT)
+    EXPORT_FIELDS = ("name", "session_string", "phone_number", "first_name", "username", "user_id")
+    
+    def __init__(self, db_path: str = DB_PATH, url: str = DATABASE_URL):
+        self.backend = open_backend(url, db_path)
+        self.conn = None
+        # تمام دسترسی‌ها به دیتابیس روی همین یک ترد انجام می‌شود
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self.run_sync(self.init_database)
     
     def init_database(self):
-        """ایجاد جدول سشن‌ها در دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
-        conn.execute('''
+        """باز کردن اتصال دائمی و ایجاد جدول سشن‌ها"""
+        self.conn = self.backend.connect(self.TABLE_KEYS)
+        self.conn.execute('''
             CREATE TABLE IF NOT EXISTS sessions (
                 name TEXT PRIMARY KEY,
                 session_string TEXT NOT NULL,
@@ -44,179 +611,1914 @@ class SessionStorage:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        conn.commit()
-        conn.close()
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS peers (
+                session_name TEXT NOT NULL,
+                username TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                access_hash INTEGER,
+                peer_type TEXT,
+                title TEXT,
+                resolved_at REAL,
+                PRIMARY KEY (session_name, username)
+            )
+        ''')
+        # ویس چت‌های فعلی هر اکانت تا بعد از ری‌استارت دوباره به آن‌ها برگردد
+        # جدول قدیمی فقط یک ویس چت برای هر اکانت نگه می‌داشت
+        legacy_calls = self.primary_key('calls') == ['session_name']
+        if legacy_calls:
+            self.conn.execute('ALTER TABLE calls RENAME TO calls_legacy')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS calls (
+                session_name TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                chat_title TEXT,
+                username TEXT,
+                join_time REAL,
+                media_source TEXT,
+                PRIMARY KEY (session_name, chat_id)
+            )
+        ''')
+        if legacy_calls:
+            self.conn.execute('INSERT INTO calls SELECT session_name, chat_id, chat_title, username, join_time, media_source FROM calls_legacy')
+            self.conn.execute('DROP TABLE calls_legacy')
+        # نودهای زنده و اجاره سشن‌ها برای اجرای چند نود روی یک دیتابیس
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                node_id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                session_name TEXT PRIMARY KEY,
+                node_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS commands (
+                command_id TEXT PRIMARY KEY,
+                op TEXT NOT NULL,
+                args TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS command_results (
+                command_id TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                PRIMARY KEY (command_id, node_id)
+            )
+        ''')
+        self.migrate_columns('sessions', {
+            'user_id': 'INTEGER',
+            'identity_updated_at': 'REAL DEFAULT 0'
+        })
+        # خلاصه وضعیت هر نود برای صفحه وضعیت نود کنترل
+        self.migrate_columns('nodes', {'snapshot': 'TEXT'})
+        self.conn.commit()
+    
+    def primary_key(self, table: str) -> List[str]:
+        """ستون‌های کلید اصلی جدول به ترتیب (خالی اگر جدول وجود ندارد)"""
+        columns = [column for column in self.backend.columns(self.conn, table) if column[1]]
+        return [name for name, _ in sorted(columns, key=lambda column: column[1])]
+    
+    def migrate_columns(self, table: str, columns: Dict[str, str]):
+        """افزودن ستون‌های جدید به جدول‌های دیتابیس‌های قدیمی"""
+        existing = {name for name, _ in self.backend.columns(self.conn, table)}
+        for column, definition in columns.items():
+            if column not in existing:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def run_sync(self, func, *args):
+        """اجرای مستقیم روی ترد دیتابیس (فقط قبل از شروع event loop)"""
+        return self.executor.submit(func, *args).result()
+    
+    async def run(self, func, *args):
+        """اجرای تابع روی ترد دیتابیس بدون بلاک کردن event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+    
+    def _save_session(self, name, session_string, phone_number, first_name, username, user_id):
+        with self.conn:
+            self.conn.execute(self.SQL_SAVE, (name, session_string, phone_number, first_name, username, user_id, time.time()))
+    
+    def _save_sessions(self, records):
+        updated_at = time.time()
+        with self.conn:
+            self.conn.executemany(self.SQL_SAVE, [
+                (r["name"], r["session_string"], r["phone_number"], r["first_name"], r["username"], r["user_id"], updated_at)
+                for r in records
+            ])
+    
+    def _load_sessions(self):
+        return self.conn.execute(self.SQL_LOAD_ALL).fetchall()
     
-    def save_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = ""):
+    def _export_sessions(self, path, fmt):
+        cursor = self.conn.execute(self.SQL_EXPORT)
+        count = 0
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                writer.writerow(self.EXPORT_FIELDS)
+            else:
+                f.write("[")
+            # ردیف‌ها دسته‌ای از cursor خوانده و نوشته می‌شوند؛ کل جدول در حافظه نمی‌آید
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    if fmt == "csv":
+                        writer.writerow(row)
+                    else:
+                        f.write(",\n" if count else "\n")
+                        f.write(json.dumps(dict(zip(self.EXPORT_FIELDS, row)), ensure_ascii=False))
+                    count += 1
+            if fmt != "csv":
+                f.write("\n]\n")
+        return count
+    
+    def _delete_session(self, name):
+        with self.conn:
+            self.conn.execute(self.SQL_DELETE, (name,))
+            self.conn.execute(self.SQL_DELETE_SESSION_PEERS, (name,))
+            self.conn.execute(self.SQL_DELETE_SESSION_CALLS, (name,))
+            self.conn.execute(self.SQL_DELETE_SESSION_LEASE, (name,))
+    
+    def _get_session(self, name):
+        result = self.conn.execute(self.SQL_GET, (name,)).fetchone()
+        return result[0] if result else None
+    
+    def _count_sessions(self):
+        return self.conn.execute(self.SQL_COUNT).fetchone()[0]
+    
+    def _update_identity(self, name, first_name, username, user_id, updated_at):
+        with self.conn:
+            self.conn.execute(self.SQL_UPDATE_IDENTITY, (first_name, username, user_id, updated_at, name))
+    
+    def _save_peer(self, session_name, username, chat_id, access_hash, peer_type, title):
+        with self.conn:
+            self.conn.execute(self.SQL_SAVE_PEER, (session_name, username, chat_id, access_hash, peer_type, title, time.time()))
+    
+    def _load_peers(self):
+        return self.conn.execute(self.SQL_LOAD_PEERS).fetchall()
+    
+    def _delete_peer(self, session_name, username):
+        with self.conn:
+            self.conn.execute(self.SQL_DELETE_PEER, (session_name, username))
+    
+    def _save_call(self, session_name, chat_id, chat_title, username, join_time, media_source):
+        with self.conn:
+            self.conn.execute(self.SQL_SAVE_CALL, (session_name, chat_id, chat_title, username, join_time, media_source))
+    
+    def _load_calls(self):
+        return self.conn.execute(self.SQL_LOAD_CALLS).fetchall()
+    
+    def _session_names(self):
+        return [row[0] for row in self.conn.execute(self.SQL_NAMES).fetchall()]
+    
+    def _heartbeat(self, node_id, now, ttl, snapshot):
+        with self.conn:
+            self.conn.execute(self.SQL_HEARTBEAT, (node_id, now, snapshot))
+            # رکورد نودهایی که مدت‌هاست خاموش‌اند و فرمان‌هایی که کسی منتظرشان نیست پاک می‌شود
+            self.conn.execute(self.SQL_PURGE_NODES, (now - 10 * ttl,))
+            self.conn.execute(self.SQL_PURGE_COMMANDS, (now - 2 * COMMAND_TIMEOUT,))
+            self.conn.execute(self.SQL_PURGE_COMMAND_RESULTS)
+        return [row[0] for row in self.conn.execute(self.SQL_LIVE_NODES, (now - ttl,)).fetchall()]
+    
+    def _node_snapshots(self, since):
+        return self.conn.execute(self.SQL_NODE_SNAPSHOTS, (since,)).fetchall()
+    
+    def _submit_command(self, command_id, op, args, nodes, now):
+        with self.conn:
+            self.conn.execute(self.SQL_SUBMIT_COMMAND, (command_id, op, args, now))
+            self.conn.executemany(self.SQL_ADD_COMMAND_TARGET, [(command_id, node) for node in nodes])
+    
+    def _take_commands(self, node_id, since):
+        with self.conn:
+            rows = self.conn.execute(self.SQL_PENDING_COMMANDS, (node_id, since)).fetchall()
+            self.conn.executemany(self.SQL_TAKE_COMMAND, [(row[0], node_id) for row in rows])
+        return rows
+    
+    def _finish_command(self, command_id, node_id, result):
+        with self.conn:
+            self.conn.execute(self.SQL_FINISH_COMMAND, (result, command_id, node_id))
+    
+    def _command_results(self, command_id):
+        return self.conn.execute(self.SQL_COMMAND_RESULTS, (command_id,)).fetchall()
+    
+    def _delete_command(self, command_id):
+        with self.conn:
+            self.conn.execute(self.SQL_DELETE_COMMAND, (command_id,))
+            self.conn.execute(self.SQL_DELETE_COMMAND_RESULTS, (command_id,))
+    
+    def _claim_leases(self, node_id, names, now, ttl):
+        expires_at = now + ttl
+        with self.conn:
+            self.conn.execute(self.SQL_RENEW_LEASES, (expires_at, node_id, now))
+            if names:
+                self.conn.executemany(self.SQL_CLAIM_LEASE, [(name, node_id, expires_at, now) for name in names])
+        return {row[0] for row in self.conn.execute(self.SQL_OWNED_LEASES, (node_id, now)).fetchall()}
+    
+    def _release_leases(self, node_id, names):
+        with self.conn:
+            if names is None:
+                self.conn.execute(self.SQL_RELEASE_NODE, (node_id,))
+                self.conn.execute(self.SQL_DELETE_NODE, (node_id,))
+            else:
+                self.conn.executemany(self.SQL_RELEASE_LEASE, [(name, node_id) for name in names])
+    
+    def _delete_call(self, session_name, chat_id):
+        with self.conn:
+            if chat_id is None:
+                self.conn.execute(self.SQL_DELETE_SESSION_CALLS, (session_name,))
+            else:
+                self.conn.execute(self.SQL_DELETE_CALL, (session_name, chat_id))
+    
+    async def save_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = "", user_id: Optional[int] = None):
         """ذخیره سشن در دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
-        conn.execute(
-            'INSERT OR REPLACE INTO sessions (name, session_string, phone_number, first_name, username) VALUES (?, ?, ?, ?, ?)',
-            (name, session_string, phone_number, first_name, username)
-        )
-        conn.commit()
-        conn.close()
+        await self.run(self._save_session, name, session_string, phone_number, first_name, username, user_id)
     
-    def load_sessions(self):
+    async def save_sessions(self, records: List[Dict]):
+        """ذخیره چند سشن با یک executemany در یک تراکنش"""
+        if records:
+            await self.run(self._save_sessions, records)
+    
+    async def load_sessions(self):
         """بارگذاری تمام سشن‌ها از دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.execute('SELECT name, session_string, phone_number, first_name, username FROM sessions')
-        sessions = cursor.fetchall()
-        conn.close()
-        return sessions
+        return await self.run(self._load_sessions)
+    
+    async def export_sessions(self, path: str, fmt: str = "json") -> int:
+        """نوشتن تمام سشن‌ها در فایل JSON یا CSV؛ تعداد سشن‌ها برگردانده می‌شود"""
+        return await self.run(self._export_sessions, path, fmt)
     
-    def delete_session(self, name: str):
+    async def delete_session(self, name: str):
         """حذف سشن از دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
-        conn.execute('DELETE FROM sessions WHERE name = ?', (name,))
-        conn.commit()
-        conn.close()
+        await self.run(self._delete_session, name)
+    
+    async def get_session(self, name: str):
+        """دریافت سشن خاص از دیتابیس"""
+        return await self.run(self._get_session, name)
+    
+    async def count_sessions(self) -> int:
+        """تعداد سشن‌های ذخیره شده"""
+        return await self.run(self._count_sessions)
+    
+    async def update_identity(self, name: str, first_name: str, username: str, user_id: Optional[int], updated_at: float):
+        """بروزرسانی اطلاعات هویت اکانت"""
+        await self.run(self._update_identity, name, first_name, username, user_id, updated_at)
+    
+    async def save_peer(self, session_name: str, username: str, chat_id: int, access_hash: int, peer_type: str, title: str):
+        """ذخیره چت resolve شده برای یک سشن"""
+        await self.run(self._save_peer, session_name, username, chat_id, access_hash, peer_type, title)
+    
+    async def delete_peer(self, session_name: str, username: str):
+        """حذف چت نامعتبر از کش"""
+        await self.run(self._delete_peer, session_name, username)
+    
+    async def save_call(self, session_name: str, chat_id: int, chat_title: str, username: str, join_time: float, media_source: str):
+        """ذخیره ویس چتی که اکانت وارد آن شده است"""
+        await self.run(self._save_call, session_name, chat_id, chat_title, username, join_time, media_source)
+    
+    async def load_calls(self):
+        """ویس چت‌های ذخیره شده (به ترتیب زمان ورود)"""
+        return await self.run(self._load_calls)
+    
+    async def delete_call(self, session_name: str, chat_id: Optional[int] = None):
+        """حذف ویس چت ذخیره شده یک اکانت (بدون chat_id همه ویس چت‌هایش)"""
+        await self.run(self._delete_call, session_name, chat_id)
+    
+    async def session_names(self) -> List[str]:
+        """نام تمام سشن‌های دیتابیس (برای تقسیم بین نودها)"""
+        return await self.run(self._session_names)
+    
+    async def heartbeat(self, node_id: str, now: float, ttl: float, snapshot: Optional[str] = None) -> List[str]:
+        """ثبت زنده بودن (و خلاصه وضعیت) نود؛ نودهای زنده (به ترتیب شناسه) برگردانده می‌شوند"""
+        return await self.run(self._heartbeat, node_id, now, ttl, snapshot)
+    
+    async def node_snapshots(self, since: float) -> List[Tuple[str, str]]:
+        """(نود، خلاصه وضعیت JSON) نودهایی که بعد از since ضربان داشته‌اند"""
+        return await self.run(self._node_snapshots, since)
+    
+    async def submit_command(self, command_id: str, op: str, args: str, nodes: List[str], now: float):
+        """ثبت فرمان برای اجرا روی نودهای مشخص"""
+        await self.run(self._submit_command, command_id, op, args, nodes, now)
+    
+    async def take_commands(self, node_id: str, since: float) -> List[Tuple[str, str, str]]:
+        """فرمان‌های در انتظار این نود (جدیدتر از since) که هم‌زمان در حال اجرا علامت می‌خورند"""
+        return await self.run(self._take_commands, node_id, since)
+    
+    async def finish_command(self, command_id: str, node_id: str, result: str):
+        """ثبت نتیجه JSON اجرای فرمان روی این نود"""
+        await self.run(self._finish_command, command_id, node_id, result)
+    
+    async def command_results(self, command_id: str) -> List[Tuple[str, Optional[str]]]:
+        """(نود، نتیجه یا None اگر هنوز تمام نشده) برای هر نود مقصد فرمان"""
+        return await self.run(self._command_results, command_id)
+    
+    async def delete_command(self, command_id: str):
+        """حذف فرمان و نتایجش بعد از جمع‌آوری"""
+        await self.run(self._delete_command, command_id)
+    
+    async def claim_leases(self, node_id: str, names: List[str], now: float, ttl: float) -> Set[str]:
+        """تمدید اجاره‌های نود و گرفتن اجاره‌های آزاد یا منقضی از names؛ اجاره‌های فعلی نود برگردانده می‌شوند"""
+        return await self.run(self._claim_leases, node_id, names, now, ttl)
+    
+    async def release_leases(self, node_id: str, names: Optional[List[str]] = None):
+        """آزاد کردن اجاره‌ها (بدون names همه اجاره‌ها و رکورد نود)"""
+        await self.run(self._release_leases, node_id, names)
+    
+    def close(self):
+        """بستن اتصال و ترد دیتابیس"""
+        if self.conn is not None:
+            self.run_sync(self.conn.close)
+            self.conn = None
+        self.executor.shutdown(wait=True)
+
+# ==================== کش هویت اکانت‌ها ====================
+class IdentityCache:
+    """نام و یوزرنیم اکانت‌ها از دیتابیس؛ بدون تماس شبکه‌ای و با بروزرسانی پس‌زمینه"""
+    
+    def __init__(self, storage: SessionStorage):
+        self.storage = storage
+        self.identities: Dict[str, Dict] = {}
+        self.refresh_task: Optional[asyncio.Task] = None
+    
+    def seed(self, name: str, first_name: str = "", username: str = "", user_id: Optional[int] = None, updated_at: float = 0.0):
+        """ثبت هویت خوانده شده از دیتابیس"""
+        self.identities[name] = {
+            "first_name": first_name or "",
+            "username": username or "",
+            "user_id": user_id,
+            "updated_at": updated_at or 0.0
+        }
+    
+    def get(self, name: str) -> Dict:
+        return self.identities.get(name, {})
+    
+    def display_name(self, name: str) -> str:
+        """نام نمایشی اکانت (در صورت نبود، نام سشن)"""
+        return self.get(name).get("first_name") or name
+    
+    def is_stale(self, name: str) -> bool:
+        return time.time() - self.get(name).get("updated_at", 0.0) > IDENTITY_TTL
+    
+    def forget(self, name: str):
+        self.identities.pop(name, None)
+    
+    async def update_from_user(self, name: str, user):
+        """بروزرسانی هویت از شیء User که قبلاً دریافت شده است"""
+        first_name, username = user.first_name or "", user.username or ""
+        current = self.get(name)
+        changed = (current.get("first_name"), current.get("username"), current.get("user_id")) != (first_name, username, user.id)
+        if not changed and not self.is_stale(name):
+            return
+        
+        updated_at = time.time()
+        self.seed(name, first_name, username, user.id, updated_at)
+        await self.storage.update_identity(name, first_name, username, user.id, updated_at)
+    
+    async def refresh(self, name: str, client: Client):
+        """دریافت مجدد هویت از تلگرام"""
+        me = await client.get_me()
+        await self.update_from_user(name, me)
+    
+    def start_background_refresh(self, live: Dict[str, "SessionEntry"]):
+        """شروع بروزرسانی دوره‌ای هویت کلاینت‌های متصل"""
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self._refresh_loop(live))
+    
+    async def _refresh_loop(self, live: Dict[str, "SessionEntry"]):
+        while True:
+            await asyncio.sleep(IDENTITY_REFRESH_INTERVAL)
+            # فقط کلاینت‌های متصل؛ برای بروزرسانی هویت کلاینت جدید ساخته نمی‌شود
+            for name, entry in list(live.items()):
+                client = entry.client
+                if client is None or not client.is_connected or not self.is_stale(name):
+                    continue
+                try:
+                    await self.refresh(name, client)
+                except Exception as e:
+                    print(f"❌ خطا در بروزرسانی هویت {name}: {e}")
+
+# ==================== کش چت‌های resolve شده ====================
+class PeerCache:
+    """کش ماندگار username → chat id / access hash / عنوان برای هر سشن"""
+    
+    def __init__(self, storage: SessionStorage):
+        self.storage = storage
+        self.peers: Dict[Tuple[str, str], Dict] = {}
+    
+    def load(self, rows):
+        """بارگذاری چت‌های ذخیره شده از دیتابیس"""
+        for session_name, username, chat_id, access_hash, peer_type, title in rows:
+            self.peers[(session_name, username)] = {
+                "chat_id": chat_id,
+                "access_hash": access_hash or 0,
+                "peer_type": peer_type,
+                "title": title
+            }
+    
+    async def resolve(self, session_name: str, client: Client, username: str) -> Dict:
+        """resolve یک چت؛ در صورت وجود در کش بدون هیچ درخواست شبکه‌ای"""
+        key = (session_name, username.lower())
+        peer = self.peers.get(key)
+        if peer is not None:
+            # access hash را به حافظه pyrogram برمی‌گردانیم تا کلاینت in_memory هم بدون resolve کار کند
+            await client.storage.update_peers([
+                (peer["chat_id"], peer["access_hash"], peer["peer_type"], key[1], None)
+            ])
+            return peer
+        
+        async with metrics.track("get_chat"):
+            chat = await limiter.call(session_name, client.get_chat, username)
+        input_peer = await client.storage.get_peer_by_id(chat.id)
+        peer = {
+            "chat_id": chat.id,
+            "access_hash": getattr(input_peer, "access_hash", 0),
+            "peer_type": chat.type.value,
+            "title": chat.title or username
+        }
+        self.peers[key] = peer
+        await self.storage.save_peer(session_name, key[1], peer["chat_id"], peer["access_hash"], peer["peer_type"], peer["title"])
+        return peer
+    
+    async def invalidate(self, session_name: str, username: str):
+        """حذف چت از کش وقتی استفاده از آن شکست خورده است"""
+        key = (session_name, username.lower())
+        if self.peers.pop(key, None) is not None:
+            await self.storage.delete_peer(*key)
+    
+    def forget_session(self, session_name: str):
+        """حذف تمام چت‌های یک سشن از حافظه (دیتابیس همراه سشن پاک می‌شود)"""
+        for key in [key for key in self.peers if key[0] == session_name]:
+            del self.peers[key]
+    
+    def chat_ids(self, username: str) -> Set[int]:
+        """شناسه چت‌هایی که این username برای هر سشنی به آن resolve شده است"""
+        username = username.lower()
+        return {peer["chat_id"] for key, peer in self.peers.items() if key[1] == username}
+
+# ==================== کش وضعیت ویس چت‌ها ====================
+async def fetch_group_call(client: Client, chat_id: int) -> bool:
+    """آیا چت الان ویس چت فعال دارد؟ (از اطلاعات کامل چت)"""
+    peer = await client.resolve_peer(chat_id)
+    if isinstance(peer, raw.types.InputPeerChannel):
+        full = await client.invoke(raw.functions.channels.GetFullChannel(
+            channel=raw.types.InputChannel(channel_id=peer.channel_id, access_hash=peer.access_hash)
+        ))
+    else:
+        full = await client.invoke(raw.functions.messages.GetFullChat(chat_id=peer.chat_id))
+    return full.full_chat.call is not None
+
+class GroupCallCache:
+    """وضعیت ویس چت هر چت با عمر کوتاه، مشترک بین همه اکانت‌ها
+    
+    در یک ورود گروهی فقط اولین اکانت وضعیت را از تلگرام می‌پرسد و بقیه منتظر همان
+    درخواست می‌مانند. None یعنی وضعیت معلوم نشد و تصمیم با خود join_group_call است.
+    """
+    
+    def __init__(self, ttl: float = GROUP_CALL_TTL, negative_ttl: float = GROUP_CALL_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # chat_id -> (فعال بودن، زمان انقضا)
+        self.states: Dict[int, Tuple[Optional[bool], float]] = {}
+        self.flights = SingleFlight(announce=False)
+    
+    async def lookup(self, session_name: str, client: Client, chat_id: int) -> Optional[bool]:
+        state = self.states.get(chat_id)
+        if state is not None and state[1] > time.monotonic():
+            metrics.inc("bot_group_call_lookups_total", {"result": "hit"})
+            return state[0]
+        return await self.flights.run(("group_call", chat_id), self._fetch, session_name, client, chat_id)
+    
+    async def _fetch(self, session_name: str, client: Client, chat_id: int) -> Optional[bool]:
+        metrics.inc("bot_group_call_lookups_total", {"result": "miss"})
+        try:
+            async with metrics.track("get_group_call"):
+                active = await limiter.call(session_name, fetch_group_call, client, chat_id)
+        except Exception as e:
+            print(f"⚠️ بررسی ویس چت {chat_id} با {session_name} ناموفق بود: {describe_error(e)}")
+            active = None
+        self.set(chat_id, active)
+        return active
+    
+    def set(self, chat_id: int, active: Optional[bool]):
+        ttl = self.negative_ttl if active is False else self.ttl
+        self.states[chat_id] = (active, time.monotonic() + ttl)
+    
+    def forget(self, chat_id: int):
+        self.states.pop(chat_id, None)
+
+# ==================== محدودیت نرخ درخواست‌ها ====================
+class TokenBucket:
+    """سطل توکن با نرخ قابل تغییر که می‌تواند تا زمان مشخصی مسدود شود"""
+    
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+    
+    def wait_time(self, now: float) -> float:
+        """زمان لازم تا آماده شدن یک توکن (صفر یعنی همین حالا)"""
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+    
+    def block(self, seconds: float, now: float):
+        """توقف تا پایان FloodWait؛ بعد از آن فقط یک درخواست فوری مجاز است"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.updated = self.blocked_until
+        self.tokens = 1.0
+    
+    def slow_down(self):
+        self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate * FLOOD_BACKOFF)
+    
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
+
+class RateLimiter:
+    """سطل توکن سراسری و برای هر اکانت با تطبیق نرخ بر اساس FloodWait های تلگرام"""
+    
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 account_rate: float = ACCOUNT_RATE, account_burst: float = ACCOUNT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.accounts: Dict[str, TokenBucket] = {}
+    
+    def _bucket(self, session_name: str) -> TokenBucket:
+        bucket = self.accounts.get(session_name)
+        if bucket is None:
+            bucket = self.accounts[session_name] = TokenBucket(self.account_rate, self.account_burst)
+        return bucket
+    
+    async def acquire(self, session_name: str):
+        """انتظار تا وقتی هم اکانت و هم سطل سراسری توکن داشته باشند"""
+        account = self._bucket(session_name)
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            wait = max(account.wait_time(now), self.global_bucket.wait_time(now))
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        account.tokens -= 1
+        self.global_bucket.tokens -= 1
+        
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            metrics.observe("bot_rate_limit_wait_seconds", waited)
+    
+    def on_flood(self, session_name: str, seconds: float):
+        """ثبت FloodWait: اکانت تا پایان زمان مسدود و نرخ اکانت و نرخ سراسری کم می‌شود"""
+        account = self._bucket(session_name)
+        account.block(seconds, time.monotonic())
+        account.slow_down()
+        self.global_bucket.slow_down()
+        metrics.inc("bot_flood_wait_total")
+        metrics.inc("bot_flood_wait_seconds_total", value=seconds)
+        print(f"⏳ {session_name} - FloodWait {seconds} ثانیه (نرخ سراسری: {self.global_bucket.rate:.1f}/ثانیه)")
+    
+    def on_success(self, session_name: str):
+        self._bucket(session_name).recover()
+        self.global_bucket.recover()
+    
+    async def call(self, session_name: str, func: Callable, *args, **kwargs):
+        """اجرای یک درخواست MTProto با رعایت نرخ و تکرار بعد از FloodWait"""
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
+            await self.acquire(session_name)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWait as e:
+                self.on_flood(session_name, e.value)
+                if attempt == FLOOD_WAIT_RETRIES or e.value > FLOOD_WAIT_MAX:
+                    raise
+                continue
+            self.on_success(session_name)
+            return result
+    
+    def forget(self, session_name: str):
+        self.accounts.pop(session_name, None)
+
+limiter = RateLimiter()
+metrics.gauge("bot_rate_limit_global_rate", lambda: limiter.global_bucket.rate)
+
+# ==================== سیاست تکرار و قطع مدار ویس چت ====================
+class VoiceJoinError(Exception):
+    """شکست نهایی ورود یک اکانت به ویس چت (بعد از اعمال سیاست تکرار)"""
+
+class VoiceChatClosed(VoiceJoinError):
+    """ویس چت چت مقصد فعال نیست"""
+
+def describe_error(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+class RetryPolicy:
+    """دسته‌بندی خطاهای ورود به ویس چت و زمان انتظار قبل از تلاش بعدی
+    
+    joined: از قبل داخل کال است (موفق)
+    chat: مشکل خود ویس چت، تنظیمات یا فایل محلی که برای همه اکانت‌ها تکرار می‌شود (قطع مدار)
+    session: مشکل همین اکانت؛ تکرار فایده ندارد
+    transient: خطای گذرای شبکه یا سرور؛ با backoff تکرار می‌شود
+    """
+    
+    # pytgcalls با تأخیر ایمپورت می‌شود، پس خطاهای آن با نام کلاس شناخته می‌شوند
+    JOINED_ERRORS = {"AlreadyJoinedError"}
+    CHAT_ERROR_NAMES = {
+        "NoActiveGroupCall", "GroupCallNotFound", "FFmpegNotInstalled", "NoAudioSourceFound",
+        "NodeJSNotInstalled", "TooOldNodeJSVersion", "NodeJSNotRunning", "RTMPStreamNeeded"
+    }
+    CHAT_ERRORS = (Forbidden, ChatAdminRequired, ChannelPrivate, ChannelInvalid)
+    TRANSIENT_ERROR_NAMES = {"TelegramServerError"}
+    TRANSIENT_ERRORS = (InternalServerError, asyncio.TimeoutError, ConnectionError)
+    # بقیه OSErrorها (فایل رسانه پیدا نشد، دسترسی نیست، دیسک پر است) محلی و دائمی هستند
+    LOCAL_ERRORS = (OSError,)
+    # خطای برنامه‌نویسی برای همه اکانت‌ها یکسان است و نباید پشت خطای اکانت پنهان شود
+    PROGRAMMING_ERRORS = (TypeError, AttributeError, NameError, AssertionError, NotImplementedError)
+    # فقط این خطاها عضویت ذخیره‌شده را باطل می‌کنند؛ FloodWait و خطای گذرا و مدار باز نه
+    GONE_ERROR_NAMES = {"NoActiveGroupCall", "GroupCallNotFound"}
+    GONE_ERRORS = (Unauthorized, UserBannedInChannel, UsernameNotOccupied, UsernameInvalid)
+    # چت کش شده دیگر معتبر نیست و باید دوباره resolve شود
+    PEER_ERRORS = (ChannelInvalid, ChannelPrivate, PeerIdInvalid)
+    
+    def __init__(self, retries: int = JOIN_RETRIES, base: float = JOIN_RETRY_BASE, cap: float = JOIN_RETRY_MAX):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+    
+    def is_bug(self, error: Exception) -> bool:
+        return isinstance(error, self.PROGRAMMING_ERRORS)
+    
+    def is_gone(self, error: Optional[Exception]) -> bool:
+        """ویس چت بسته شده یا اکانت/چت برای همیشه از دست رفته؛ تلاش دوباره بعد از ری‌استارت بی‌فایده است"""
+        if error is None or isinstance(error, VoiceChatClosed):
+            return error is not None
+        cause = error.__cause__ or error
+        return type(cause).__name__ in self.GONE_ERROR_NAMES or isinstance(cause, self.GONE_ERRORS)
+    
+    def is_stale_peer(self, error: Exception) -> bool:
+        return isinstance(error.__cause__ or error, self.PEER_ERRORS)
+    
+    def classify(self, error: Exception) -> str:
+        name = type(error).__name__
+        if name in self.JOINED_ERRORS:
+            return "joined"
+        if name in self.CHAT_ERROR_NAMES or isinstance(error, self.CHAT_ERRORS):
+            return "chat"
+        if name in self.TRANSIENT_ERROR_NAMES or isinstance(error, self.TRANSIENT_ERRORS):
+            return "transient"
+        if isinstance(error, self.LOCAL_ERRORS):
+            return "chat"
+        # بقیه خطاها (نشست باطل، FloodWait طولانی، عضو نبودن، بن بودن و ...) مخصوص همین اکانت هستند
+        return "session"
+    
+    def delay(self, attempt: int) -> float:
+        """backoff نمایی با jitter تا اکانت‌ها هم‌زمان دوباره تلاش نکنند"""
+        return min(self.cap, self.base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+class CircuitBreaker:
+    """قطع‌کننده مدار هر ویس چت
+    
+    بعد از BREAKER_THRESHOLD خطای سراسری پشت سر هم مدار باز می‌شود و اکانت‌های بعدی بدون
+    هیچ درخواستی رد می‌شوند. بعد از BREAKER_COOLDOWN فقط یک اکانت آزمایشی تلاش می‌کند و
+    بقیه منتظر نتیجه آن می‌مانند: موفقیت مدار را می‌بندد و شکست سراسری دوباره بازش می‌کند.
+    """
+    
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        # chat_id -> [خطاهای پشت سر هم، زمان باز شدن مدار، آخرین دلیل، Event تلاش آزمایشی در جریان]
+        self.chats: Dict[int, list] = {}
+    
+    async def admit(self, chat_id: int) -> Optional[str]:
+        """دلیل رد درخواست وقتی مدار باز است؛ None یعنی اجازه تلاش"""
+        state = self.chats.get(chat_id)
+        while state is not None and state[1] is not None:
+            if time.monotonic() - state[1] < self.cooldown:
+                return state[2]
+            probe = state[3]
+            if probe is None:
+                # همین درخواست تلاش آزمایشی است
+                state[3] = asyncio.Event()
+                return None
+            await probe.wait()
+            state = self.chats.get(chat_id)
+        return None
+    
+    def _finish_probe(self, state: list):
+        if state[3] is not None:
+            state[3].set()
+            state[3] = None
+    
+    def on_success(self, chat_id: int):
+        state = self.chats.pop(chat_id, None)
+        if state is None:
+            return
+        self._finish_probe(state)
+        if state[1] is not None:
+            print(f"🟢 مدار ویس چت {chat_id} بسته شد")
+    
+    def on_failure(self, chat_id: int, reason: str, chat_wide: bool = True):
+        """ثبت شکست؛ خطای مخصوص یک اکانت (یا لغو) فقط تلاش آزمایشی را به نفر بعدی می‌سپارد"""
+        state = self.chats.get(chat_id)
+        if not chat_wide:
+            if state is not None:
+                self._finish_probe(state)
+            return
+        
+        if state is None:
+            state = self.chats[chat_id] = [0, None, reason, None]
+        state[0] += 1
+        state[2] = reason
+        probe_failed = state[3] is not None
+        if state[0] >= self.threshold or probe_failed:
+            if state[1] is None or probe_failed:
+                metrics.inc("bot_circuit_open_total")
+                print(f"⛔ مدار ویس چت {chat_id} باز شد ({reason})؛ تا {self.cooldown:.0f} ثانیه تلاشی انجام نمی‌شود")
+            state[1] = time.monotonic()
+        self._finish_probe(state)
+    
+    def reset(self, chat_id: int):
+        """بستن مدار به دستور مالک؛ منتظرهای تلاش آزمایشی هم آزاد می‌شوند"""
+        state = self.chats.pop(chat_id, None)
+        if state is not None:
+            self._finish_probe(state)
+    
+    def open_count(self) -> int:
+        return sum(1 for state in self.chats.values() if state[1] is not None)
+
+join_retry = RetryPolicy()
+breakers = CircuitBreaker()
+metrics.gauge("bot_circuit_open_chats", breakers.open_count)
+
+# ==================== مدیریت وضعیت کاربران ====================
+class UserState:
+    def __init__(self):
+        self.states = {}
+    
+    def set_state(self, user_id, state, data=None):
+        self.states[user_id] = {"state": state, "data": data or {}}
+    
+    def get_state(self, user_id):
+        return self.states.get(user_id)
+    
+    def clear_state(self, user_id):
+        if user_id in self.states:
+            del self.states[user_id]
+
+user_state = UserState()
+
+# ==================== هماهنگی عملیات همزمان ====================
+class SingleFlight:
+    """هر عملیات با کلید یکسان فقط یک بار اجرا می‌شود؛ درخواست تکراری منتظر همان اجرا می‌ماند و همان نتیجه را می‌گیرد"""
+    
+    def __init__(self, announce: bool = True):
+        # کلید -> [تسک، تعداد منتظرها، کار اجراکننده]
+        self.flights: Dict[Tuple, list] = {}
+        self.announce = announce
+    
+    async def run(self, key: Tuple, func: Callable, *args, **kwargs):
+        flight = self.flights.get(key)
+        if flight is None:
+            # تسک context فراخواننده اول را برمی‌دارد؛ پیشرفت فقط روی کار او ثبت می‌شود
+            flight = [asyncio.create_task(func(*args, **kwargs)), 0, current_job.get()]
+            self.flights[key] = flight
+            flight[0].add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            metrics.inc("bot_single_flight_joined_total", {"op": key[0]})
+            if self.announce:
+                print(f"🔁 {key[0]} در حال اجراست؛ درخواست تکراری به همان اجرا متصل شد")
+            self._attach(flight[2])
+        
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            # با لغو آخرین منتظر، خود عملیات هم لغو می‌شود
+            if flight[1] == 1:
+                flight[0].cancel()
+            raise
+        finally:
+            flight[1] -= 1
+    
+    @staticmethod
+    def _attach(owner: Optional["Job"]):
+        """کار درخواست تکراری خبر داشته باشد که پیشرفتش روی کار دیگری نمایش داده می‌شود"""
+        job = current_job.get()
+        if job is None or job is owner:
+            return
+        job.attached_to = owner.id if owner is not None else 0
+        where = f"کار #{owner.id}" if owner is not None else "اجرای در حال انجام"
+        job.lines.append(f"🔁 متصل به {where}؛ پیشرفت روی همان اجرا نمایش داده می‌شود")
+
+def single_flight(method):
+    """عملیات سراسری fleet؛ فراخوانی تکراری با همان آرگومان‌ها به اجرای جاری متصل می‌شود"""
+    signature = inspect.signature(method)
+    
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        # آرگومان‌های موقعیتی، نام‌دار و پیش‌فرض به یک شکل کلید می‌شوند
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__,) + tuple(list(bound.arguments.items())[1:])
+        return await self.flights.run(key, method, *bound.args, **bound.kwargs)
+    return wrapper
+
+class SessionLocks:
+    """قفل جدا برای هر سشن تا عملیات‌های یک اکانت پشت سر هم اجرا شوند، نه هم‌زمان
+    
+    قفل برای همان تسک دوباره‌پذیر است (خروج از ویس چت داخل توقف سشن) و وقتی منتظری
+    ندارد حذف می‌شود تا حافظه با تعداد اکانت‌ها رشد نکند.
+    """
+    
+    def __init__(self):
+        # نام سشن -> [قفل، تسک صاحب قفل، تعداد استفاده‌کننده‌ها]
+        self.locks: Dict[str, list] = {}
+    
+    @asynccontextmanager
+    async def hold(self, name: str):
+        task = asyncio.current_task()
+        record = self.locks.get(name)
+        if record is not None and record[1] is task:
+            yield
+            return
+        
+        if record is None:
+            record = self.locks[name] = [asyncio.Lock(), None, 0]
+        record[2] += 1
+        try:
+            async with record[0]:
+                record[1] = task
+                try:
+                    yield
+                finally:
+                    record[1] = None
+        finally:
+            record[2] -= 1
+            if record[2] == 0:
+                del self.locks[name]
+    
+    def locked(self, name: str) -> bool:
+        record = self.locks.get(name)
+        return record is not None and record[0].locked()
+
+# ==================== رجیستری سشن‌ها ====================
+class CallMembership:
+    """حضور یک اکانت در ویس چت یک چت"""
+    
+    __slots__ = ("chat_id", "chat_title", "username", "join_time", "media_source")
+    
+    def __init__(self, chat_id: int, chat_title: str, username: str, join_time: float, media_source: str):
+        self.chat_id = chat_id
+        self.chat_title = chat_title
+        self.username = username
+        self.join_time = join_time
+        self.media_source = media_source
+    
+    def call_info(self) -> Dict:
+        return {
+            "chat_id": self.chat_id,
+            "chat_title": self.chat_title,
+            "username": self.username,
+            "join_time": self.join_time,
+            "media_source": self.media_source
+        }
+
+class SessionEntry:
+    """رکورد فشرده یک سشن: اطلاعات ذخیره شده، کلاینت زنده و ویس چت‌هایش"""
+    
+    __slots__ = (
+        "name", "session_string", "phone_number",
+        "client", "call", "last_used", "in_use", "calls"
+    )
+    
+    def __init__(self, name: str, session_string: str, phone_number: str = ""):
+        self.name = name
+        self.session_string = session_string
+        self.phone_number = phone_number
+        self.client: Optional[Client] = None
+        self.call: Optional["PyTgCalls"] = None
+        self.last_used = 0.0
+        # تعداد استفاده‌های همزمان؛ سشن در حال استفاده از LRU خارج نمی‌شود
+        self.in_use = 0
+        # ویس چت‌هایی که اکانت داخل آن‌هاست: None، یک عضویت (حالت رایج) یا chat_id → عضویت؛
+        # دیکشنری فقط وقتی ساخته می‌شود که یک کلاینت همزمان در چند چت باشد تا رکورد داخل کال فشرده بماند
+        self.calls: Optional[Union[CallMembership, Dict[int, CallMembership]]] = None
+    
+    def membership(self, chat_id: int) -> Optional[CallMembership]:
+        calls = self.calls
+        if isinstance(calls, CallMembership):
+            return calls if calls.chat_id == chat_id else None
+        return calls.get(chat_id) if calls else None
+    
+    def memberships(self) -> List[CallMembership]:
+        calls = self.calls
+        if calls is None:
+            return []
+        if isinstance(calls, CallMembership):
+            return [calls]
+        return list(calls.values())
+    
+    def chat_ids(self) -> List[int]:
+        return [membership.chat_id for membership in self.memberships()]
+    
+    def add_membership(self, membership: CallMembership):
+        calls = self.calls
+        if calls is None or (isinstance(calls, CallMembership) and calls.chat_id == membership.chat_id):
+            self.calls = membership
+        elif isinstance(calls, CallMembership):
+            self.calls = {calls.chat_id: calls, membership.chat_id: membership}
+        else:
+            calls[membership.chat_id] = membership
+    
+    def remove_membership(self, chat_id: int) -> Optional[CallMembership]:
+        calls = self.calls
+        if isinstance(calls, CallMembership):
+            if calls.chat_id != chat_id:
+                return None
+            self.calls = None
+            return calls
+        if not calls:
+            return None
+        membership = calls.pop(chat_id, None)
+        # با ماندن یک چت دوباره به حالت فشرده برمی‌گردد
+        if len(calls) <= 1:
+            self.calls = next(iter(calls.values()), None)
+        return membership
+
+class SessionRegistry:
+    """رجیستری سشن‌ها بر اساس نام با ایندکس کلاینت‌های زنده (LRU)، اکانت‌های داخل ویس چت و chat_id"""
+    
+    def __init__(self):
+        self.entries: Dict[str, SessionEntry] = {}
+        # کلاینت‌های زنده به ترتیب استفاده (کم‌استفاده‌ترین در ابتدا)
+        self.live: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        # اکانت‌هایی که حداقل در یک ویس چت هستند و ایندکس chat_id → عضویت هر اکانت
+        self.joined: Dict[str, SessionEntry] = {}
+        self.by_chat: Dict[int, Dict[str, CallMembership]] = {}
+        # (اکانت، چت) هایی که پخش استریمشان تمام شده است
+        self.silent: Set[Tuple[str, int]] = set()
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def __getitem__(self, name: str) -> SessionEntry:
+        return self.entries[name]
+    
+    def get(self, name: str) -> Optional[SessionEntry]:
+        return self.entries.get(name)
+    
+    def add(self, name: str, session_string: str, phone_number: str = "") -> SessionEntry:
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.entries[name] = SessionEntry(name, session_string, phone_number)
+        else:
+            entry.session_string = session_string
+            entry.phone_number = phone_number
+        return entry
+    
+    def remove(self, name: str) -> Optional[SessionEntry]:
+        """حذف سشن از تمام ایندکس‌ها؛ کلاینت آن (اگر هست) روی رکورد می‌ماند تا متوقف شود"""
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.leave(entry)
+            self.live.pop(name, None)
+        return entry
+    
+    def attach(self, entry: SessionEntry, client: Client, call: "PyTgCalls"):
+        entry.client = client
+        entry.call = call
+        self.live[entry.name] = entry
+    
+    def detach(self, entry: SessionEntry) -> Tuple[Optional[Client], Optional["PyTgCalls"]]:
+        """خروج کلاینت از LRU؛ کلاینت و PyTgCalls برای توقف برگردانده می‌شوند"""
+        self.live.pop(entry.name, None)
+        self.leave(entry)
+        client, call = entry.client, entry.call
+        entry.client = entry.call = None
+        return client, call
+    
+    def touch(self, entry: SessionEntry):
+        self.live.move_to_end(entry.name)
+        entry.last_used = time.monotonic()
+    
+    def join(self, entry: SessionEntry, chat_id: int, chat_title: str, media_source: str, join_time: float, username: str = ""):
+        """ثبت عضویت در ویس چت یک چت؛ عضویت اکانت در چت‌های دیگر دست نمی‌خورد"""
+        membership = CallMembership(chat_id, chat_title, username, join_time, media_source)
+        entry.add_membership(membership)
+        self.joined[entry.name] = entry
+        self.by_chat.setdefault(chat_id, {})[entry.name] = membership
+        self.silent.discard((entry.name, chat_id))
+    
+    def leave(self, entry: SessionEntry, chat_id: Optional[int] = None):
+        """حذف عضویت در ویس چت یک چت یا (بدون chat_id) در همه چت‌ها"""
+        for target in ([chat_id] if chat_id is not None else entry.chat_ids()):
+            if entry.remove_membership(target) is None:
+                continue
+            members = self.by_chat.get(target)
+            if members is not None:
+                members.pop(entry.name, None)
+                if not members:
+                    del self.by_chat[target]
+            self.silent.discard((entry.name, target))
+        if not entry.calls:
+            self.joined.pop(entry.name, None)
+    
+    def in_chat(self, chat_id: int) -> List[str]:
+        """نام اکانت‌های داخل ویس چت یک چت، بدون پیمایش سشن‌ها"""
+        return list(self.by_chat.get(chat_id, ()))
+
+# ==================== پایش سلامت اکانت‌ها ====================
+class HealthMonitor:
+    """بررسی دوره‌ای اکانت‌ها در پس‌زمینه؛ هندلرها فقط جدول آماده وضعیت را می‌خوانند"""
+    
+    def __init__(self, manager: "SessionManager"):
+        self.manager = manager
+        # آخرین خطای بررسی شبکه‌ای هر اکانت
+        self.errors: Dict[str, str] = {}
+        self.status_list: List[str] = []
+        self.active_count = 0
+        self.checked_at = 0.0
+        self.dirty = True
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._loop())
+    
+    def request_check(self):
+        """علامت‌گذاری تغییر وضعیت ناوگان؛ جدول بدون درخواست شبکه‌ای بازسازی می‌شود"""
+        self.dirty = True
+        self.wake.set()
+    
+    def snapshot(self) -> Tuple[List[str], int]:
+        """جدول وضعیت آماده؛ بدون پیمایش سشن‌ها وقتی پایش در پس‌زمینه فعال است"""
+        if self.dirty and (self.task is None or self.task.done()):
+            self.rebuild()
+        return self.status_list, self.active_count
+    
+    async def _loop(self):
+        next_probe = 0.0
+        while True:
+            if time.monotonic() >= next_probe:
+                await self.probe_all()
+                next_probe = time.monotonic() + HEALTH_INTERVAL
+            elif self.dirty:
+                self.rebuild()
+            
+            # asyncio.wait (برخلاف wait_for) لغو تسک را هنگام set شدن همزمان event از دست نمی‌دهد
+            waiter = asyncio.ensure_future(self.wake.wait())
+            try:
+                await asyncio.wait([waiter], timeout=max(0.0, next_probe - time.monotonic()))
+            finally:
+                waiter.cancel()
+            self.wake.clear()
+            # تجمیع تغییرات پشت سر هم (مثلاً حین راه‌اندازی صدها اکانت) در یک بازسازی
+            await asyncio.sleep(1)
+    
+    async def probe_all(self):
+        """بررسی شبکه‌ای کلاینت‌های متصل با سقف همزمانی و سپس بازسازی جدول"""
+        semaphore = asyncio.Semaphore(HEALTH_CONCURRENCY)
+        
+        async def probe(name, client):
+            async with semaphore:
+                await self._probe(name, client)
+        
+        connected = [(name, entry.client) for name, entry in list(self.manager.sessions.live.items()) if entry.client.is_connected]
+        await asyncio.gather(*(probe(name, client) for name, client in connected))
+        self.rebuild()
+    
+    async def _probe(self, name: str, client: Client):
+        # کلاینت ممکن است در این فاصله از LRU خارج شده باشد؛ برای بررسی کلاینت جدید ساخته نمی‌شود
+        entry = self.manager.sessions.get(name)
+        if entry is None or entry.client is not client or not client.is_connected:
+            return
+        # فقط سنجاق در برابر آزادسازی هم‌زمان؛ last_used و ترتیب LRU دست نمی‌خورد تا پایش، کلاینت بیکار را زنده نگه ندارد
+        entry.in_use += 1
+        try:
+            async with metrics.track("health_probe"):
+                me = await asyncio.wait_for(limiter.call(name, client.get_me), HEALTH_PROBE_TIMEOUT)
+            self.errors.pop(name, None)
+            await self.manager.identities.update_from_user(name, me)
+        except Exception as e:
+            self.errors[name] = str(e) or type(e).__name__
+        finally:
+            entry.in_use -= 1
+    
+    def rebuild(self):
+        """ساخت جدول وضعیت از حالت فعلی کلاینت‌ها، کال‌ها و نتیجه آخرین بررسی‌ها"""
+        manager = self.manager
+        self.dirty = False
+        status_list = []
+        active_count = 0
+        
+        for name, entry in list(manager.sessions.entries.items()):
+            client = entry.client
+            if client is None or not client.is_connected:
+                status_list.append(f"🔴 {name} - غیرفعال")
+                continue
+            if name in self.errors:
+                status_list.append(f"🔴 {name} - خطا: {self.errors[name]}")
+                continue
+            
+            # عضویت را رویدادهای PyTgCalls به‌روز نگه می‌دارند؛ نیازی به پرس‌وجو نیست
+            chat_ids = entry.chat_ids()
+            calls = len(chat_ids)
+            silent = sum(1 for chat_id in chat_ids if (name, chat_id) in manager.sessions.silent)
+            if not calls:
+                call_status = "💤"
+            else:
+                call_status = "🎧 در ویس چت" if calls == 1 else f"🎧 در {calls} ویس چت"
+                if silent:
+                    call_status += " (پخش تمام شده)" if silent == calls else f" ({silent} بدون پخش)"
+            pytgcalls_status = "🟢" if entry.call.is_connected else "🔴"
+            status_list.append(f"{pytgcalls_status} {name} - {manager.identities.display_name(name)} {call_status}")
+            active_count += 1
+        
+        self.status_list = status_list
+        self.active_count = active_count
+        self.checked_at = time.time()
+
+# ==================== استخر اکانت‌های آماده ====================
+class StandbyPool:
+    """سرپرست STANDBY_SIZE اکانت همیشه متصل و آماده ورود به ویس چت
+    
+    اکانت‌های استخر از LRU خارج نمی‌شوند. اتصال قطع شده در دور بعدی (یا فوراً با request_check)
+    دوباره برقرار می‌شود؛ اکانتی که شکست بخورد با backoff نمایی کنار می‌رود و تا آن زمان
+    اکانت بعدی جای آن را می‌گیرد.
+    """
+    
+    def __init__(self, manager: "SessionManager", size: int = STANDBY_SIZE):
+        self.manager = manager
+        self.size = min(size, MAX_LIVE_CLIENTS)
+        self.members: Set[str] = set()
+        # نام -> [شکست‌های پشت سر هم، زمان مجاز تلاش بعدی]
+        self.backoff: Dict[str, list] = {}
+        self.paused = False
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self.size > 0 and (self.task is None or self.task.done()):
+            metrics.gauge("bot_standby_ready", self.ready_count)
+            self.task = asyncio.create_task(self._loop())
+    
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+    
+    def pause(self):
+        """بعد از توقف دستی اکانت‌ها، استخر آن‌ها را دوباره وصل نمی‌کند"""
+        self.paused = True
+        self.members.clear()
+    
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            self.request_check()
+    
+    def request_check(self):
+        self.wake.set()
+    
+    def is_ready(self, entry: SessionEntry) -> bool:
+        return entry.client is not None and entry.client.is_connected and entry.call.is_connected
+    
+    def ready_count(self) -> int:
+        sessions = self.manager.sessions
+        return sum(1 for name in self.members if name in sessions and self.is_ready(sessions[name]))
+    
+    async def _loop(self):
+        while True:
+            await self.fill()
+            waiter = asyncio.ensure_future(self.wake.wait())
+            try:
+                await asyncio.wait([waiter], timeout=STANDBY_INTERVAL)
+            finally:
+                waiter.cancel()
+            self.wake.clear()
+    
+    def _pick(self) -> Set[str]:
+        """اعضای فعلی (اگر در backoff نیستند) و سپس بقیه سشن‌ها به ترتیب رجیستری"""
+        now = time.monotonic()
+        sessions = self.manager.sessions
+        
+        def available(name):
+            state = self.backoff.get(name)
+            return state is None or state[1] <= now
+        
+        chosen = [name for name in self.members if name in sessions and available(name)]
+        for name in sessions:
+            if len(chosen) >= self.size:
+                break
+            if name not in self.members and available(name):
+                chosen.append(name)
+        return set(chosen[:self.size])
+    
+    async def fill(self):
+        """اتصال همزمان اعضایی از استخر که آماده نیستند"""
+        if self.paused or self.size <= 0:
+            return
+        self.members = self._pick()
+        sessions = self.manager.sessions
+        missing = [name for name in self.members if not self.is_ready(sessions[name])]
+        if not missing:
+            return
+        
+        semaphore = asyncio.Semaphore(START_CONCURRENCY)
+        results = await asyncio.gather(*(self.manager._start_client(name, semaphore) for name in missing))
+        for result in results:
+            name = result["name"]
+            if result["status"] == "success":
+                self.backoff.pop(name, None)
+                continue
+            failures = self.backoff.get(name, [0])[0] + 1
+            delay = min(STANDBY_BACKOFF_MAX, STANDBY_INTERVAL * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+            self.backoff[name] = [failures, time.monotonic() + delay]
+            print(f"❌ استخر آماده: {result['info']}؛ تلاش دوباره تا {delay:.0f} ثانیه دیگر")
+            # جایگزین در دور بعد انتخاب می‌شود
+            self.wake.set()
+        print(f"🔥 استخر آماده: {self.ready_count()}/{len(self.members)} اکانت متصل")
+
+# ==================== اجاره سشن‌ها بین نودها ====================
+# اجاره نود کنترل در همان جدول leases؛ نام سشن‌ها فقط حروف و اعداد است و با این نام یکی نمی‌شود
+CONTROL_LEASE = "@control"
+
+def lease_owner(name: str, nodes: List[str]) -> Optional[str]:
+    """نود صاحب سشن با rendezvous hashing؛ با آمدن یا رفتن یک نود فقط سهم همان نود جابه‌جا می‌شود"""
+    return max(
+        nodes,
+        key=lambda node: hashlib.blake2b(f"{node}/{name}".encode(), digest_size=8).digest(),
+        default=None
+    )
+
+class LeaseManager:
+    """اجاره سشن‌ها در دیتابیس مشترک تا هر سشن فقط روی یک نود اجرا شود
+    
+    هر نود هر LEASE_HEARTBEAT ثانیه ضربان می‌فرستد، سهم خودش از بین نودهای زنده را اجاره
+    یا تمدید می‌کند و فقط همان سشن‌ها را در رجیستری نگه می‌دارد. سشنی که سهم نود دیگری شده
+    اول متوقف و بعد آزاد می‌شود؛ اجاره نودی که از کار افتاده بعد از LEASE_TTL منقضی می‌شود و
+    بقیه آن را برمی‌دارند. ویس چت‌ها در دیتابیس می‌مانند تا صاحب جدید دوباره وارد آن‌ها شود.
+    
+    اجاره CONTROL_LEASE مال اولین نودی است که آن را بگیرد و تا زنده است پیش او می‌ماند؛
+    on_control با گرفتن یا از دست دادن آن صدا زده می‌شود تا ربات فقط روی همان نود اجرا شود.
+    """
+    
+    def __init__(self, manager: "SessionManager", node_id: str = NODE_ID, ttl: float = LEASE_TTL, interval: float = LEASE_HEARTBEAT):
+        self.manager = manager
+        self.node_id = node_id
+        self.ttl = ttl
+        self.interval = interval
+        self.owned: Set[str] = set()
+        self.control = False
+        self.on_control: Optional[Callable] = None
+        self.commands = CommandWorker(manager, node_id)
+        self.nodes: List[str] = []
+        # صاحب هر سشن برای همین فهرست نودها (با تغییر نودها دوباره محاسبه می‌شود)
+        self.assignments: Dict[str, Optional[str]] = {}
+        # سشن‌هایی که در حال توقف برای تحویل هستند
+        self.moving: Set[str] = set()
+        self.started = False
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.node_id)
+    
+    async def start(self):
+        """اولین تقسیم قبل از راه‌اندازی هر سشن؛ تمدید و تقسیم دوباره در پس‌زمینه"""
+        if not self.enabled:
+            return
+        if self.ttl <= self.interval:
+            print(f"⚠️ LEASE_TTL ({self.ttl:.0f}) باید بیشتر از LEASE_HEARTBEAT ({self.interval:.0f}) باشد")
+        print(f"🖧 نود {self.node_id} روی {self.manager.storage.backend.label}")
+        await self.reconcile()
+        self.started = True
+        metrics.gauge("bot_leased_sessions", lambda: len(self.owned))
+        metrics.gauge("bot_live_nodes", lambda: len(self.nodes))
+        self.task = asyncio.create_task(self._loop())
+        self.commands.start()
+    
+    async def elect(self) -> bool:
+        """ضربان و تلاش برای گرفتن اجاره کنترل قبل از اتصال ربات"""
+        storage = self.manager.storage
+        now = time.time()
+        self.nodes = await storage.heartbeat(self.node_id, now, self.ttl)
+        owned = await storage.claim_leases(self.node_id, [CONTROL_LEASE], now, self.ttl)
+        await self._set_control(CONTROL_LEASE in owned)
+        return self.control
+    
+    async def stop(self):
+        """آزاد کردن همه اجاره‌ها (و کنترل) تا نودهای دیگر بدون انتظار برای انقضا آن‌ها را بردارند"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        self.task = None
+        self.commands.stop()
+        try:
+            await self.manager.storage.release_leases(self.node_id)
+        except Exception as e:
+            print(f"❌ خطا در آزاد کردن اجاره‌ها: {e}")
+        self.owned.clear()
+    
+    async def _set_control(self, control: bool):
+        if control == self.control:
+            return
+        print(f"🖧 نود {self.node_id} {'کنترل ربات را گرفت' if control else 'دیگر نود کنترل نیست'}")
+        try:
+            if self.on_control is not None:
+                await self.on_control(control)
+        except Exception as e:
+            print(f"❌ خطا در تغییر نود کنترل: {e}")
+            if control:
+                # نود دیگری باید بتواند کنترل را بگیرد
+                await self.manager.storage.release_leases(self.node_id, [CONTROL_LEASE])
+                return
+        self.control = control
+    
+    def request_check(self):
+        self.wake.set()
+    
+    async def _loop(self):
+        while True:
+            waiter = asyncio.ensure_future(self.wake.wait())
+            try:
+                await asyncio.wait([waiter], timeout=self.interval)
+            finally:
+                waiter.cancel()
+            self.wake.clear()
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"❌ خطا در تمدید اجاره سشن‌ها: {e}")
+    
+    def _owner(self, name: str) -> Optional[str]:
+        owner = self.assignments.get(name)
+        if owner is None:
+            owner = self.assignments[name] = lease_owner(name, self.nodes)
+        return owner
+    
+    async def reconcile(self):
+        storage = self.manager.storage
+        now = time.time()
+        nodes = await storage.heartbeat(self.node_id, now, self.ttl, json.dumps(self.manager.snapshot()))
+        if nodes != self.nodes:
+            if self.nodes:
+                print(f"🖧 نودهای زنده: {len(self.nodes)} → {len(nodes)}")
+            self.nodes = nodes
+            self.assignments.clear()
+        
+        wanted = [name for name in await storage.session_names() if self._owner(name) == self.node_id]
+        owned = await storage.claim_leases(self.node_id, wanted + [CONTROL_LEASE], now, self.ttl)
+        await self._set_control(CONTROL_LEASE in owned)
+        owned.discard(CONTROL_LEASE)
+        self.owned = owned
+        keep = owned.intersection(wanted)
+        local = set(self.manager.sessions)
+        
+        # سهم نودهای دیگر و اجاره‌های از دست رفته؛ فقط اجاره‌هایی که دست ما بود آزاد می‌شوند
+        drop = (local - keep) - self.moving
+        release = (owned - keep) - self.moving
+        if drop or release:
+            self.moving.update(drop | release)
+            task = asyncio.create_task(self._hand_off(drop, release))
+            if not self.started:
+                # در راه‌اندازی هنوز کلاینتی ساخته نشده و حذف فوری است
+                await task
+        
+        added = keep - local - self.moving
+        if added:
+            await self._adopt(added)
+    
+    async def _hand_off(self, drop: Set[str], release: Set[str]):
+        try:
+            entries = [self.manager.sessions[name] for name in drop if name in self.manager.sessions]
+            live = [entry for entry in entries if entry.client is not None]
+            if live:
+                # ویس چت‌ها در دیتابیس می‌مانند تا نود جدید دوباره وارد شود
+                await self.manager._stop_sessions(live, keep_calls=True)
+            for entry in entries:
+                await self.manager.forget_session(entry.name)
+            if release:
+                await self.manager.storage.release_leases(self.node_id, list(release))
+            if self.started:
+                metrics.inc("bot_lease_handoffs_total", value=len(drop | release))
+                print(f"🖧 {len(drop | release)} سشن به نودهای دیگر رسید")
+        except Exception as e:
+            print(f"❌ خطا در تحویل سشن‌ها: {e}")
+        finally:
+            self.moving.difference_update(drop | release)
+    
+    async def _adopt(self, names: Set[str]):
+        """ثبت سشن‌های تازه اجاره شده و (بعد از راه‌اندازی) بازگشت آن‌ها به ویس چت‌هایشان"""
+        storage = self.manager.storage
+        for name, session_string, phone_number, first_name, username, user_id, updated_at in await storage.load_sessions():
+            if name in names:
+                self.manager.sessions.add(name, session_string, phone_number)
+                self.manager.identities.seed(name, first_name, username, user_id, updated_at)
+        self.manager.peers.load(row for row in await storage.run(storage._load_peers) if row[0] in names)
+        self.manager.health.request_check()
+        if self.started:
+            print(f"🖧 {len(names)} سشن به این نود رسید")
+            jobs.submit(
+                "resume", f"بازگشت {len(names)} سشن اجاره‌شده به ویس چت‌ها",
+                functools.partial(self.manager.resume_calls, tuple(sorted(names))),
+                self._report_resume
+            )
+    
+    async def _report_resume(self, job: "Job"):
+        # شکست کار را خود JobManager ثبت می‌کند
+        if job.status == "done":
+            results, successful = job.result
+            print(f"🖧 بازگشت سشن‌های اجاره‌شده: {successful}/{len(results)} عضویت برگشت")
+
+# عملیاتی که نود کنترل می‌تواند روی همه نودها اجرا کند (خاموشی مال خود هر نود است)
+CLUSTER_OPS = {
+    "start_all_clients", "stop_all_clients", "get_status", "join_voice_chat",
+    "leave_all_voice_chats", "forget_session", "resume_calls", "rebalance"
+}
+
+class CommandWorker:
+    """اجرای فرمان‌هایی که نود کنترل در دیتابیس مشترک برای این نود ثبت کرده است"""
+    
+    def __init__(self, manager: "SessionManager", node_id: str, interval: float = COMMAND_POLL):
+        self.manager = manager
+        self.node_id = node_id
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        self.running: Set[asyncio.Task] = set()
+    
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+    
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in self.running:
+            task.cancel()
+    
+    async def _loop(self):
+        while True:
+            try:
+                # فرمان‌هایی که نود کنترل دیگر منتظرشان نیست اجرا نمی‌شوند
+                for command_id, op, args in await self.manager.storage.take_commands(self.node_id, time.time() - COMMAND_TIMEOUT):
+                    task = asyncio.create_task(self._run(command_id, op, json.loads(args)))
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+            except Exception as e:
+                print(f"❌ خطا در خواندن فرمان‌های نود: {e}")
+            await asyncio.sleep(self.interval)
     
-    def get_session(self, name: str):
-        """دریافت سشن خاص از دیتابیس"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.execute('SELECT session_string FROM sessions WHERE name = ?', (name,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+    async def _run(self, command_id: str, op: str, args: List):
+        response = {}
+        try:
+            if op not in CLUSTER_OPS:
+                raise ValueError(f"عملیات نامعتبر: {op}")
+            result = getattr(self.manager, op)(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            response["result"] = result
+        except Exception as e:
+            response["error"] = str(e)
+        response["snapshot"] = self.manager.snapshot()
+        try:
+            await self.manager.storage.finish_command(command_id, self.node_id, json.dumps(response))
+        except Exception as e:
+            print(f"❌ خطا در ثبت نتیجه فرمان {op}: {e}")
 
-# ==================== مدیریت وضعیت کاربران ====================
-class UserState:
-    def __init__(self):
-        self.states = {}
+# ==================== ورود گروهی سشن‌ها ====================
+def parse_session_file(content: bytes, filename: str = "") -> Tuple[List[Dict], List[str]]:
+    """خواندن رکوردهای سشن از فایل JSON یا CSV؛ رکوردهای معتبر و خطای بقیه برگردانده می‌شوند"""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("فایل باید با کدگذاری UTF-8 باشد")
     
-    def set_state(self, user_id, state, data=None):
-        self.states[user_id] = {"state": state, "data": data or {}}
+    if filename.lower().endswith(".csv") or not text.lstrip().startswith(("[", "{")):
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        try:
+            rows = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON نامعتبر: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get("sessions", [])
+        if not isinstance(rows, list):
+            raise ValueError("فایل JSON باید لیستی از سشن‌ها باشد")
     
-    def get_state(self, user_id):
-        return self.states.get(user_id)
+    records, errors, seen = [], [], set()
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            errors.append(f"❌ ردیف {number}: فرمت نامعتبر")
+            continue
+        name = str(row.get("name") or "").strip()
+        session_string = str(row.get("session_string") or "").strip()
+        if not name.replace("_", "").isalnum():
+            errors.append(f"❌ ردیف {number}: نام سشن نامعتبر ({name or '---'})")
+        elif not session_string:
+            errors.append(f"❌ ردیف {number}: سشن استرینگ خالی است ({name})")
+        elif name in seen:
+            errors.append(f"⏭ ردیف {number}: نام تکراری در فایل ({name})")
+        else:
+            seen.add(name)
+            records.append({
+                "name": name,
+                "session_string": session_string,
+                "phone_number": str(row.get("phone_number") or ""),
+                "first_name": "",
+                "username": "",
+                "user_id": None
+            })
     
-    def clear_state(self, user_id):
-        if user_id in self.states:
-            del self.states[user_id]
-
-user_state = UserState()
+    if not records and not errors:
+        raise ValueError("هیچ سشنی در فایل پیدا نشد")
+    return records, errors
 
 # ==================== مدیریت سشن‌ها و ویس چت ====================
+CALL_EVENT_LABELS = {
+    "kicked": "از گروه اخراج شد",
+    "left": "گروه را ترک کرد",
+    "closed": "ویس چت بسته شد",
+    "stream_end": "پخش تمام شد"
+}
+
+def churn_count(counts: Dict[str, int]) -> int:
+    """تعداد خروج‌های ناخواسته (اخراج، ترک گروه، بسته شدن کال) از روی شمارش رویدادها"""
+    return sum(value for event, value in counts.items() if event != "stream_end")
+
 class SessionManager:
     def __init__(self):
         self.storage = SessionStorage()
-        self.clients: List[Client] = []
-        self.calls: Dict[str, PyTgCalls] = {}
-        self.active_calls: Dict[str, Dict] = {}
-        self.voice_chat_sessions: Dict[str, Dict] = {}
+        self.identities = IdentityCache(self.storage)
+        self.peers = PeerCache(self.storage)
+        self.group_calls = GroupCallCache()
+        self.health = HealthMonitor(self)
+        self.standby = StandbyPool(self)
+        self.leases = LeaseManager(self)
+        self.join_latency = LatencySamples("bot_join_latency_seconds")
+        # رکورد سبک تمام سشن‌ها؛ کلاینت فقط هنگام نیاز ساخته می‌شود
+        self.sessions = SessionRegistry()
+        self.locks = SessionLocks()
+        self.flights = SingleFlight()
+        # شمارش رویدادهای کال هر چت برای دیدن ریزش اکانت‌ها
+        self.call_events: Dict[int, Dict[str, int]] = {}
+        # در پروسه کاری، تغییر عضویت فوراً به پروسه اصلی اطلاع داده می‌شود
+        self.on_call_event: Optional[Callable[[], None]] = None
+        self.reaper_task: Optional[asyncio.Task] = None
         self.load_sessions()
     
     def load_sessions(self):
-        """بارگذاری سشن‌ها از دیتابیس"""
-        sessions = self.storage.load_sessions()
+        """بارگذاری رکورد سشن‌ها از دیتابیس (بدون ساخت کلاینت)"""
+        sessions = self.storage.run_sync(self.storage._load_sessions)
         print(f"📁 پیدا شد {len(sessions)} سشن در دیتابیس")
         
-        for name, session_string, phone_number, first_name, username in sessions:
-            try:
-                client = Client(
-                    name=name,
-                    api_id=API_ID,
-                    api_hash=API_HASH,
-                    session_string=session_string,
-                    in_memory=True
-                )
-                self.clients.append(client)
-                
-                # ایجاد PyTgCalls برای هر کلاینت
-                call = PyTgCalls(client)
-                self.calls[name] = call
-                
-                print(f"✅ سشن {name} بارگذاری شد - {first_name or 'Unknown'} ({phone_number})")
-            except Exception as e:
-                print(f"❌ خطا در بارگذاری {name}: {e}")
+        for name, session_string, phone_number, first_name, username, user_id, updated_at in sessions:
+            self.sessions.add(name, session_string, phone_number)
+            self.identities.seed(name, first_name, username, user_id, updated_at)
+        
+        self.peers.load(self.storage.run_sync(self.storage._load_peers))
+    
+    async def acquire(self, name: str) -> Tuple[Client, "PyTgCalls"]:
+        """دریافت کلاینت زنده یک سشن؛ در صورت نیاز ساخته و وارد LRU می‌شود"""
+        entry = self.sessions[name]
+        if entry.client is None:
+            client = Client(
+                name=name,
+                api_id=API_ID,
+                api_hash=API_HASH,
+                session_string=entry.session_string,
+                in_memory=True
+            )
+            
+            # ایجاد PyTgCalls برای کلاینت
+            call = load_voice_backend()(client)
+            self._watch_call(name, call)
+            self.sessions.attach(entry, client, call)
+            print(f"✅ سشن {name} بارگذاری شد - {self.identities.display_name(name)} ({entry.phone_number})")
+        
+        self.sessions.touch(entry)
+        await self._enforce_capacity()
+        return entry.client, entry.call
+    
+    def _watch_call(self, name: str, call: "PyTgCalls"):
+        """ثبت هندلرهای رویداد PyTgCalls تا عضویت ویس چت بدون پرس‌وجو به‌روز بماند"""
+        @call.on_kicked()
+        async def on_kicked(_, chat_id: int):
+            await self._on_call_event(name, "kicked", chat_id)
+        
+        @call.on_left()
+        async def on_left(_, chat_id: int):
+            await self._on_call_event(name, "left", chat_id)
+        
+        @call.on_closed_voice_chat()
+        async def on_closed(_, chat_id: int):
+            await self._on_call_event(name, "closed", chat_id)
+        
+        @call.on_stream_end()
+        async def on_stream_end(_, update):
+            await self._on_call_event(name, "stream_end", update.chat_id)
+    
+    async def _on_call_event(self, name: str, event: str, chat_id: int):
+        """به‌روزرسانی عضویت همان لحظه‌ای که سرور تغییر را گزارش می‌کند"""
+        if event == "stream_end" and await self._loop_silence(name, chat_id):
+            return
+        # شمارش هر چت فقط در call_events؛ لیبل chat_id کاردینالیتی متریک را بی‌حد می‌کند
+        metrics.inc("bot_call_events_total", {"event": event})
+        counts = self.call_events.setdefault(chat_id, {})
+        counts[event] = counts.get(event, 0) + 1
+        if event == "closed":
+            self.group_calls.set(chat_id, False)
+        
+        # رویداد مربوط به چتی که اکانت (دیگر) در آن ثبت نشده فقط شمرده می‌شود
+        entry = self.sessions.get(name)
+        membership = entry.membership(chat_id) if entry is not None else None
+        if membership is None:
+            return
+        
+        if event == "stream_end":
+            # اکانت هنوز داخل کال است، فقط چیزی پخش نمی‌کند
+            self.sessions.silent.add((name, chat_id))
+        else:
+            print(f"⚠️ {name}: {CALL_EVENT_LABELS[event]} ({membership.chat_title})")
+            self.sessions.leave(entry, chat_id)
+            await self.storage.delete_call(name, chat_id)
+        
+        self.health.request_check()
+        if self.on_call_event is not None:
+            self.on_call_event()
+    
+    async def _loop_silence(self, name: str, chat_id: int) -> bool:
+        """فایل سکوت کوتاه است و در پایانش از ابتدا دوباره پخش می‌شود؛ False یعنی پخش واقعاً تمام شد"""
+        entry = self.sessions.get(name)
+        membership = entry.membership(chat_id) if entry is not None else None
+        if membership is None or membership.media_source != "silence" or entry.call is None:
+            return False
+        try:
+            async with metrics.track("change_stream"):
+                await entry.call.change_stream(chat_id, build_media_stream("silence"))
+            return True
+        except Exception as e:
+            print(f"❌ {name}: پخش دوباره سکوت ناموفق بود: {describe_error(e)}")
+            return False
+    
+    @asynccontextmanager
+    async def use_session(self, name: str):
+        """استفاده از کلاینت یک سشن؛ در طول استفاده از LRU خارج نمی‌شود"""
+        client, call = await self.acquire(name)
+        entry = self.sessions[name]
+        entry.in_use += 1
+        try:
+            yield client, call
+        finally:
+            entry.in_use -= 1
+            if entry.client is not None:
+                entry.last_used = time.monotonic()
+            self.health.request_check()
+            await self._enforce_capacity()
+    
+    def _is_pinned(self, entry: SessionEntry) -> bool:
+        """کلاینت‌های در حال استفاده یا داخل ویس چت نباید آزاد شوند"""
+        return entry.in_use > 0 or bool(entry.calls) or entry.name in self.standby.members
+    
+    async def _enforce_capacity(self):
+        """آزادسازی کم‌استفاده‌ترین کلاینت‌های بیکار وقتی LRU پر است"""
+        overflow = len(self.sessions.live) - MAX_LIVE_CLIENTS
+        if overflow <= 0:
+            return
+        
+        # آخرین کلاینت همان است که الان درخواست شده
+        candidates = [entry for entry in list(self.sessions.live.values())[:-1] if not self._is_pinned(entry)]
+        for entry in candidates[:overflow]:
+            await self._evict(entry)
+    
+    async def _evict(self, entry: SessionEntry):
+        """قطع اتصال و حذف کلاینت از LRU"""
+        client, call = self.sessions.detach(entry)
+        self.health.errors.pop(entry.name, None)
+        self.health.request_check()
+        
+        try:
+            if call is not None and call.is_connected:
+                await call.stop()
+            if client is not None and client.is_connected:
+                await client.stop()
+        except Exception as e:
+            print(f"❌ خطا در آزادسازی {entry.name}: {e}")
+    
+    def start_idle_reaper(self):
+        """شروع تسک پس‌زمینه آزادسازی کلاینت‌های بیکار"""
+        if self.reaper_task is None or self.reaper_task.done():
+            self.reaper_task = asyncio.create_task(self._idle_reaper())
+    
+    async def _idle_reaper(self):
+        """آزادسازی دوره‌ای کلاینت‌هایی که بیش از CLIENT_IDLE_TTL بیکار مانده‌اند"""
+        interval = max(CLIENT_IDLE_TTL / 4, 5)
+        while True:
+            await asyncio.sleep(interval)
+            deadline = time.monotonic() - CLIENT_IDLE_TTL
+            idle = [entry for entry in self.sessions.live.values() if entry.last_used < deadline and not self._is_pinned(entry)]
+            for entry in idle:
+                await self._evict(entry)
+                print(f"💤 کلاینت بیکار {entry.name} آزاد شد")
     
+    @single_flight
     async def start_all_clients(self):
-        """راه‌اندازی تمام کلاینت‌ها و PyTgCalls"""
+        """راه‌اندازی همزمان تمام کلاینت‌ها و PyTgCalls با محدودیت همزمانی"""
         print("🔄 راه‌اندازی اکانت‌ها و ویس چت...")
-        results = []
+        self.standby.resume()
+        semaphore = asyncio.Semaphore(START_CONCURRENCY)
+        # بیش از سقف LRU وصل نمی‌شود، وگرنه اکانت‌های تازه راه‌افتاده همان لحظه آزاد می‌شدند؛
+        # کلاینت‌های ثابت (داخل ویس چت یا استخر آماده) و زنده اول جا می‌گیرند
+        names = sorted(self.sessions, key=lambda name: (
+            not (name in self.sessions.live and self._is_pinned(self.sessions[name])),
+            name not in self.sessions.live
+        ))
+        names, deferred = names[:MAX_LIVE_CLIENTS], names[MAX_LIVE_CLIENTS:]
+        progress = ProgressCounter(len(names))
+        
+        async def start_one(name):
+            result = await self._start_client(name, semaphore)
+            progress.step(result["info"], result["status"] == "success")
+            return result
         
-        for client in self.clients:
-            session_name = client.name
+        results = list(await asyncio.gather(*(start_one(name) for name in names)))
+        if deferred:
+            print(f"⏸ {len(deferred)} اکانت بیش از سقف {MAX_LIVE_CLIENTS} کلاینت زنده است و در اولین استفاده وصل می‌شود")
+        results.extend(
+            {"name": name, "status": "deferred", "info": f"⏸ {name} - بیش از سقف {MAX_LIVE_CLIENTS} کلاینت زنده؛ در اولین استفاده وصل می‌شود"}
+            for name in deferred
+        )
+        return results
+    
+    async def _start_client(self, session_name: str, semaphore: asyncio.Semaphore) -> Dict:
+        """راه‌اندازی یک اکانت با تایم‌اوت؛ FloodWait فقط همین اکانت را متوقف می‌کند"""
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
             try:
-                if not client.is_connected:
-                    await client.start()
-                
-                # راه‌اندازی PyTgCalls
-                call = self.calls[session_name]
-                if not call.is_connected:
-                    await call.start()
-                
-                me = await client.get_me()
-                status = f"🟢 {session_name} - {me.first_name} (ویس چت فعال)"
-                results.append({"name": session_name, "status": "success", "info": status})
-                
+                # انتظار برای توکن (و پایان FloodWait قبلی) بیرون از سمافور تا بقیه اکانت‌ها معطل نشوند
+                await limiter.acquire(session_name)
+                async with self.locks.hold(session_name), semaphore:
+                    async with self.use_session(session_name) as (client, call):
+                        await asyncio.wait_for(self._start_session(session_name, client, call), START_TIMEOUT)
+                limiter.on_success(session_name)
+                status = f"🟢 {session_name} - {self.identities.display_name(session_name)} (ویس چت فعال)"
+                return {"name": session_name, "status": "success", "info": status}
+            
+            except FloodWait as e:
+                limiter.on_flood(session_name, e.value)
+                if attempt == FLOOD_WAIT_RETRIES or e.value > FLOOD_WAIT_MAX:
+                    return {"name": session_name, "status": "error", "info": f"🔴 {session_name} - FloodWait: {e.value} ثانیه"}
+            
+            except asyncio.TimeoutError:
+                return {"name": session_name, "status": "error", "info": f"🔴 {session_name} - خطا: تایم‌اوت ({START_TIMEOUT:.0f} ثانیه)"}
+            
             except Exception as e:
-                results.append({"name": session_name, "status": "error", "info": f"🔴 {session_name} - خطا: {str(e)}"})
+                return {"name": session_name, "status": "error", "info": f"🔴 {session_name} - خطا: {str(e)}"}
+    
+    async def _start_session(self, session_name: str, client: Client, call: "PyTgCalls"):
+        """اتصال کلاینت و PyTgCalls و بروزرسانی کش هویت"""
+        if not client.is_connected:
+            async with metrics.track("client_start"):
+                await client.start()
+            # pyrogram هنگام start اطلاعات اکانت را در client.me نگه می‌دارد
+            if getattr(client, "me", None) is not None:
+                await self.identities.update_from_user(session_name, client.me)
         
-        return results
+        # راه‌اندازی PyTgCalls
+        if not call.is_connected:
+            async with metrics.track("call_start"):
+                await call.start()
+        
+        if self.identities.is_stale(session_name):
+            await self.identities.refresh(session_name, client)
     
+    @single_flight
     async def stop_all_clients(self):
-        """توقف تمام کلاینت‌ها"""
+        """توقف همزمان تمام کلاینت‌ها با سقف همزمانی و تایم‌اوت برای هر سشن"""
         print("⏹ توقف اکانت‌ها...")
-        results = []
+        self.standby.pause()
+        results, _ = await self._stop_sessions(list(self.sessions.live.values()))
+        self.health.request_check()
+        return results
+    
+    async def shutdown(self, deadline: float) -> List[str]:
+        """توقف همه سشن‌ها تا مهلت مشخص؛ نام سشن‌هایی که رها شدند برگردانده می‌شود"""
+        started = time.monotonic()
+        self.standby.stop()
+        # یک ثانیه از مهلت برای آزاد کردن اجاره‌ها بعد از توقف سشن‌ها می‌ماند
+        reserve = min(1.0, deadline / 2) if self.leases.enabled else 0.0
+        # ویس چت‌ها در دیتابیس می‌مانند تا بعد از ری‌استارت (یا روی نود دیگر) دوباره وارد شوند
+        _, abandoned = await self._stop_sessions(list(self.sessions.live.values()), deadline - reserve, keep_calls=True)
+        try:
+            await asyncio.wait_for(self.leases.stop(), max(0.0, deadline - (time.monotonic() - started)))
+        except asyncio.TimeoutError:
+            print(f"⏱ اجاره‌ها در مهلت خاموشی آزاد نشدند؛ بعد از {self.leases.ttl:.0f} ثانیه منقضی می‌شوند")
+        return abandoned
+    
+    async def _stop_sessions(self, entries: List[SessionEntry], deadline: Optional[float] = None, keep_calls: bool = False) -> Tuple[List[str], List[str]]:
+        """توقف همزمان چند سشن؛ سشن‌هایی که در STOP_TIMEOUT یا تا پایان مهلت کل تمام نشدند رها می‌شوند"""
+        semaphore = asyncio.Semaphore(STOP_CONCURRENCY)
+        progress = ProgressCounter(len(entries))
+        timed_out = set()
         
-        # خروج از ویس چت‌ها
-        for session_name in list(self.active_calls.keys()):
-            try:
-                await self._leave_voice_chat(session_name)
-                results.append(f"🔇 {session_name} از ویس چت خارج شد")
-            except Exception as e:
-                results.append(f"❌ خطا در خروج {session_name}: {e}")
+        async def stop_one(entry):
+            async with semaphore:
+                try:
+                    lines, ok = await asyncio.wait_for(self._stop_session(entry, keep_calls), STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    timed_out.add(entry.name)
+                    lines, ok = [f"⏱ {entry.name}: تایم‌اوت توقف ({STOP_TIMEOUT:.0f} ثانیه)"], False
+            progress.step(lines[-1], ok)
+            return lines
         
-        # توقف PyTgCalls
-        for session_name, call in self.calls.items():
+        tasks = [(entry, asyncio.create_task(stop_one(entry))) for entry in entries]
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait([task for _, task in tasks], timeout=deadline)
+        
+        results, abandoned = [], []
+        for entry, task in tasks:
+            if task in pending:
+                task.cancel()
+                abandoned.append(entry.name)
+                results.append(f"⏱ {entry.name}: به دلیل پایان مهلت رها شد")
+                continue
+            results.extend(task.result())
+            if entry.name in timed_out:
+                abandoned.append(entry.name)
+        return results, abandoned
+    
+    async def _stop_session(self, entry: SessionEntry, keep_calls: bool = False) -> Tuple[List[str], bool]:
+        """خروج از ویس چت، توقف PyTgCalls و توقف کلاینت یک سشن"""
+        async with self.locks.hold(entry.name):
+            lines, ok = [], True
+            
+            # خروج از ویس چت‌ها
+            if entry.calls:
+                try:
+                    await self._leave_voice_chat(entry.name, forget=not keep_calls)
+                    lines.append(f"🔇 {entry.name} از ویس چت خارج شد")
+                except Exception as e:
+                    lines.append(f"❌ خطا در خروج {entry.name}: {e}")
+                    ok = False
+            
+            # توقف PyTgCalls
+            call = entry.call
             try:
-                if call.is_connected:
+                if call is not None and call.is_connected:
                     await call.stop()
-                    results.append(f"⏹️ ویس چت {session_name} متوقف شد")
+                    lines.append(f"⏹️ ویس چت {entry.name} متوقف شد")
             except Exception as e:
-                results.append(f"❌ خطا در توقف ویس چت {session_name}: {e}")
-        
-        # توقف کلاینت‌ها
-        for client in self.clients:
+                lines.append(f"❌ خطا در توقف ویس چت {entry.name}: {e}")
+                ok = False
+            
+            # توقف کلاینت
+            client = entry.client
             try:
-                if client.is_connected:
+                if client is not None and client.is_connected:
                     await client.stop()
-                    results.append(f"⏹️ {client.name} متوقف شد")
+                    lines.append(f"⏹️ {entry.name} متوقف شد")
                 else:
-                    results.append(f"ℹ️ {client.name} از قبل متوقف بود")
+                    lines.append(f"ℹ️ {entry.name} از قبل متوقف بود")
             except Exception as e:
-                results.append(f"❌ خطا در توقف {client.name}: {e}")
-        
-        return results
+                lines.append(f"❌ خطا در توقف {entry.name}: {e}")
+                ok = False
+            
+            return lines, ok
     
-    async def get_status(self):
-        """دریافت وضعیت تمام اکانت‌ها"""
-        status_list = []
-        active_count = 0
-        
-        for client in self.clients:
-            session_name = client.name
-            try:
-                if client.is_connected:
-                    me = await client.get_me()
-                    call_status = "🎧 در ویس چت" if session_name in self.active_calls else "💤"
-                    
-                    # بررسی وضعیت PyTgCalls
-                    call = self.calls.get(session_name)
-                    pytgcalls_status = "🟢" if call and call.is_connected else "🔴"
-                    
-                    status_list.append(f"{pytgcalls_status} {session_name} - {me.first_name} {call_status}")
-                    active_count += 1
-                else:
-                    status_list.append(f"🔴 {session_name} - غیرفعال")
-            except Exception as e:
-                status_list.append(f"🔴 {session_name} - خطا: {str(e)}")
+    async def get_status(self, chat_id: Optional[int] = None):
+        """وضعیت تمام اکانت‌ها از جدول پایش سلامت یا (با chat_id) اکانت‌های یک ویس چت، بدون درخواست شبکه‌ای"""
+        if chat_id is None:
+            return self.health.snapshot()
         
-        return status_list, active_count
+        status_list = []
+        for name in self.sessions.in_chat(chat_id):
+            icon = "🔇" if (name, chat_id) in self.sessions.silent else "🎧"
+            status_list.append(f"{icon} {name} - {self.identities.display_name(name)}")
+        return status_list, len(status_list)
     
-    async def join_voice_chat(self, voice_chat_link: str):
+    @single_flight
+    async def join_voice_chat(self, voice_chat_link: str, media_source: Optional[str] = None):
         """ورود واقعی به ویس چت با PyTgCalls"""
         results = []
         successful = 0
@@ -232,53 +2534,106 @@ class SessionManager:
             
             print(f"🔗 تشخیص داده شد: username={username}")
             
-            for client in self.clients:
-                session_name = client.name
-                try:
-                    if not client.is_connected:
-                        await client.start()
-                    
-                    # راه‌اندازی PyTgCalls اگر متصل نیست
-                    call = self.calls[session_name]
-                    if not call.is_connected:
-                        await call.start()
-                    
-                    # گرفتن اطلاعات چت
-                    chat = await client.get_chat(username)
-                    print(f"📱 چت پیدا شد: {chat.title} (ID: {chat.id})")
-                    
-                    # اتصال به ویس چت
-                    success = await self._connect_to_voice_chat(client, call, chat.id, session_name)
-                    
-                    if success:
-                        self.active_calls[session_name] = {
-                            'chat_id': chat.id,
-                            'chat_title': chat.title,
-                            'join_time': asyncio.get_event_loop().time(),
-                            'client': client,
-                            'call': call
-                        }
-                        me = await client.get_me()
-                        results.append(f"✅ {me.first_name} به ویس چت پیوست")
-                        successful += 1
-                    else:
-                        me = await client.get_me()
-                        results.append(f"❌ {me.first_name}: نتوانست به ویس چت بپیوندد")
-                    
-                    await asyncio.sleep(2)  # تأخیر بین اتصال اکانت‌ها
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"❌ خطا برای {session_name}: {error_msg}")
-                    results.append(f"❌ {session_name}: {error_msg}")
+            # دستور دستی مالک یعنی احتمالاً ویس چت تازه شروع شده؛ نتیجه منفی قبلی و مدار باز کنار می‌روند
+            for chat_id in self.peers.chat_ids(username):
+                self.group_calls.forget(chat_id)
+                breakers.reset(chat_id)
+            
+            # سرعت ورود را محدودیت نرخ تعیین می‌کند، نه تأخیر ثابت بین اکانت‌ها
+            # اکانت‌های آماده اول نوبت می‌گیرند تا اولین ورودها بدون اتصال سرد انجام شوند
+            self.standby.resume()
+            names = sorted(self.sessions, key=lambda name: name not in self.standby.members)
+            progress = ProgressCounter(len(names))
+            semaphore = asyncio.Semaphore(START_CONCURRENCY)
+            
+            async def join_one(session_name):
+                async with semaphore:
+                    text, success, _ = await self._join_session(session_name, username, media_source)
+                progress.step(text, success)
+                return text, success
+            
+            for text, success in await asyncio.gather(*(join_one(name) for name in names)):
+                results.append(text)
+                successful += success
                         
         except Exception as e:
-            error_msg = f"❌ خطا در پردازش لینک: {str(e)}"
+            # خطای برنامه‌نویسی (مثلاً امضای اشتباه join_group_call) کل دسته را متوقف می‌کند
+            error_msg = f"❌ خطا در ورود به ویس چت: {describe_error(e)}"
             print(error_msg)
             return [error_msg], 0
         
         return results, successful
     
+    @single_flight
+    async def resume_calls(self, names: Optional[Tuple[str, ...]] = None):
+        """ورود دوباره همزمان (با رعایت محدودیت نرخ) به ویس چت‌هایی که قبل از ری‌استارت فعال بودند"""
+        rows = [
+            row for row in await self.storage.load_calls()
+            if row[0] in self.sessions and (names is None or row[0] in names)
+        ]
+        if not rows:
+            return [], 0
+        
+        print(f"🔁 بازگشت {len(rows)} عضویت (اکانت × ویس چت) به ویس چت‌ها...")
+        progress = ProgressCounter(len(rows))
+        semaphore = asyncio.Semaphore(START_CONCURRENCY)
+        
+        async def resume_one(row):
+            session_name, chat_id, chat_title, username, join_time, media_source = row
+            async with semaphore:
+                text, success, error = await self._join_session(session_name, username, media_source, join_time)
+            # ردیف فقط وقتی حذف می‌شود که ویس چت یا اکانت واقعاً از بین رفته باشد
+            if not success and join_retry.is_gone(error):
+                await self.storage.delete_call(session_name, chat_id)
+            progress.step(text, success)
+            return text, success
+        
+        results, successful = [], 0
+        for text, success in await asyncio.gather(*(resume_one(row) for row in rows)):
+            results.append(text)
+            successful += success
+        return results, successful
+    
+    async def _join_session(self, session_name: str, username: str, media_source: Optional[str], join_time: Optional[float] = None) -> Tuple[str, bool, Optional[Exception]]:
+        """ورود یک اکانت به ویس چت؛ متن نتیجه، موفقیت و خطای شکست را برمی‌گرداند"""
+        try:
+            entry = self.sessions[session_name]
+            started = time.perf_counter()
+            async with self.locks.hold(session_name), self.use_session(session_name) as (client, call):
+                # اکانت آماده مستقیم به join_group_call می‌رود؛ بدون start و get_me
+                warm = client.is_connected and call.is_connected
+                if not warm:
+                    await self._start_session(session_name, client, call)
+                
+                # گرفتن اطلاعات چت (از کش در صورت وجود)
+                chat = await self.peers.resolve(session_name, client, username)
+                print(f"📱 چت پیدا شد: {chat['title']} (ID: {chat['chat_id']})")
+                
+                # اتصال به ویس چت
+                await self._connect_to_voice_chat(client, call, chat['chat_id'], session_name, media_source)
+                
+                media_source = media_source or MEDIA_SOURCE
+                join_time = join_time or time.time()
+                self.sessions.join(entry, chat['chat_id'], chat['title'], media_source, join_time, username)
+                await self.storage.save_call(session_name, chat['chat_id'], chat['title'], username, join_time, media_source)
+                self.join_latency.add("standby" if warm else "cold", time.perf_counter() - started)
+                return f"✅ {self.identities.display_name(session_name)} به ویس چت پیوست", True, None
+        
+        except VoiceJoinError as e:
+            # خطای چت/peer پیچیده در VoiceJoinError هم یعنی چت کش شده دیگر معتبر نیست
+            if join_retry.is_stale_peer(e):
+                await self.peers.invalidate(session_name, username)
+            return f"❌ {self.identities.display_name(session_name)}: {e}", False, e
+        
+        except Exception as e:
+            if join_retry.is_bug(e):
+                raise
+            # چت کش شده ممکن است دیگر معتبر نباشد
+            await self.peers.invalidate(session_name, username)
+            error_msg = str(e)
+            print(f"❌ خطا برای {session_name}: {error_msg}")
+            return f"❌ {session_name}: {error_msg}", False, e
+    
     def extract_username_from_link(self, link: str) -> Optional[str]:
         """استخراج username از لینک ویس چت"""
         patterns = [
@@ -301,149 +2656,873 @@ class SessionManager:
         
         return None
     
-    async def _connect_to_voice_chat(self, client: Client, call: PyTgCalls, chat_id: int, session_name: str) -> bool:
-        """اتصال واقعی به ویس چت با PyTgCalls"""
+    async def _connect_to_voice_chat(self, client: Client, call: "PyTgCalls", chat_id: int, session_name: str, media_source: Optional[str] = None):
+        """اتصال واقعی به ویس چت با PyTgCalls؛ فقط خطاهای گذرا با backoff تکرار می‌شوند"""
+        # وقتی چند اکانت قبلی به ویس چت نرسیده‌اند، این اکانت اصلاً تلاش نمی‌کند
+        reason = await breakers.admit(chat_id)
+        if reason is not None:
+            metrics.inc("bot_join_failures_total", {"kind": "circuit_open"})
+            raise VoiceJoinError(f"⛔ تلاش نشد؛ ویس چت در دسترس نیست ({reason})")
+        
         try:
-            # بررسی وضعیت ویس چت
+            # وضعیت ویس چت یک بار برای همه اکانت‌ها بررسی می‌شود
+            if await self.group_calls.lookup(session_name, client, chat_id) is False:
+                metrics.inc("bot_join_failures_total", {"kind": "chat"})
+                breakers.on_failure(chat_id, "ویس چت فعال نیست")
+                raise VoiceChatClosed("ویس چت فعال نیست")
+            
+            for attempt in range(join_retry.retries + 1):
+                try:
+                    async with metrics.track("join_group_call"):
+                        await limiter.call(
+                            session_name,
+                            call.join_group_call,
+                            chat_id,
+                            build_media_stream(media_source)
+                        )
+                    breakers.on_success(chat_id)
+                    self.group_calls.set(chat_id, True)
+                    print(f"✅ {session_name} با موفقیت به ویس چت پیوست")
+                    return
+                
+                except Exception as e:
+                    if join_retry.is_bug(e):
+                        # تلاش آزمایشی مدار آزاد می‌شود و خطا به بالا می‌رود
+                        breakers.on_failure(chat_id, describe_error(e), chat_wide=False)
+                        raise
+                    kind = join_retry.classify(e)
+                    if kind == "joined":
+                        breakers.on_success(chat_id)
+                        print(f"ℹ️ {session_name} از قبل در ویس چت بود")
+                        return
+                    
+                    metrics.inc("bot_join_failures_total", {"kind": kind})
+                    print(f"❌ خطا در اتصال {session_name} به ویس چت ({kind}): {describe_error(e)}")
+                    if kind != "transient" or attempt == join_retry.retries:
+                        breakers.on_failure(chat_id, describe_error(e), chat_wide=kind == "chat")
+                        raise VoiceJoinError(describe_error(e)) from e
+                    
+                    delay = join_retry.delay(attempt)
+                    metrics.inc("bot_join_retries_total")
+                    print(f"🔁 {session_name}: تلاش دوباره بعد از {delay:.1f} ثانیه")
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            # لغو کار نباید تلاش آزمایشی مدار را برای همیشه نگه دارد
+            breakers.on_failure(chat_id, "لغو شد", chat_wide=False)
+            raise
+    
+    async def _leave_voice_chat(self, session_name: str, chat_id: Optional[int] = None, forget: bool = True) -> bool:
+        """خروج از ویس چت یک چت یا (بدون chat_id) همه چت‌ها؛ با forget=False ویس چت‌ها در دیتابیس برای ری‌استارت بعدی می‌مانند"""
+        async with self.locks.hold(session_name):
             try:
-                group_call = await call.get_group_call(chat_id)
-                if not group_call:
-                    # اگر ویس چت فعال نیست، یک ویس چت جدید ایجاد می‌کنیم
-                    await client.send_message(chat_id, "🎧 در حال شروع ویس چت...")
-                    await asyncio.sleep(2)
-            except:
-                pass
+                entry = self.sessions.joined.get(session_name)
+                if entry is None:
+                    return False
+                targets = [target for target in entry.chat_ids() if chat_id is None or target == chat_id]
+                if not targets:
+                    return False
+                
+                call = entry.call
+                for target in targets:
+                    # خروج از ویس چت
+                    if call.is_connected:
+                        async with metrics.track("leave_group_call"):
+                            await limiter.call(session_name, call.leave_group_call, target)
+                    
+                    # حذف از لیست کال‌های فعال
+                    self.sessions.leave(entry, target)
+                    if forget:
+                        await self.storage.delete_call(session_name, target)
+                
+                self.health.request_check()
+                print(f"✅ {session_name} از {len(targets)} ویس چت خارج شد")
+                return True
+            except Exception as e:
+                print(f"❌ خطا در خروج {session_name} از ویس چت: {e}")
+                return False
+    
+    @single_flight
+    async def leave_all_voice_chats(self, chat_id: Optional[int] = None):
+        """خروج همزمان از ویس چت یک چت یا (بدون chat_id) همه ویس چت‌ها با سقف همزمانی و تایم‌اوت برای هر سشن"""
+        results = []
+        successful = 0
+        joined = self.sessions.in_chat(chat_id) if chat_id is not None else list(self.sessions.joined)
+        progress = ProgressCounter(len(joined))
+        semaphore = asyncio.Semaphore(STOP_CONCURRENCY)
+        
+        async def leave_one(session_name):
+            success = False
+            async with semaphore:
+                try:
+                    success = await asyncio.wait_for(self._leave_voice_chat(session_name, chat_id), STOP_TIMEOUT)
+                    line = f"✅ {session_name} از ویس چت خارج شد" if success else f"❌ {session_name}: خطا در خروج"
+                except asyncio.TimeoutError:
+                    line = f"⏱ {session_name}: تایم‌اوت خروج ({STOP_TIMEOUT:.0f} ثانیه)"
+                except Exception as e:
+                    line = f"❌ {session_name}: {str(e)}"
+            progress.step(line, success)
+            return line, success
+        
+        for line, success in await asyncio.gather(*(leave_one(name) for name in joined)):
+            results.append(line)
+            successful += success
+        
+        return results, successful
+    
+    async def add_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = "", user_id: Optional[int] = None):
+        """افزودن سشن جدید به سیستم"""
+        try:
+            # ذخیره در دیتابیس
+            await self.storage.save_session(name, session_string, phone_number, first_name, username, user_id)
             
-            # اتصال به ویس چت با صدای خاموش
-            await call.join_group_call(
-                chat_id,
-                AudioPiped(
-                    "http://docs.evostream.com/sample_content/assets/sintel1m720p.mp4",
-                    HighQualityAudio(),
-                ),
-                invite_members=True
-            )
+            self.register_session(name, session_string, phone_number, first_name, username, user_id)
             
-            print(f"✅ {session_name} با موفقیت به ویس چت پیوست")
+            print(f"✅ سشن {name} به سیستم اضافه شد")
             return True
-            
         except Exception as e:
-            print(f"❌ خطا در اتصال {session_name} به ویس چت: {e}")
+            print(f"❌ خطا در اضافه کردن سشن {name}: {e}")
+            return False
+    
+    async def delete_session(self, name: str):
+        """حذف سشن از سیستم"""
+        try:
+            # حذف از دیتابیس
+            await self.storage.delete_session(name)
+            await self.forget_session(name)
             
-            # روش جایگزین: استفاده از دستورات تلگرام
-            try:
-                await client.send_message(chat_id, "/join")
-                await asyncio.sleep(2)
-                await client.send_message(chat_id, "🎧")
-                await asyncio.sleep(1)
-                
-                # تلاش مجدد برای اتصال
-                await call.join_group_call(
-                    chat_id,
-                    AudioPiped(
-                        "http://docs.evostream.com/sample_content/assets/sintel1m720p.mp4",
-                        HighQualityAudio(),
-                    ),
-                    invite_members=True
-                )
-                print(f"✅ {session_name} با روش جایگزین به ویس چت پیوست")
-                return True
-            except Exception as e2:
-                print(f"❌ روش جایگزین نیز برای {session_name} شکست خورد: {e2}")
-                return False
+            print(f"✅ سشن {name} حذف شد")
+            return True
+        except Exception as e:
+            print(f"❌ خطا در حذف سشن {name}: {e}")
+            return False
+    
+    def register_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = "", user_id: Optional[int] = None):
+        """ثبت سشن در حافظه؛ کلاینت در اولین استفاده ساخته می‌شود"""
+        self.sessions.add(name, session_string, phone_number)
+        self.identities.seed(name, first_name, username, user_id, time.time())
+        self.health.request_check()
+        # در حالت چند نودی، سشن جدید فوراً به نود صاحبش سپرده می‌شود
+        self.leases.request_check()
+    
+    def register_sessions(self, rows: List[List]):
+        """ثبت چند سشن در حافظه (ردیف‌ها به ترتیب آرگومان‌های register_session)"""
+        for row in rows:
+            self.register_session(*row)
+    
+    def rebalance(self):
+        """تقسیم دوباره سشن‌ها بین نودها بدون انتظار برای ضربان بعدی (مثلاً بعد از افزودن سشن روی نود کنترل)"""
+        self.leases.request_check()
+    
+    async def import_sessions(self, records: List[Dict]):
+        """بررسی همزمان سشن‌ها و ذخیره سشن‌های سالم در یک تراکنش"""
+        results, imported = await self._import_records(records)
+        return results, len(imported)
+    
+    async def _import_records(self, records: List[Dict]) -> Tuple[List[str], List[Dict]]:
+        results = []
+        fresh = []
+        for record in records:
+            if record["name"] in self.sessions:
+                results.append(f"⏭ {record['name']}: از قبل وجود دارد")
+            else:
+                fresh.append(record)
+        
+        # هر بررسی یک اتصال موقت است؛ تعداد اتصال‌های همزمان محدود می‌ماند
+        progress = ProgressCounter(len(fresh))
+        semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        
+        async def check_one(record):
+            async with semaphore:
+                line, ok = await self._validate_session(record)
+            progress.step(line, ok)
+            return line, ok
+        
+        checked = await asyncio.gather(*(check_one(record) for record in fresh))
+        imported = [record for record, (_, ok) in zip(fresh, checked) if ok]
+        results.extend(line for line, _ in checked)
+        
+        await self.storage.save_sessions(imported)
+        for record in imported:
+            self.register_session(**record)
+        print(f"📥 {len(imported)} سشن از فایل وارد شد")
+        return results, imported
+    
+    async def _validate_session(self, record: Dict) -> Tuple[str, bool]:
+        """اتصال موقت با سشن استرینگ و خواندن هویت اکانت؛ رکورد با اطلاعات هویت کامل می‌شود"""
+        name = record["name"]
+        client = Client(
+            name=f"import_{name}",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            session_string=record["session_string"],
+            in_memory=True
+        )
+        try:
+            await limiter.acquire(name)
+            async with metrics.track("import_validate"):
+                await asyncio.wait_for(client.start(), START_TIMEOUT)
+            me = client.me
+            record["first_name"] = me.first_name or ""
+            record["username"] = me.username or ""
+            record["user_id"] = me.id
+            return f"✅ {name} - {me.first_name or name}", True
+        except FloodWait as e:
+            limiter.on_flood(name, e.value)
+            return f"🔴 {name} - FloodWait: {e.value} ثانیه", False
+        except asyncio.TimeoutError:
+            return f"🔴 {name} - خطا: تایم‌اوت ({START_TIMEOUT:.0f} ثانیه)", False
+        except Exception as e:
+            return f"❌ {name}: {str(e)}", False
+        finally:
+            if client.is_connected:
+                try:
+                    await client.stop()
+                except Exception as e:
+                    print(f"❌ خطا در بستن اتصال موقت {name}: {e}")
+    
+    async def forget_session(self, name: str):
+        """حذف سشن از حافظه و قطع اتصال کلاینت آن"""
+        # حذف از رجیستری (و از ایندکس ویس چت‌ها)
+        entry = self.sessions.remove(name)
+        self.identities.forget(name)
+        self.peers.forget_session(name)
+        limiter.forget(name)
+        
+        # قطع اتصال کلاینت بعد از پایان عملیات در حال اجرای همین اکانت
+        if entry is not None:
+            async with self.locks.hold(name):
+                await self._evict(entry)
+    
+    def keep_shard(self, index: int, count: int):
+        """نگه داشتن فقط سشن‌های متعلق به این شارد"""
+        for name in [name for name in self.sessions if shard_index(name, count) != index]:
+            self.sessions.remove(name)
+            self.identities.forget(name)
+    
+    def call_stats(self) -> Dict[str, int]:
+        """شمارنده‌های کلاینت‌ها و کال‌ها برای صفحه وضعیت"""
+        live = self.sessions.live.values()
+        return {
+            "live_clients": len(self.sessions.live),
+            "connected_clients": sum(1 for entry in live if entry.client.is_connected),
+            "connected_calls": sum(1 for entry in live if entry.call.is_connected),
+            "active_calls": sum(len(members) for members in self.sessions.by_chat.values()),
+            # سقف کلاینت‌های زنده همین پروسه؛ coordinatorها آن را روی شاردها/نودها جمع می‌زنند
+            "capacity": MAX_LIVE_CLIENTS
+        }
+    
+    def chat_summary(self) -> List[Dict]:
+        """ویس چت‌های فعال با تعداد اکانت‌های هر کدام (از ایندکس chat_id)"""
+        summary = []
+        for chat_id, members in self.sessions.by_chat.items():
+            # اولین عضو، زودتر از بقیه وارد شده است
+            first = next(iter(members.values()))
+            summary.append({
+                "chat_id": chat_id,
+                "chat_title": first.chat_title,
+                "username": first.username,
+                "accounts": len(members),
+                "join_time": first.join_time,
+                "churn": churn_count(self.call_events.get(chat_id, {}))
+            })
+        return summary
+    
+    def snapshot(self) -> Dict:
+        """خلاصه قابل ارسال وضعیت کال‌ها (بدون اشیای کلاینت)"""
+        return {
+            "active_calls": {
+                name: [membership.call_info() for membership in entry.memberships()]
+                for name, entry in self.sessions.joined.items()
+            },
+            "stats": self.call_stats(),
+            # کلید JSON باید رشته باشد
+            "call_events": {str(chat_id): counts for chat_id, counts in self.call_events.items()},
+            "join_latency": self.join_latency.export()
+        }
+    
+    def join_latency_samples(self) -> Dict[str, List[float]]:
+        return self.join_latency.export()
+
+# ==================== شاردینگ چندپروسه‌ای ====================
+# عملیاتی که پروسه اصلی می‌تواند از پروسه‌های کاری درخواست کند
+SHARD_OPS = {
+    "start_all_clients", "stop_all_clients", "get_status", "join_voice_chat",
+    "leave_all_voice_chats", "register_session", "register_sessions", "forget_session", "shutdown", "resume_calls"
+}
+
+def shard_index(name: str, count: int) -> int:
+    """شارد ثابت هر سشن بر اساس نام آن"""
+    return zlib.crc32(name.encode()) % count
+
+def run_shard_worker(index: int, count: int, socket_path: str):
+    """نقطه ورود پروسه کاری؛ هر پروسه event loop و کلاینت‌های خودش را دارد"""
+    asyncio.run(_shard_worker_main(index, count, socket_path))
+
+async def _shard_worker_main(index: int, count: int, socket_path: str):
+    # خاموشی را پروسه اصلی هماهنگ می‌کند؛ SIGTERM نباید کال‌ها را نیمه‌کاره رها کند
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: None)
+    manager = session_manager
+    manager.keep_shard(index, count)
+    manager.start_idle_reaper()
+    manager.health.start()
+    # استخر آماده بین شاردها تقسیم می‌شود
+    manager.standby.size = min(-(-STANDBY_SIZE // count), MAX_LIVE_CLIENTS)
+    manager.standby.start()
+    manager.identities.start_background_refresh(manager.sessions.live)
+    await metrics.start(manager.call_stats, METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    print(f"🧩 شارد {index}: {len(manager.sessions)} سشن")
+    
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=2 ** 24)
+    writer.write(json.dumps({"shard": index}).encode() + b"\n")
+    await writer.drain()
+    
+    # رویدادهای پشت سر هم (مثلاً بسته شدن کال برای همه اکانت‌ها) در یک snapshot فرستاده می‌شوند
+    push_scheduled = False
+    
+    def push_snapshot():
+        nonlocal push_scheduled
+        push_scheduled = False
+        if not writer.is_closing():
+            writer.write(json.dumps({"id": None, "snapshot": manager.snapshot()}).encode() + b"\n")
+    
+    def schedule_push():
+        nonlocal push_scheduled
+        if not push_scheduled:
+            push_scheduled = True
+            asyncio.get_running_loop().call_soon(push_snapshot)
+    
+    manager.on_call_event = schedule_push
+    
+    async def handle(request: Dict):
+        response = {"id": request["id"]}
+        try:
+            if request["op"] not in SHARD_OPS:
+                raise ValueError(f"عملیات نامعتبر: {request['op']}")
+            result = getattr(manager, request["op"])(*request["args"])
+            if asyncio.iscoroutine(result):
+                result = await result
+            response["result"] = result
+        except Exception as e:
+            response["error"] = str(e)
+        response["snapshot"] = manager.snapshot()
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+    
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        task = asyncio.create_task(handle(json.loads(line)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    # پروسه اصلی بسته شده است
+    await manager.stop_all_clients()
+
+class ShardCoordinator:
+    """اجرای سشن‌ها در چند پروسه و ادغام نتایج به همان شکلی که هندلرها انتظار دارند"""
+    
+    def __init__(self, manager: SessionManager, count: int):
+        self.manager = manager
+        self.count = count
+        self.socket_path = os.path.join(tempfile.gettempdir(), f"bot-shards-{os.getpid()}.sock")
+        self.processes: List[multiprocessing.Process] = []
+        self.writers: Dict[int, asyncio.StreamWriter] = {}
+        self.pending: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self.snapshots: Dict[int, Dict] = {}
+        self.next_id = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.all_connected = asyncio.Event()
+        self.flights = SingleFlight()
+        self.stopping = False
+    
+    @property
+    def sessions(self) -> SessionRegistry:
+        return self.manager.sessions
+    
+    @property
+    def active_calls(self) -> Dict[str, List[Dict]]:
+        merged = {}
+        for snapshot in self.snapshots.values():
+            merged.update(snapshot["active_calls"])
+        return merged
+    
+    def chat_summary(self) -> List[Dict]:
+        chats: Dict[int, Dict] = {}
+        for calls in self.active_calls.values():
+            for info in calls:
+                chat = chats.setdefault(info["chat_id"], {
+                    "chat_id": info["chat_id"],
+                    "chat_title": info["chat_title"],
+                    "username": info["username"],
+                    "accounts": 0,
+                    "join_time": info["join_time"],
+                    "churn": 0
+                })
+                chat["accounts"] += 1
+                chat["join_time"] = min(chat["join_time"], info["join_time"])
+        for snapshot in self.snapshots.values():
+            for chat_id, counts in snapshot.get("call_events", {}).items():
+                if int(chat_id) in chats:
+                    chats[int(chat_id)]["churn"] += churn_count(counts)
+        return list(chats.values())
+    
+    def join_latency_samples(self) -> Dict[str, List[float]]:
+        merged: Dict[str, List[float]] = {}
+        for snapshot in self.snapshots.values():
+            for path, values in snapshot.get("join_latency", {}).items():
+                merged.setdefault(path, []).extend(values)
+        return merged
+    
+    def call_stats(self) -> Dict[str, int]:
+        totals = {"live_clients": 0, "connected_clients": 0, "connected_calls": 0, "active_calls": 0, "capacity": 0}
+        for snapshot in self.snapshots.values():
+            for key, value in snapshot["stats"].items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+    
+    async def start(self):
+        """اجرای پروسه‌های کاری و انتظار برای اتصال همه آن‌ها"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._on_worker, path=self.socket_path, limit=2 ** 24)
+        
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.count):
+            process = context.Process(target=run_shard_worker, args=(index, self.count, self.socket_path), daemon=True)
+            process.start()
+            self.processes.append(process)
+        
+        await asyncio.wait_for(self.all_connected.wait(), SHARD_START_TIMEOUT)
+        print(f"🧩 {self.count} پروسه کاری آماده است")
+    
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """بستن اتصال‌ها و پایان پروسه‌های کاری"""
+        self.stopping = True
+        # با بسته شدن اتصال، هر پروسه کاری کلاینت‌هایش را متوقف کرده و خارج می‌شود
+        for writer in list(self.writers.values()):
+            writer.close()
+        
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, process.join, timeout) for process in self.processes))
+        for process in self.processes:
+            if process.is_alive():
+                # پروسه‌های کاری SIGTERM را نادیده می‌گیرند
+                process.kill()
+        
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+    
+    async def _on_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        index = json.loads(await reader.readline())["shard"]
+        self.writers[index] = writer
+        if len(self.writers) == self.count:
+            self.all_connected.set()
+        
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            self.snapshots[index] = response["snapshot"]
+            _, future = self.pending.pop(response["id"], (None, None))
+            if future is None or future.done():
+                continue
+            if "error" in response:
+                future.set_exception(RuntimeError(f"شارد {index}: {response['error']}"))
+            else:
+                future.set_result(response["result"])
+        
+        # پروسه کاری از دست رفته است؛ درخواست‌های در انتظار آن شکست می‌خورند
+        if not self.stopping:
+            print(f"❌ اتصال شارد {index} قطع شد")
+        self.writers.pop(index, None)
+        for request_id, (shard, future) in list(self.pending.items()):
+            if shard == index:
+                del self.pending[request_id]
+                if not future.done():
+                    future.set_exception(RuntimeError(f"شارد {index} در دسترس نیست"))
+    
+    async def _request(self, index: int, op: str, *args):
+        writer = self.writers.get(index)
+        if writer is None:
+            raise RuntimeError(f"شارد {index} در دسترس نیست")
+        
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = (index, future)
+        writer.write(json.dumps({"id": self.next_id, "op": op, "args": list(args)}).encode() + b"\n")
+        await writer.drain()
+        return await future
+    
+    async def _broadcast(self, op: str, *args) -> List:
+        """اجرای یک عملیات روی همه شاردها؛ شارد خراب فقط خطای خودش را برمی‌گرداند"""
+        indexes = sorted(self.writers)
+        responses = await asyncio.gather(*(self._request(i, op, *args) for i in indexes), return_exceptions=True)
+        return list(zip(indexes, responses))
+    
+    @single_flight
+    async def start_all_clients(self):
+        results = []
+        for index, response in await self._broadcast("start_all_clients"):
+            if isinstance(response, Exception):
+                results.append({"name": f"shard-{index}", "status": "error", "info": f"🔴 {response}"})
+            else:
+                results.extend(response)
+        return results
+    
+    @single_flight
+    async def stop_all_clients(self):
+        results = []
+        for index, response in await self._broadcast("stop_all_clients"):
+            results.extend([f"❌ {response}"] if isinstance(response, Exception) else response)
+        return results
+    
+    async def shutdown(self, deadline: float) -> List[str]:
+        """خاموشی همزمان همه شاردها تا مهلت مشخص و سپس پایان پروسه‌های کاری"""
+        started = time.monotonic()
+        abandoned = []
+        try:
+            # هر شارد خودش مهلت را رعایت می‌کند؛ یک ثانیه برای رسیدن پاسخ‌ها
+            responses = await asyncio.wait_for(self._broadcast("shutdown", max(0.0, deadline - 1)), deadline)
+        except asyncio.TimeoutError:
+            responses = [(index, RuntimeError("timeout")) for index in sorted(self.writers)]
+        for index, response in responses:
+            abandoned.extend([f"shard-{index}"] if isinstance(response, Exception) else response)
+        
+        await self.stop(max(1.0, deadline - (time.monotonic() - started)))
+        return abandoned
+    
+    async def get_status(self, chat_id: Optional[int] = None):
+        status_list, active_count = [], 0
+        for index, response in await self._broadcast("get_status", chat_id):
+            if isinstance(response, Exception):
+                status_list.append(f"🔴 {response}")
+                continue
+            status_list.extend(response[0])
+            active_count += response[1]
+        return status_list, active_count
     
-    async def _leave_voice_chat(self, session_name: str) -> bool:
-        """خروج از ویس چت"""
-        try:
-            if session_name in self.active_calls:
-                call_data = self.active_calls[session_name]
-                call = call_data['call']
-                chat_id = call_data['chat_id']
-                
-                # خروج از ویس چت
-                if call.is_connected:
-                    await call.leave_group_call(chat_id)
-                
-                # حذف از لیست کال‌های فعال
-                del self.active_calls[session_name]
-                
-                print(f"✅ {session_name} از ویس چت خارج شد")
-                return True
-            
-            return False
-        except Exception as e:
-            print(f"❌ خطا در خروج {session_name} از ویس چت: {e}")
+    async def _merge_counted(self, op: str, *args):
+        results, successful = [], 0
+        for index, response in await self._broadcast(op, *args):
+            if isinstance(response, Exception):
+                results.append(f"❌ {response}")
+                continue
+            results.extend(response[0])
+            successful += response[1]
+        return results, successful
+    
+    @single_flight
+    async def join_voice_chat(self, voice_chat_link: str, media_source: Optional[str] = None):
+        if not self.manager.extract_username_from_link(voice_chat_link.strip()):
+            return ["❌ لینک ویس چت نامعتبر است"], 0
+        return await self._merge_counted("join_voice_chat", voice_chat_link, media_source)
+    
+    @single_flight
+    async def leave_all_voice_chats(self, chat_id: Optional[int] = None):
+        return await self._merge_counted("leave_all_voice_chats", chat_id)
+    
+    @single_flight
+    async def resume_calls(self):
+        return await self._merge_counted("resume_calls")
+    
+    async def add_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = "", user_id: Optional[int] = None):
+        if not await self.manager.add_session(name, session_string, phone_number, first_name, username, user_id):
             return False
+        await self._request(shard_index(name, self.count), "register_session", name, session_string, phone_number, first_name, username, user_id)
+        return True
     
-    async def leave_all_voice_chats(self):
-        """خروج از تمام ویس چت‌ها"""
-        results = []
-        successful = 0
+    async def import_sessions(self, records: List[Dict]):
+        """بررسی و ذخیره در پروسه اصلی؛ سشن‌های جدید یک‌جا به شارد خودشان فرستاده می‌شوند"""
+        results, imported = await self.manager._import_records(records)
         
-        for session_name in list(self.active_calls.keys()):
+        by_shard: Dict[int, List[List]] = {}
+        for r in imported:
+            by_shard.setdefault(shard_index(r["name"], self.count), []).append(
+                [r["name"], r["session_string"], r["phone_number"], r["first_name"], r["username"], r["user_id"]]
+            )
+        responses = await asyncio.gather(
+            *(self._request(index, "register_sessions", rows) for index, rows in by_shard.items()),
+            return_exceptions=True
+        )
+        results.extend(f"❌ {response}" for response in responses if isinstance(response, Exception))
+        return results, len(imported)
+    
+    async def delete_session(self, name: str):
+        if not await self.manager.delete_session(name):
+            return False
+        await self._request(shard_index(name, self.count), "forget_session", name)
+        return True
+
+class ClusterCoordinator(ShardCoordinator):
+    """فرستادن فرمان‌های ربات به همه نودها از راه دیتابیس مشترک؛ فقط روی نود کنترل ساخته می‌شود
+    
+    هر فرمان یک ردیف در commands و برای هر نود زنده یک ردیف در command_results دارد. هر نود
+    (از جمله خود نود کنترل) با CommandWorker سهم خودش را اجرا و نتیجه را ثبت می‌کند و ادغام
+    نتایج همان کد ShardCoordinator است. وضعیت نودها از ضربان آن‌ها در جدول nodes خوانده می‌شود.
+    """
+    
+    def __init__(self, manager: SessionManager):
+        super().__init__(manager, 0)
+        self.names: Set[str] = set()
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def sessions(self) -> Set[str]:
+        # رجیستری این نود فقط سهم خودش را دارد؛ هندلرها تعداد کل را می‌خواهند
+        return self.names
+    
+    async def start(self):
+        await self.refresh()
+        self.task = asyncio.create_task(self._loop())
+    
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+    
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.manager.leases.interval)
             try:
-                success = await self._leave_voice_chat(session_name)
-                if success:
-                    results.append(f"✅ {session_name} از ویس چت خارج شد")
-                    successful += 1
-                else:
-                    results.append(f"❌ {session_name}: خطا در خروج")
+                await self.refresh()
             except Exception as e:
-                results.append(f"❌ {session_name}: {str(e)}")
-        
-        return results, successful
+                print(f"❌ خطا در خواندن وضعیت نودها: {e}")
     
-    def add_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = ""):
-        """افزودن سشن جدید به سیستم"""
+    async def refresh(self):
+        storage = self.manager.storage
+        self.names = set(await storage.session_names())
+        rows = await storage.node_snapshots(time.time() - self.manager.leases.ttl)
+        self.snapshots = {node: json.loads(snapshot) for node, snapshot in rows}
+    
+    async def _broadcast(self, op: str, *args) -> List:
+        """اجرای یک عملیات روی همه نودهای زنده؛ نودی که از کار بیفتد فقط خطای خودش را برمی‌گرداند"""
+        storage = self.manager.storage
+        leases = self.manager.leases
+        command_id = os.urandom(8).hex()
+        await storage.submit_command(command_id, op, json.dumps(list(args)), leases.nodes, time.time())
+        deadline = time.monotonic() + COMMAND_TIMEOUT
         try:
-            # ذخیره در دیتابیس
-            self.storage.save_session(name, session_string, phone_number, first_name, username)
-            
-            # ایجاد کلاینت جدید
-            client = Client(
-                name=name,
-                api_id=API_ID,
-                api_hash=API_HASH,
-                session_string=session_string,
-                in_memory=True
-            )
-            self.clients.append(client)
-            
-            # ایجاد PyTgCalls جدید
-            call = PyTgCalls(client)
-            self.calls[name] = call
-            
-            print(f"✅ سشن {name} به سیستم اضافه شد")
-            return True
-        except Exception as e:
-            print(f"❌ خطا در اضافه کردن سشن {name}: {e}")
+            while True:
+                await asyncio.sleep(COMMAND_POLL)
+                rows = await storage.command_results(command_id)
+                if all(result is not None or node not in leases.nodes for node, result in rows):
+                    break
+                if time.monotonic() > deadline:
+                    break
+        finally:
+            await storage.delete_command(command_id)
+        
+        responses = []
+        for node, result in sorted(rows):
+            if result is None:
+                responses.append((node, RuntimeError(f"نود {node} پاسخ نداد")))
+                continue
+            response = json.loads(result)
+            self.snapshots[node] = response["snapshot"]
+            if "error" in response:
+                responses.append((node, RuntimeError(f"نود {node}: {response['error']}")))
+            else:
+                responses.append((node, response["result"]))
+        return responses
+    
+    async def shutdown(self, deadline: float) -> List[str]:
+        """فقط سشن‌های همین نود متوقف می‌شوند؛ نودهای دیگر کنترل را می‌گیرند"""
+        await self.stop()
+        return await self.manager.shutdown(deadline)
+    
+    async def add_session(self, name: str, session_string: str, phone_number: str = "", first_name: str = "", username: str = "", user_id: Optional[int] = None):
+        if not await self.manager.add_session(name, session_string, phone_number, first_name, username, user_id):
             return False
+        self.names.add(name)
+        await self._broadcast("rebalance")
+        return True
     
-    def delete_session(self, name: str):
-        """حذف سشن از سیستم"""
+    async def import_sessions(self, records: List[Dict]):
+        # رجیستری نود کنترل فقط سهم خودش را دارد؛ تکراری بودن با همه سشن‌ها سنجیده می‌شود
+        results = [f"⏭ {record['name']}: از قبل وجود دارد" for record in records if record["name"] in self.names]
+        checked, imported = await self.manager._import_records([record for record in records if record["name"] not in self.names])
+        results.extend(checked)
+        self.names.update(record["name"] for record in imported)
+        if imported:
+            await self._broadcast("rebalance")
+        return results, len(imported)
+    
+    async def delete_session(self, name: str):
+        if not await self.manager.delete_session(name):
+            return False
+        self.names.discard(name)
+        await self._broadcast("forget_session", name)
+        return True
+
+# ==================== کارهای پس‌زمینه ====================
+# کار در حال اجرا در context فعلی؛ عملیات‌های SessionManager پیشرفت را روی آن ثبت می‌کنند
+current_job: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+JOB_STATUS_LABELS = {
+    "queued": "⏳ در صف",
+    "running": "🔄 در حال اجرا",
+    "done": "✅ انجام شد",
+    "failed": "❌ خطا",
+    "cancelled": "🚫 لغو شد"
+}
+
+def report_progress(done: int, total: int, line: Optional[str] = None, ok: Optional[bool] = None):
+    """ثبت پیشرفت (و نتیجه هر سشن) روی کار فعلی، اگر عملیات داخل یک کار اجرا می‌شود"""
+    job = current_job.get()
+    if job is None:
+        return
+    job.done, job.total = done, total
+    if ok is not None:
+        if ok:
+            job.succeeded += 1
+        else:
+            job.failed += 1
+    if line is not None:
+        job.lines.append(line)
+
+class ProgressCounter:
+    """شمارنده پیشرفت یک عملیات گروهی"""
+    
+    def __init__(self, total: int):
+        self.done = 0
+        self.total = total
+        report_progress(0, total)
+    
+    def step(self, line: Optional[str] = None, ok: Optional[bool] = None):
+        self.done += 1
+        report_progress(self.done, self.total, line, ok)
+
+class Job:
+    """یک عملیات طولانی که در پس‌زمینه اجرا می‌شود"""
+    
+    def __init__(self, job_id: int, kind: str, title: str, key: Optional[Tuple] = None):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        # کلید یکسان یعنی همان عملیات؛ درخواست تکراری به همین کار متصل می‌شود
+        self.key = key
+        # callbackهای پایان کار، یکی برای هر درخواست‌دهنده
+        self.callbacks: List[Callable] = []
+        self.status = "queued"
+        self.done = 0
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        # نتیجه هر سشن به ترتیب پایان
+        self.lines: List[str] = []
+        self.result = None
+        self.error: Optional[str] = None
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # شناسه کاری که این کار به اجرای آن متصل شده (0 یعنی اجرای بیرون از صف کارها)
+        self.attached_to: Optional[int] = None
+    
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+    
+    def describe(self) -> str:
+        progress = f" {self.done}/{self.total}" if self.total else ""
+        return f"#{self.id} {self.title} - {JOB_STATUS_LABELS[self.status]}{progress} ({self.elapsed:.0f} ثانیه)"
+
+class JobManager:
+    """صف کارهای پس‌زمینه با شناسه، پیشرفت، لغو و سقف همزمانی"""
+    
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, history: int = JOB_HISTORY):
+        self.jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.history = history
+        self.next_id = 0
+    
+    def submit(self, kind: str, title: str, func: Callable, on_done: Optional[Callable] = None,
+               key: Optional[Tuple] = None) -> Job:
+        """ثبت کار جدید؛ بلافاصله برمی‌گردد و کار در پس‌زمینه اجرا می‌شود
+        
+        اگر کار فعالی با همین key باشد، کار تازه‌ای در صف نمی‌رود و همان کار برگردانده می‌شود؛
+        وگرنه با JOB_CONCURRENCY=1 درخواست تکراری پشت سمافور می‌ماند و عملیات را دوباره اجرا می‌کرد
+        """
+        job = self.find(key) if key is not None else None
+        if job is not None:
+            metrics.inc("bot_single_flight_joined_total", {"op": kind})
+            print(f"🔁 کار #{job.id} ({job.title}) در حال اجراست؛ درخواست تکراری به همان کار متصل شد")
+        else:
+            self.next_id += 1
+            job = Job(self.next_id, kind, title, key)
+            self.jobs[job.id] = job
+            job.task = asyncio.create_task(self._run(job, func))
+            self._trim()
+        if on_done is not None:
+            job.callbacks.append(on_done)
+        return job
+    
+    def find(self, key: Tuple) -> Optional[Job]:
+        """کار فعال با همین کلید"""
+        for job in self.jobs.values():
+            if job.key == key and not job.finished:
+                return job
+        return None
+    
+    async def _run(self, job: Job, func: Callable):
         try:
-            # حذف از دیتابیس
-            self.storage.delete_session(name)
-            
-            # حذف از لیست کلاینت‌ها
-            self.clients = [client for client in self.clients if client.name != name]
-            
-            # حذف از لیست کال‌ها
-            if name in self.calls:
-                del self.calls[name]
-            
-            # خروج از ویس چت اگر فعال است
-            if name in self.active_calls:
-                del self.active_calls[name]
-            
-            print(f"✅ سشن {name} حذف شد")
-            return True
+            async with self.semaphore:
+                job.status = "running"
+                job.started_at = time.monotonic()
+                current_job.set(job)
+                job.result = await func()
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
         except Exception as e:
-            print(f"❌ خطا در حذف سشن {name}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            print(f"❌ کار #{job.id} ({job.title}) شکست خورد: {e}")
+        finally:
+            job.finished_at = time.monotonic()
+        
+        for on_done in job.callbacks:
+            try:
+                await on_done(job)
+            except Exception as e:
+                print(f"❌ خطا در گزارش کار #{job.id}: {e}")
+    
+    def cancel(self, job_id: int) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
             return False
+        job.task.cancel()
+        return True
+    
+    def active(self) -> List[Job]:
+        return [job for job in self.jobs.values() if not job.finished]
+    
+    def _trim(self):
+        """نگه داشتن فقط JOB_HISTORY کار تمام شده آخر"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
 
 # ==================== ایجاد نمونه‌ها ====================
-session_manager = SessionManager()
+with boot.phase("بارگذاری سشن‌ها از دیتابیس"):
+    session_manager = SessionManager()
+jobs = JobManager()
+# هندلرها عملیات را از fleet می‌خواهند؛ در حالت چندپروسه‌ای در main() با ShardCoordinator جایگزین می‌شود
+fleet = session_manager
+# بعد از آماده شدن بخش ویس چت در پس‌زمینه set می‌شود
+fleet_ready = asyncio.Event()
 
 # ==================== کیبوردها ====================
 main_keyboard = ReplyKeyboardMarkup(
@@ -451,7 +3530,8 @@ main_keyboard = ReplyKeyboardMarkup(
         [KeyboardButton("🔧 ساخت سشن جدید"), KeyboardButton("📋 لیست سشن‌ها")],
         [KeyboardButton("🔄 راه‌اندازی اکانت‌ها"), KeyboardButton("⏹ توقف اکانت‌ها")],
         [KeyboardButton("🎧 ورود به ویس چت"), KeyboardButton("🔇 خروج از ویس چت")],
-        [KeyboardButton("📊 وضعیت ربات"), KeyboardButton("🗑️ حذف سشن")]
+        [KeyboardButton("📊 وضعیت ربات"), KeyboardButton("🗑️ حذف سشن")],
+        [KeyboardButton("📌 وضعیت کارها")]
     ],
     resize_keyboard=True
 )
@@ -467,6 +3547,95 @@ app = Client("main_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 def is_owner(message: Message):
     return message.from_user.id == OWNER_ID
 
+def message_length(text: str) -> int:
+    """طول متن به واحد UTF-16 که تلگرام با آن محدودیت پیام را می‌سنجد"""
+    return len(text.encode("utf-16-le")) // 2
+
+class ProgressReporter:
+    """نمایش زنده پیشرفت یک کار در پیام وضعیت؛ حداکثر یک ویرایش در هر STATUS_EDIT_INTERVAL"""
+    
+    def __init__(self, status_msg: Message, formatter: Callable[[Job], str]):
+        self.status_msg = status_msg
+        self.formatter = formatter
+        self.job: Optional[Job] = None
+        self.last_text = status_msg.text
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self, job: Job):
+        self.job = job
+        self.task = asyncio.create_task(self._loop())
+    
+    def render(self) -> str:
+        job = self.job
+        percent = f" ({job.done * 100 // job.total}%)" if job.total else ""
+        text = (
+            f"⏳ {job.title}\n\n"
+            f"• شناسه کار: #{job.id} - {JOB_STATUS_LABELS[job.status]}\n"
+            f"• پیشرفت: {job.done}/{job.total}{percent}\n"
+            f"• ✅ موفق: {job.succeeded} | ❌ خطا: {job.failed}\n"
+            f"• ⏱ زمان: {job.elapsed:.0f} ثانیه\n"
+        )
+        if job.attached_to:
+            text += f"• 🔁 متصل به کار #{job.attached_to}؛ پیشرفت زنده روی آن کار است\n"
+        if job.lines:
+            text += "\n" + "\n".join(job.lines[-5:]) + "\n"
+        text += f"\nلغو: /canceljob {job.id}"
+        return text
+    
+    async def _edit(self, text: str, **kwargs):
+        if text == self.last_text:
+            return
+        try:
+            await self.status_msg.edit_text(text, **kwargs)
+            self.last_text = text
+        except Exception as e:
+            print(f"❌ خطا در ویرایش پیام وضعیت: {e}")
+    
+    async def _loop(self):
+        while True:
+            await self._edit(self.render())
+            await asyncio.sleep(STATUS_EDIT_INTERVAL)
+    
+    async def finish(self, job: Job):
+        """callback پایان کار: گزارش نهایی در پیام و در صورت طولانی بودن به صورت فایل"""
+        self.task.cancel()
+        if job.status == "done":
+            text = self.formatter(job)
+        else:
+            text = f"⚠️ {job.describe()}"
+            if job.error:
+                text += f"\n{job.error}"
+        
+        if message_length(text) <= MESSAGE_LIMIT:
+            await self._edit(text, reply_markup=main_keyboard)
+            return
+        
+        # فقط ابتدای گزارش در پیام؛ گزارش کامل به صورت فایل
+        head = text[:MESSAGE_LIMIT // 2].rsplit("\n", 1)[0]
+        await self._edit(f"{head}\n\n📎 گزارش کامل در فایل پیوست", reply_markup=main_keyboard)
+        document = io.BytesIO(text.encode("utf-8"))
+        document.name = f"job-{job.id}-{job.kind}.txt"
+        await self.status_msg.reply_document(document, caption=f"📄 گزارش کامل کار #{job.id}")
+
+async def submit_job(message: Message, kind: str, title: str, func: Callable, formatter: Callable[[Job], str],
+                     key: Optional[Tuple] = None) -> Optional[Job]:
+    """ثبت کار پس‌زمینه؛ پیام وضعیت تا پایان کار با پیشرفت زنده ویرایش می‌شود
+    
+    با key، درخواست تکراری به کار فعال همان عملیات متصل می‌شود و پیشرفت همان کار را نشان می‌دهد
+    """
+    if not fleet_ready.is_set():
+        await message.reply_text(
+            "⏳ بخش ویس چت هنوز در حال راه‌اندازی است؛ چند ثانیه دیگر دوباره تلاش کنید.",
+            reply_markup=main_keyboard
+        )
+        return None
+    
+    status_msg = await message.reply_text(f"⏳ {title}...")
+    reporter = ProgressReporter(status_msg, formatter)
+    job = jobs.submit(kind, title, func, reporter.finish, key)
+    reporter.start(job)
+    return job
+
 # ==================== دستورات اصلی ====================
 @app.on_message(filters.command("start"))
 async def start_command(client, message: Message):
@@ -483,10 +3652,12 @@ async def start_command(client, message: Message):
         "• مدیریت کامل اکانت‌ها\n\n"
         "🔧 **امکانات:**\n"
         "• ساخت سشن جدید\n"
-        • مدیریت اکانت‌ها\n"
+        "• مدیریت اکانت‌ها\n"
         "• ورود واقعی به ویس چت\n"
         "• نمایش وضعیت لحظه‌ای\n"
-        "• حذف سشن‌ها\n\n"
+        "• حذف سشن‌ها\n"
+        "• ورود و خروجی گروهی سشن‌ها: /import و /export\n"
+        "• هر اکانت همزمان در چند ویس چت: /calls و /leave\n\n"
         "از دکمه‌های زیر استفاده کنید:",
         reply_markup=main_keyboard
     )
@@ -512,7 +3683,7 @@ async def list_sessions_command(client, message: Message):
     if not is_owner(message):
         return
     
-    status_list, active_count = await session_manager.get_status()
+    status_list, active_count = await fleet.get_status()
     
     if not status_list:
         await message.reply_text("📭 هیچ سشنی یافت نشد.", reply_markup=main_keyboard)
@@ -520,7 +3691,7 @@ async def list_sessions_command(client, message: Message):
     
     text = f"📋 **لیست اکانت‌ها**\n\n"
     text += f"🟢 فعال: {active_count} | 🔴 غیرفعال: {len(status_list) - active_count}\n"
-    text += f"🎧 در ویس چت: {len(session_manager.active_calls)}\n\n"
+    text += f"🎧 در ویس چت: {fleet.call_stats()['active_calls']}\n\n"
     
     for i, status in enumerate(status_list[:15], 1):
         text += f"{i}. {status}\n"
@@ -536,29 +3707,35 @@ async def start_clients_command(client, message: Message):
     if not is_owner(message):
         return
     
-    if not session_manager.clients:
+    if not fleet.sessions:
         await message.reply_text("❌ هیچ سشنی برای راه‌اندازی وجود ندارد.", reply_markup=main_keyboard)
         return
     
-    status_msg = await message.reply_text("🔄 در حال راه‌اندازی اکانت‌ها و ویس چت...")
-    
-    results = await session_manager.start_all_clients()
-    
+    await submit_job(message, "start", "راه‌اندازی اکانت‌ها و ویس چت", fleet.start_all_clients, format_start_report, ("start",))
+
+def format_start_report(job: Job) -> str:
+    results = job.result
+    elapsed = job.elapsed
     success_count = sum(1 for r in results if r["status"] == "success")
+    deferred_count = sum(1 for r in results if r["status"] == "deferred")
+    started = len(results) - deferred_count
+    throughput = started / elapsed if elapsed > 0 else float(started)
     
     text = f"✅ **راه‌اندازی کامل شد**\n\n"
     text += f"• 🟢 موفق: {success_count}\n"
-    text += f"• ❌ خطا: {len(results) - success_count}\n"
+    text += f"• ❌ خطا: {started - success_count}\n"
+    if deferred_count:
+        text += f"• ⏸ بیش از سقف کلاینت زنده (وصل نشد): {deferred_count}\n"
     text += f"• 📊 کل: {len(results)}\n"
-    text += f"• 🎧 ویس چت فعال: {len(session_manager.calls)}\n\n"
+    text += f"• 🎧 ویس چت فعال: {fleet.call_stats()['connected_calls']}\n"
+    text += f"• ⚡ سرعت: {throughput:.1f} سشن/ثانیه ({elapsed:.1f} ثانیه، همزمانی {START_CONCURRENCY})\n\n"
     
-    for result in results[:10]:
+    for result in results:
+        if result["status"] == "deferred":
+            continue
         text += f"• {result['info']}\n"
     
-    if len(results) > 10:
-        text += f"\n... و {len(results) - 10} اکانت دیگر"
-    
-    await status_msg.edit_text(text, reply_markup=main_keyboard)
+    return text
 
 # ==================== توقف اکانت‌ها ====================
 @app.on_message(filters.regex("^⏹ توقف اکانت‌ها$"))
@@ -566,22 +3743,19 @@ async def stop_clients_command(client, message: Message):
     if not is_owner(message):
         return
     
-    if not session_manager.clients:
+    if not fleet.sessions:
         await message.reply_text("❌ هیچ سشنی برای توقف وجود ندارد.", reply_markup=main_keyboard)
         return
     
-    status_msg = await message.reply_text("⏹ در حال توقف اکانت‌ها و ویس چت...")
-    
-    results = await session_manager.stop_all_clients()
-    
+    await submit_job(message, "stop", "توقف اکانت‌ها و ویس چت", fleet.stop_all_clients, format_stop_report, ("stop",))
+
+def format_stop_report(job: Job) -> str:
+    results = job.result
     text = "⏹️ **نتایج توقف اکانت‌ها**\n\n"
-    for result in results[:15]:
+    for result in results:
         text += f"• {result}\n"
     
-    if len(results) > 15:
-        text += f"\n... و {len(results) - 15} نتیجه دیگر"
-    
-    await status_msg.edit_text(text, reply_markup=main_keyboard)
+    return text
 
 # ==================== ورود به ویس چت ====================
 @app.on_message(filters.regex("^🎧 ورود به ویس چت$"))
@@ -596,6 +3770,9 @@ async def join_voice_chat_command(client, message: Message):
         "• مثال: https://t.me/fazayimaishat?videochat\n"
         "• یا: t.me/fazayimaishat?voicechat\n"
         "• یا: @fazayimaishat\n\n"
+        "🔊 **منبع صدا (اختیاری، بعد از لینک):**\n"
+        "• `silence` (پیش‌فرض)، مسیر فایل .raw یا لینک/فایل صوتی\n"
+        "• مثال: `@fazayimaishat /data/music.mp3`\n\n"
         "⚠️ **توجه:**\n"
         "• اکانت‌ها باید عضو گروه باشند\n"
         "• ویس چت باید فعال باشد\n"
@@ -604,25 +3781,237 @@ async def join_voice_chat_command(client, message: Message):
     )
 
 # ==================== خروج از ویس چت ====================
+def match_chat(chats: List[Dict], text: str) -> Optional[Dict]:
+    """پیدا کردن ویس چت فعال با شماره لیست، chat_id یا لینک/username"""
+    text = text.strip()
+    if text.isdigit() and 1 <= int(text) <= len(chats):
+        return chats[int(text) - 1]
+    if text.lstrip("-").isdigit():
+        return next((chat for chat in chats if chat["chat_id"] == int(text)), None)
+    username = session_manager.extract_username_from_link(text)
+    if username:
+        return next((chat for chat in chats if (chat.get("username") or "").lower() == username.lower()), None)
+    return None
+
+def format_chat_list(chats: List[Dict]) -> str:
+    return "\n".join(
+        f"{i}. {chat['chat_title']} (`{chat['chat_id']}`) - {chat['accounts']} اکانت"
+        for i, chat in enumerate(chats, 1)
+    )
+
+async def submit_leave(message: Message, chat: Optional[Dict] = None):
+    if chat is None:
+        await submit_job(message, "leave", "خروج از ویس چت‌ها", fleet.leave_all_voice_chats, format_leave_report, ("leave", None))
+    else:
+        await submit_job(
+            message, "leave", f"خروج از ویس چت {chat['chat_title']}",
+            lambda: fleet.leave_all_voice_chats(chat["chat_id"]), format_leave_report,
+            ("leave", chat["chat_id"])
+        )
+
 @app.on_message(filters.regex("^🔇 خروج از ویس چت$"))
 async def leave_voice_chat_command(client, message: Message):
     if not is_owner(message):
         return
     
-    status_msg = await message.reply_text("🔇 در حال خروج از ویس چت‌ها...")
+    chats = fleet.chat_summary()
+    if len(chats) <= 1:
+        await submit_leave(message)
+        return
+    
+    # اکانت‌ها در چند ویس چت هستند؛ خروج از یکی یا همه
+    user_state.set_state(message.from_user.id, "waiting_leave_chat")
+    await message.reply_text(
+        "🔇 **خروج از ویس چت**\n\n"
+        f"{format_chat_list(chats)}\n\n"
+        "شماره، لینک یا chat_id ویس چت را بفرستید، یا `همه` برای خروج از تمام ویس چت‌ها.",
+        reply_markup=cancel_keyboard
+    )
+
+@app.on_message(filters.command("leave"))
+async def leave_command(client, message: Message):
+    """/leave برای همه ویس چت‌ها یا /leave <لینک|chat_id> برای یک چت"""
+    if not is_owner(message):
+        return
+    
+    if len(message.command) < 2:
+        await submit_leave(message)
+        return
+    chat = match_chat(fleet.chat_summary(), message.command[1])
+    if chat is None:
+        await message.reply_text("❌ ویس چت فعالی با این مشخصات پیدا نشد.", reply_markup=main_keyboard)
+        return
+    await submit_leave(message, chat)
+
+async def handle_leave_chat(client, message, text, user_id):
+    user_state.clear_state(user_id)
+    if text in ("همه", "all"):
+        await submit_leave(message)
+        return
+    chat = match_chat(fleet.chat_summary(), text)
+    if chat is None:
+        await message.reply_text("❌ ویس چت فعالی با این مشخصات پیدا نشد.", reply_markup=main_keyboard)
+        return
+    await submit_leave(message, chat)
+
+@app.on_message(filters.command("calls"))
+async def calls_command(client, message: Message):
+    """/calls فهرست ویس چت‌های فعال؛ /calls <شماره|لینک|chat_id> اکانت‌های یک ویس چت"""
+    if not is_owner(message):
+        return
     
-    results, successful = await session_manager.leave_all_voice_chats()
+    chats = fleet.chat_summary()
+    if not chats:
+        await message.reply_text("📭 هیچ اکانتی در ویس چت نیست.", reply_markup=main_keyboard)
+        return
+    if len(message.command) < 2:
+        await message.reply_text(f"🎧 **ویس چت‌های فعال:**\n\n{format_chat_list(chats)}", reply_markup=main_keyboard)
+        return
     
-    result_text = "\n".join(results[:15])
-    if len(results) > 15:
-        result_text += f"\n... و {len(results) - 15} نتیجه دیگر"
+    chat = match_chat(chats, message.command[1])
+    if chat is None:
+        await message.reply_text("❌ ویس چت فعالی با این مشخصات پیدا نشد.", reply_markup=main_keyboard)
+        return
+    status_list, count = await fleet.get_status(chat["chat_id"])
+    text = f"🎧 **{chat['chat_title']}** - {count} اکانت\n\n"
+    text += "\n".join(f"{i}. {status}" for i, status in enumerate(status_list[:30], 1))
+    if len(status_list) > 30:
+        text += f"\n... و {len(status_list) - 30} اکانت دیگر"
+    await message.reply_text(text, reply_markup=main_keyboard)
+
+def format_leave_report(job: Job) -> str:
+    results, successful = job.result
+    result_text = "\n".join(results)
     
-    await status_msg.edit_text(
+    return (
         f"🔇 **نتایج خروج از ویس چت:**\n\n"
         f"✅ خارج شدند: {successful}\n"
-        f"📊 کل کال‌های فعال: {len(session_manager.active_calls)}\n\n"
-        f"{result_text}",
-        reply_markup=main_keyboard
+        f"📊 عضویت‌های باقی‌مانده در ویس چت‌ها: {fleet.call_stats()['active_calls']}\n\n"
+        f"{result_text}"
+    )
+
+# ==================== وضعیت کارها ====================
+@app.on_message(filters.regex("^📌 وضعیت کارها$") | filters.command("jobs"))
+async def jobs_status_command(client, message: Message):
+    if not is_owner(message):
+        return
+    
+    if not jobs.jobs:
+        await message.reply_text("📭 هیچ کاری ثبت نشده است.", reply_markup=main_keyboard)
+        return
+    
+    text = "📌 **وضعیت کارها**\n\n"
+    text += f"🔄 فعال: {len(jobs.active())} | 🔢 همزمانی: {JOB_CONCURRENCY}\n\n"
+    for job in reversed(list(jobs.jobs.values())[-10:]):
+        text += f"• {job.describe()}\n"
+    
+    if jobs.active():
+        text += "\nبرای لغو: /canceljob <شناسه>"
+    
+    await message.reply_text(text, reply_markup=main_keyboard)
+
+@app.on_message(filters.command("canceljob"))
+async def cancel_job_command(client, message: Message):
+    if not is_owner(message):
+        return
+    
+    if len(message.command) < 2 or not message.command[1].lstrip("#").isdigit():
+        await message.reply_text("❌ استفاده: /canceljob <شناسه کار>", reply_markup=main_keyboard)
+        return
+    
+    job_id = int(message.command[1].lstrip("#"))
+    if jobs.cancel(job_id):
+        await message.reply_text(f"🚫 درخواست لغو کار #{job_id} ثبت شد.", reply_markup=main_keyboard)
+    else:
+        await message.reply_text(f"❌ کار فعال با شناسه #{job_id} پیدا نشد.", reply_markup=main_keyboard)
+
+# ==================== ورود و خروجی گروهی سشن‌ها ====================
+@app.on_message(filters.command("export"))
+async def export_sessions_command(client, message: Message):
+    if not is_owner(message):
+        return
+    
+    fmt = message.command[1].lower() if len(message.command) > 1 else "json"
+    if fmt not in ("json", "csv"):
+        await message.reply_text("❌ استفاده: /export [json|csv]", reply_markup=main_keyboard)
+        return
+    
+    path = os.path.join(tempfile.gettempdir(), f"sessions-{int(time.time())}.{fmt}")
+    try:
+        count = await session_manager.storage.export_sessions(path, fmt)
+        await message.reply_document(
+            path,
+            caption=(
+                f"📤 خروجی {count} سشن ({fmt.upper()})\n"
+                "⚠️ این فایل دسترسی کامل به اکانت‌ها می‌دهد؛ آن را در جای امن نگه دارید."
+            ),
+            reply_markup=main_keyboard
+        )
+    except Exception as e:
+        await message.reply_text(f"❌ خطا در خروجی گرفتن: {str(e)}", reply_markup=main_keyboard)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+@app.on_message(filters.command("import"))
+async def import_sessions_command(client, message: Message):
+    if not is_owner(message):
+        return
+    
+    user_state.set_state(message.from_user.id, "waiting_import_file")
+    await message.reply_text(
+        "📥 **ورود گروهی سشن‌ها**\n\n"
+        "فایل JSON یا CSV سشن‌ها را ارسال کنید:\n"
+        "• JSON: لیستی از `{\"name\": ..., \"session_string\": ..., \"phone_number\": ...}`\n"
+        "• CSV: ستون‌های `name,session_string,phone_number`\n"
+        "• خروجی /export همین فرمت را دارد\n\n"
+        "هر سشن قبل از ذخیره با یک اتصال موقت بررسی می‌شود؛ سشن‌های موجود رد می‌شوند.",
+        reply_markup=cancel_keyboard
+    )
+
+@app.on_message(filters.document & filters.private)
+async def handle_import_document(client, message: Message):
+    if not is_owner(message):
+        return
+    
+    user_id = message.from_user.id
+    current_state = user_state.get_state(user_id)
+    if not current_state or current_state["state"] != "waiting_import_file":
+        return
+    
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply_text(
+            f"❌ حجم فایل بیش از {IMPORT_MAX_BYTES // 1024} کیلوبایت است.",
+            reply_markup=cancel_keyboard
+        )
+        return
+    
+    try:
+        data = await message.download(in_memory=True)
+        records, errors = parse_session_file(bytes(data.getbuffer()), document.file_name or "")
+    except ValueError as e:
+        await message.reply_text(f"❌ {e}\nفایل دیگری ارسال کنید:", reply_markup=cancel_keyboard)
+        return
+    
+    user_state.clear_state(user_id)
+    
+    async def import_all():
+        results, successful = await fleet.import_sessions(records)
+        return errors + results, successful
+    
+    await submit_job(message, "import", f"ورود {len(records)} سشن از فایل", import_all, format_import_report)
+
+def format_import_report(job: Job) -> str:
+    results, successful = job.result
+    result_text = "\n".join(results)
+    
+    return (
+        f"📥 **نتایج ورود گروهی سشن‌ها:**\n\n"
+        f"✅ وارد شد: {successful}\n"
+        f"❌ رد شد: {len(results) - successful}\n"
+        f"📊 کل سشن‌ها: {len(fleet.sessions)}\n\n"
+        f"{result_text}"
     )
 
 # ==================== وضعیت ربات ====================
@@ -631,27 +4020,42 @@ async def bot_status_command(client, message: Message):
     if not is_owner(message):
         return
     
-    status_list, active_count = await session_manager.get_status()
+    status_list, active_count = await fleet.get_status()
+    stats = fleet.call_stats()
     
     # اطلاعات دیتابیس
-    storage = SessionStorage()
-    db_sessions = storage.load_sessions()
+    db_count = await session_manager.storage.count_sessions()
     
     text = (
         "🤖 **وضعیت کامل ربات - Railway**\n\n"
-        f"• 📁 سشن‌های بارگذاری شده: {len(session_manager.clients)}\n"
-        f"• 💾 سشن‌ها در دیتابیس: {len(db_sessions)}\n"
+        f"• 📁 سشن‌های بارگذاری شده: {stats['live_clients']} / {stats['capacity']}\n"
+        f"• 💾 سشن‌ها در دیتابیس: {db_count}\n"
         f"• 🟢 اکانت‌های فعال: {active_count}\n"
-        f"• 🎧 PyTgCalls فعال: {len([c for c in session_manager.calls.values() if c.is_connected])}\n"
-        f"• 🔊 در ویس چت: {len(session_manager.active_calls)}\n"
+        f"• 🎧 PyTgCalls فعال: {stats['connected_calls']}\n"
+        f"• 🔊 در ویس چت: {stats['active_calls']}\n"
+        f"• 🧩 پروسه‌های کاری: {SHARD_WORKERS}\n"
         f"• 👤 کاربر فعال: {message.from_user.first_name}\n\n"
     )
     
-    if session_manager.active_calls:
+    checked_at = session_manager.health.checked_at
+    if checked_at:
+        text += f"🩺 آخرین بررسی سلامت: {int(time.time() - checked_at)} ثانیه پیش\n\n"
+    
+    leases = session_manager.leases
+    if leases.enabled:
+        text += f"🖧 نود `{leases.node_id}`: {len(leases.owned)} سشن اجاره شده، {len(leases.nodes)} نود زنده\n\n"
+    
+    latency = format_latency(fleet.join_latency_samples())
+    if latency:
+        text += f"⏱ **تأخیر ورود به ویس چت:**\n{latency}\n\n"
+    
+    chats = fleet.chat_summary()
+    if chats:
         text += "**کال‌های فعال:**\n"
-        for session_name, call_info in list(session_manager.active_calls.items())[:5]:
-            duration = int(asyncio.get_event_loop().time() - call_info['join_time'])
-            text += f"• {session_name} - {call_info['chat_title']} ({duration} ثانیه)\n"
+        for chat in chats[:5]:
+            duration = int(time.time() - chat['join_time'])
+            churn = f" | 🔻 {chat['churn']} خروج" if chat.get("churn") else ""
+            text += f"• {chat['chat_title']} - {chat['accounts']} اکانت ({duration} ثانیه){churn}\n"
     
     if status_list:
         text += "\n**آخرین وضعیت اکانت‌ها:**\n"
@@ -672,7 +4076,7 @@ async def delete_session_command(client, message: Message):
     
     user_state.set_state(message.from_user.id, "waiting_delete_session")
     
-    status_list, _ = await session_manager.get_status()
+    status_list, _ = await fleet.get_status()
     
     if not status_list:
         await message.reply_text("❌ هیچ سشنی برای حذف وجود ندارد.", reply_markup=main_keyboard)
@@ -733,6 +4137,12 @@ async def handle_text_messages(client, message: Message):
         
         elif state == "waiting_delete_session":
             await handle_delete_session(client, message, text, user_id)
+        
+        elif state == "waiting_leave_chat":
+            await handle_leave_chat(client, message, text, user_id)
+        
+        elif state == "waiting_import_file":
+            await message.reply_text("📎 لطفاً فایل JSON یا CSV سشن‌ها را به صورت فایل ارسال کنید.", reply_markup=cancel_keyboard)
     
     except Exception as e:
         await message.reply_text(f"❌ خطا: {str(e)}", reply_markup=main_keyboard)
@@ -749,8 +4159,7 @@ async def handle_session_name(client, message, text, user_id):
         return
     
     # بررسی وجود سشن در دیتابیس
-    storage = SessionStorage()
-    existing_session = storage.get_session(text)
+    existing_session = await session_manager.storage.get_session(text)
     if existing_session:
         await message.reply_text(
             "❌ سشنی با این نام وجود دارد.\nلطفاً نام دیگری انتخاب کنید:",
@@ -879,12 +4288,13 @@ async def finalize_session(client, message, user_id, data, client_obj):
         await client_obj.disconnect()
         
         # ذخیره سشن در سیستم
-        success = session_manager.add_session(
+        success = await fleet.add_session(
             name=data["session_name"],
             session_string=session_string,
             phone_number=data["phone_number"],
             first_name=me.first_name or "",
-            username=me.username or ""
+            username=me.username or "",
+            user_id=me.id
         )
         
         if success:
@@ -916,32 +4326,37 @@ async def finalize_session(client, message, user_id, data, client_obj):
 
 # ==================== هندلر ویس چت ====================
 async def handle_voice_chat_join(client, message, text, user_id):
-    status_msg = await message.reply_text("🎧 در حال اتصال به ویس چت...")
-    
-    # راه‌اندازی اکانت‌ها
-    await session_manager.start_all_clients()
+    # منبع صدا می‌تواند بعد از لینک آمده باشد
+    link, _, media_source = text.partition(" ")
     
-    results, successful = await session_manager.join_voice_chat(text)
-    
-    result_text = "\n".join(results[:15])
-    if len(results) > 15:
-        result_text += f"\n... و {len(results) - 15} نتیجه دیگر"
+    user_state.clear_state(user_id)
+    # هر اکانت در مسیر ورود خودش (فقط اگر آماده نباشد) راه‌اندازی می‌شود
+    await submit_job(
+        message, "join", "اتصال به ویس چت",
+        lambda: fleet.join_voice_chat(link, media_source.strip() or None),
+        format_join_report, ("join", link, media_source.strip() or None)
+    )
+
+def format_join_report(job: Job) -> str:
+    results, successful = job.result
+    result_text = "\n".join(results)
+    latency = format_latency(fleet.join_latency_samples())
+    latency_text = f"\n⏱ **تأخیر ورود (اخیر):**\n{latency}\n" if latency else ""
     
-    await status_msg.edit_text(
+    return (
         f"🎧 **نتایج ورود به ویس چت:**\n\n"
         f"✅ موفق: {successful}\n"
-        f"📊 کل: {len(session_manager.clients)}\n"
-        f"🔊 اتصال واقعی با PyTgCalls\n\n"
-        f"{result_text}",
-        reply_markup=main_keyboard
+        f"📊 کل: {len(fleet.sessions)}\n"
+        f"🔊 اتصال واقعی با PyTgCalls\n"
+        f"{latency_text}\n"
+        f"{result_text}"
     )
-    user_state.clear_state(user_id)
 
 # ==================== هندلر حذف سشن ====================
 async def handle_delete_session(client, message, text, user_id):
     """حذف سشن از سیستم"""
     try:
-        success = session_manager.delete_session(text)
+        success = await fleet.delete_session(text)
         
         if success:
             await message.reply_text(
@@ -963,42 +4378,189 @@ async def handle_delete_session(client, message, text, user_id):
     user_state.clear_state(user_id)
 
 # ==================== راه‌اندازی ====================
+async def report_resume(job: Job):
+    """ارسال نتیجه بازگشت خودکار به ویس چت‌ها برای مالک"""
+    if job.status != "done":
+        text = f"⚠️ {job.describe()}"
+    else:
+        results, successful = job.result
+        if not results:
+            return
+        text = (
+            f"🔁 **بازگشت به ویس چت‌ها بعد از ری‌استارت**\n\n"
+            f"✅ موفق: {successful}\n"
+            f"❌ خطا: {len(results) - successful}\n"
+            f"⏱ زمان: {job.elapsed:.1f} ثانیه"
+        )
+    await app.send_message(OWNER_ID, text)
+
+def import_voice_backend(loop: asyncio.AbstractEventLoop):
+    """ایمپورت pytgcalls در ترد جدا تا event loop ربات آزاد بماند"""
+    # pytgcalls هنگام ایمپورت get_event_loop را صدا می‌زند که در ترد غیر اصلی حلقه‌ای ندارد
+    asyncio.set_event_loop(loop)
+    try:
+        with boot.phase("ایمپورت pytgcalls (پس‌زمینه)"):
+            return load_voice_backend()
+    finally:
+        asyncio.set_event_loop(None)
+
 async def main():
     print("🚀 در حال راه‌اندازی ربات در Railway...")
     print(f"📊 محیط: {'Railway' if 'RAILWAY_ENVIRONMENT' in os.environ else 'Local'}")
+    print(f"⚙️ event loop: {'uvloop' if USE_UVLOOP else 'asyncio'}")
+    boot.mark("ایمپورت ماژول‌ها")
+    print(f"📁 {len(session_manager.sessions)} سشن از دیتابیس بارگذاری شد (حداکثر {MAX_LIVE_CLIENTS} کلاینت زنده)")
     
-    # اطلاعات دیتابیس
-    storage = SessionStorage()
-    sessions = storage.load_sessions()
-    print(f"📁 {len(sessions)} سشن از دیتابیس بارگذاری شد")
+    # ایمپورت pytgcalls هم‌زمان با اتصال ربات در یک ترد جدا انجام می‌شود
+    loop = asyncio.get_running_loop()
+    voice_import = loop.run_in_executor(None, import_voice_backend, loop)
     
-    await app.start()
+    # ربات اول وصل می‌شود تا /start بدون انتظار برای بخش ویس چت جواب بدهد
+    # با چند نود فقط نود کنترل به ربات وصل می‌شود؛ بقیه فقط سهم خودشان از سشن‌ها را اجرا می‌کنند
+    leases = session_manager.leases
+    if leases.enabled:
+        leases.on_control = set_control
+        with boot.phase("انتخاب نود کنترل"):
+            await leases.elect()
+    else:
+        with boot.phase("اتصال ربات"):
+            await app.start()
     
-    me = await app.get_me()
-    print(f"🤖 ربات: @{me.username} ({me.first_name})")
-    print(f"📊 {len(session_manager.clients)} سشن بارگذاری شد")
-    print(f"🎧 {len(session_manager.calls)} PyTgCalls آماده")
-    print(f"👤 مالک: {OWNER_ID}")
+    if app.is_connected:
+        print(f"🤖 ربات: @{app.me.username} ({app.me.first_name})")
+        print(f"👤 مالک: {OWNER_ID}")
+        boot.mark("آماده پاسخگویی")
+        print("✅ ربات در Railway آماده است! از /start استفاده کنید.")
+    else:
+        print(f"🖧 نود {leases.node_id} بدون ربات اجرا می‌شود؛ فرمان‌ها از نود کنترل می‌رسند")
     
-    print("✅ ربات در Railway آماده است! از /start استفاده کنید.")
+    # ارجاع به تسک نگه داشته می‌شود تا جمع‌آوری نشود و خطایش گم نشود
+    global voice_task
+    voice_task = asyncio.create_task(start_voice(voice_import))
+    voice_task.add_done_callback(report_voice_failure)
 
-if __name__ == "__main__":
-    print("=" * 50)
-    print("ربات مدیریت اکانت‌های تلگرام - نسخه Railway")
-    print("=" * 50)
-    
-    # بررسی کتابخانه‌ها
+def report_voice_failure(task: asyncio.Task):
+    """خطای راه‌اندازی ویس چت در لاگ ثبت می‌شود"""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        print(f"❌ خطا در راه‌اندازی بخش ویس چت: {describe_error(error)}")
+
+async def set_control(active: bool):
+    """با گرفتن اجاره کنترل ربات وصل می‌شود و فرمان‌ها به همه نودها می‌رود؛ با از دست دادنش قطع می‌شود"""
+    global fleet
+    if active:
+        coordinator = ClusterCoordinator(session_manager)
+        await coordinator.start()
+        try:
+            await app.start()
+        except Exception:
+            await coordinator.stop()
+            raise
+        fleet = coordinator
+    else:
+        coordinator, fleet = fleet, session_manager
+        await coordinator.stop()
+        if app.is_connected:
+            await app.stop()
+
+async def start_voice(voice_import: asyncio.Future):
+    """راه‌اندازی بخش ویس چت در پس‌زمینه بعد از اتصال ربات"""
+    global fleet
     try:
-        import pytgcalls
+        await voice_import
     except ImportError:
-        print("❌ کتابخانه pytgcalls نصب نیست.")
+        print("❌ کتابخانه pytgcalls نصب نیست؛ بخش ویس چت غیرفعال است.")
+        return
+    
+    # فایل سکوت مشترک یک بار ساخته می‌شود
+    if MEDIA_SOURCE == "silence":
+        with boot.phase("فایل سکوت"):
+            await asyncio.get_running_loop().run_in_executor(None, ensure_silence_file)
+    
+    if SHARD_WORKERS > 1 and session_manager.leases.enabled:
+        print("⚠️ با NODE_ID سشن‌های هر نود در همین پروسه اجرا می‌شوند؛ SHARD_WORKERS نادیده گرفته شد")
+    
+    if SHARD_WORKERS > 1 and not session_manager.leases.enabled:
+        # سشن‌ها در پروسه‌های کاری اجرا می‌شوند
+        with boot.phase("راه‌اندازی شاردها"):
+            coordinator = ShardCoordinator(session_manager, SHARD_WORKERS)
+            await coordinator.start()
+        fleet = coordinator
+    else:
+        # در حالت چند نودی فقط سهم این نود در رجیستری می‌ماند
+        with boot.phase("اجاره سشن‌ها"):
+            await session_manager.leases.start()
+        # آزادسازی کلاینت‌های بیکار، پایش سلامت و بروزرسانی هویت‌ها در پس‌زمینه
+        session_manager.start_idle_reaper()
+        session_manager.health.start()
+        session_manager.standby.start()
+        session_manager.identities.start_background_refresh(session_manager.sessions.live)
+    
+    # متریک‌ها از fleet خوانده می‌شوند (در حالت شارد، جمع همه پروسه‌ها)؛ هر نود متریک خودش را دارد
+    leases = session_manager.leases
+    with boot.phase("سرور متریک"):
+        await metrics.start(session_manager.call_stats if leases.enabled else fleet.call_stats)
+    
+    fleet_ready.set()
+    # بازگشت اکانت‌ها به ویس چت‌هایی که قبل از ری‌استارت در آن‌ها بودند؛ هر نود سهم خودش را برمی‌گرداند
+    if leases.enabled:
+        jobs.submit("resume", "بازگشت به ویس چت‌ها", session_manager.resume_calls, report_resume if leases.control else None)
+    else:
+        jobs.submit("resume", "بازگشت به ویس چت‌ها", fleet.resume_calls, report_resume)
+    boot.mark("آماده ویس چت")
+    print(boot.report())
+
+voice_task: Optional[asyncio.Task] = None
+shutting_down = False
+
+async def shutdown(signal_name: str):
+    """خاموشی با مهلت SHUTDOWN_DEADLINE و گزارش سشن‌هایی که رها شدند"""
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
     
+    print(f"⏹ {signal_name} دریافت شد؛ خاموشی با مهلت {SHUTDOWN_DEADLINE:.0f} ثانیه...")
+    started = time.monotonic()
+    # راه‌اندازی نیمه‌کاره ویس چت نباید هم‌زمان با خاموشی ادامه پیدا کند
+    if voice_task is not None and not voice_task.done():
+        voice_task.cancel()
     try:
-        import pyrogram
-    except ImportError:
-        print("❌ کتابخانه pyrogram نصب نیست.")
+        abandoned = await fleet.shutdown(SHUTDOWN_DEADLINE)
+    except Exception as e:
+        abandoned = []
+        print(f"❌ خطا در خاموشی: {e}")
+    
+    if abandoned:
+        report = f"⚠️ خاموشی: {len(abandoned)} سشن در مهلت متوقف نشد و رها شد:\n" + "\n".join(abandoned)
+    else:
+        report = f"✅ خاموشی: همه سشن‌ها در {time.monotonic() - started:.1f} ثانیه متوقف شدند"
+    print(report)
+    
+    # گزارش به مالک و توقف ربات فقط با زمان باقی‌مانده
+    remaining = max(1.0, SHUTDOWN_DEADLINE - (time.monotonic() - started))
+    # نودی که کنترل را ندارد ربات را اجرا نمی‌کند
+    if app.is_connected:
+        try:
+            await asyncio.wait_for(app.send_message(OWNER_ID, report[:MESSAGE_LIMIT]), remaining / 2)
+        except Exception as e:
+            print(f"❌ خطا در ارسال گزارش خاموشی: {e}")
+        try:
+            await asyncio.wait_for(app.stop(), remaining / 2)
+        except Exception as e:
+            print(f"❌ خطا در توقف ربات: {e}")
+    
+    asyncio.get_running_loop().stop()
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("ربات مدیریت اکانت‌های تلگرام - نسخه Railway")
+    print("=" * 50)
     
     loop = asyncio.get_event_loop()
+    loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(shutdown("SIGTERM")))
     try:
         loop.run_until_complete(main())
         print("🟢 ربات فعال و در حال اجرا...")